@@ -6,6 +6,18 @@ if [ -f .env ]; then
   export $(grep -v '^#' .env | xargs)
 fi
 
+# Rates for the driver pod: the rate file named by BILLING_RATES_PATH (use
+# /app/config/rates.json for the file baked into the image), otherwise the
+# RATE_<task> values from .env, which the image does not contain
+if [ -n "$BILLING_RATES_PATH" ]; then
+  RATES_ENV_CONFS=( --conf spark.kubernetes.driverEnv.BILLING_RATES_PATH="${BILLING_RATES_PATH}" )
+else
+  RATES_ENV_CONFS=()
+  for name in $(compgen -e | grep '^RATE_'); do
+    RATES_ENV_CONFS+=( --conf spark.kubernetes.driverEnv.${name}="${!name}" )
+  done
+fi
+
 # Choose master URL and deploy mode based on ENVIRONMENT
 if [ "$ENVIRONMENT" = "aws" ]; then
   MASTER_URL="$SPARK_MASTER_URL_AWS"
@@ -28,11 +40,7 @@ if [ "$ENVIRONMENT" = "aws" ]; then
     --conf spark.kubernetes.driverEnv.SPARK_MASTER_URL_AWS="${MASTER_URL}" \
     --conf spark.kubernetes.driverEnv.SPARK_EVENT_LOG_ENABLED="${SPARK_EVENT_LOG_ENABLED}" \
     --conf spark.kubernetes.driverEnv.SPARK_EVENT_LOG_DIR="${SPARK_EVENT_LOG_DIR}" \
-    --conf spark.kubernetes.driverEnv.RATE_login="${RATE_login}" \
-    --conf spark.kubernetes.driverEnv.RATE_getUserProfile="${RATE_getUserProfile}" \
-    --conf spark.kubernetes.driverEnv.RATE_createOrder="${RATE_createOrder}" \
-    --conf spark.kubernetes.driverEnv.RATE_updateInventory="${RATE_updateInventory}" \
-    --conf spark.kubernetes.driverEnv.RATE_deleteOrder="${RATE_deleteOrder}" \
+    "${RATES_ENV_CONFS[@]}" \
     --conf spark.hadoop.fs.s3a.access.key="${AWS_ACCESS_KEY_ID}" \
     --conf spark.hadoop.fs.s3a.secret.key="${AWS_SECRET_ACCESS_KEY}" \
     --conf spark.hadoop.fs.s3a.endpoint="s3.${AWS_REGION}.amazonaws.com" \
@@ -69,11 +77,7 @@ elif [ "$ENVIRONMENT" = "kub" ]; then
     --conf spark.kubernetes.driverEnv.SPARK_MASTER_URL_LOCAL_K8S="${MASTER_URL}" \
     --conf spark.kubernetes.driverEnv.SPARK_EVENT_LOG_ENABLED="${SPARK_EVENT_LOG_ENABLED}" \
     --conf spark.kubernetes.driverEnv.SPARK_EVENT_LOG_DIR="${SPARK_EVENT_LOG_DIR}" \
-    --conf spark.kubernetes.driverEnv.RATE_login="${RATE_login}" \
-    --conf spark.kubernetes.driverEnv.RATE_getUserProfile="${RATE_getUserProfile}" \
-    --conf spark.kubernetes.driverEnv.RATE_createOrder="${RATE_createOrder}" \
-    --conf spark.kubernetes.driverEnv.RATE_updateInventory="${RATE_updateInventory}" \
-    --conf spark.kubernetes.driverEnv.RATE_deleteOrder="${RATE_deleteOrder}" \
+    "${RATES_ENV_CONFS[@]}" \
   )
 
 else
@@ -124,4 +128,11 @@ spark-submit \
   ${DRIVER_CONF} \
   local:///app/src/mapreduce_billing/spark_job.py \
     --input-path ${INPUT_PATH} \
-    --output-dir "${OUTPUT_DIR}"
\ No newline at end of file
+    --output-dir "${OUTPUT_DIR}" \
+    --engine "${BILLING_ENGINE:-rdd}" \
+    ${BILLING_STATE_DIR:+--state-dir "${BILLING_STATE_DIR}"} \
+    ${BILLING_SKEW_SALTS:+--skew-salts "${BILLING_SKEW_SALTS}"} \
+    ${BILLING_CUBE:+--cube "${BILLING_CUBE}"} \
+    ${BILLING_ON_ERROR:+--on-error "${BILLING_ON_ERROR}"} \
+    ${BILLING_MAX_ERROR_RATE:+--max-error-rate "${BILLING_MAX_ERROR_RATE}"} \
+    ${BILLING_METRICS_PATH:+--metrics-path "${BILLING_METRICS_PATH}"}
\ No newline at end of file
@@ -0,0 +1,380 @@
+"""
+Benchmark harness comparing the aggregation engines on synthetic logs:
+- generates seeded logs at each scale point with utils.log_generator
+- runs each engine in a forked child process and records wall time,
+  records/sec and peak memory of the child's whole process tree (pool
+  workers and Spark's JVM included)
+- checks that every engine produces identical per-user totals
+- compares throughput against a previous results file to flag regressions
+
+Results are written as JSON so runs can be diffed or checked in CI.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from utils.log_generator import generate_logs
+
+RESULTS_VERSION = 1
+LOCAL_ENGINES = ("python", "numpy", "parallel")
+RSS_SAMPLE_SECONDS = 0.05
+
+
+def _run_python(input_path):
+    from mapreduce_billing.naive_aggregation import aggregate_naive
+    return aggregate_naive(input_path)
+
+
+def _run_numpy(input_path):
+    from mapreduce_billing.numpy_aggregation import aggregate_numpy
+    return aggregate_numpy(input_path)
+
+
+def _run_parallel(input_path):
+    from mapreduce_billing.parallel_aggregation import aggregate_parallel
+    return aggregate_parallel(input_path)
+
+
+def _run_mapreduce(input_path):
+    from mapreduce_billing.engines import aggregate_mapreduce
+    return aggregate_mapreduce(input_path)
+
+
+def _spark_session():
+    from pyspark.sql import SparkSession
+    return SparkSession.builder.master("local[*]").appName("billing-benchmark").getOrCreate()
+
+
+def _run_spark_rdd(input_path):
+    from mapreduce_billing.map_reduce import map_records, reduce_records
+    spark = _spark_session()
+    try:
+        pairs = map_records(spark.sparkContext.textFile(input_path))
+        totals = pairs.reduceByKey(reduce_records).collect()
+    finally:
+        spark.stop()
+    return {
+        user: {'total_duration_ms': duration, 'total_cost_micros': cost}
+        for user, (duration, cost) in totals
+    }
+
+
+def _run_spark_dataframe(input_path):
+    from mapreduce_billing.dataframe_aggregation import aggregate_df, parse_lines_df
+    from mapreduce_billing.naive_aggregation import load_rates
+    spark = _spark_session()
+    try:
+        totals = aggregate_df(parse_lines_df(spark.read.text(input_path)), load_rates()).collect()
+    finally:
+        spark.stop()
+    return {
+        row[0]: {'total_duration_ms': row[1], 'total_cost_micros': row[2]}
+        for row in totals
+    }
+
+
+ENGINES = {
+    "python": _run_python,
+    "numpy": _run_numpy,
+    "parallel": _run_parallel,
+    "mapreduce": _run_mapreduce,
+    "spark-rdd": _run_spark_rdd,
+    "spark-dataframe": _run_spark_dataframe,
+}
+
+
+def totals_digest(results):
+    """SHA-1 of the sorted per-user totals, to compare engines exactly."""
+    digest = hashlib.sha1()
+    for user in sorted(results):
+        metrics = results[user]
+        digest.update(
+            f"{user}:{metrics['total_duration_ms']}:{metrics['total_cost_micros']}\n".encode("utf-8")
+        )
+    return digest.hexdigest()
+
+
+def _peak_rss_mb(usage):
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(usage.ru_maxrss / scale, 1)
+
+
+def _memory_kb(pid):
+    # Proportional set size splits pages shared between forked processes,
+    # so a tree's sum is not inflated by copy-on-write pages
+    for path, field in ((f"/proc/{pid}/smaps_rollup", "Pss:"), (f"/proc/{pid}/status", "VmRSS:")):
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.startswith(field):
+                        return int(line.split()[1])
+        except OSError:
+            continue
+    return 0
+
+
+def tree_memory_kb(root):
+    """
+    Memory in kilobytes of ``root`` and all its descendants, from /proc.
+
+    Returns:
+        int | None: the total, or None where /proc is not available.
+    """
+    if not os.path.isdir("/proc"):
+        return None
+    children = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name in parentheses may contain spaces
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(name))
+    total, pending = 0, [root]
+    while pending:
+        pid = pending.pop()
+        total += _memory_kb(pid)
+        pending.extend(children.get(pid, ()))
+    return total
+
+
+class _TreeMemorySampler(threading.Thread):
+    """Samples tree_memory_kb of a process every RSS_SAMPLE_SECONDS, keeping the peak."""
+
+    def __init__(self, pid):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.peak_kb = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while True:
+            sample = tree_memory_kb(self.pid)
+            if sample is not None:
+                self.peak_kb = max(self.peak_kb or 0, sample)
+            if sample is None or self._stop_event.wait(RSS_SAMPLE_SECONDS):
+                return
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def run_engine(engine, input_path):
+    """
+    Run one engine in a forked child so its memory is measured in isolation.
+
+    ``peak_rss_mb`` is the sampled peak of the child's whole process tree
+    (see tree_memory_kb), so pool workers and a Spark JVM count towards it,
+    and at least the child's own peak RSS. Without /proc only the child is
+    measured, and ``rss_scope`` is "process" instead of "tree".
+
+    Returns:
+        dict: ``status`` ("ok" or "error"), ``wall_seconds``, ``peak_rss_mb``,
+            ``rss_scope`` and, on success, ``users`` and ``digest`` (see
+            totals_digest); on failure, ``error``.
+    """
+    read_fd, write_fd = os.pipe()
+    started = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            results = ENGINES[engine](input_path)
+            payload = {"status": "ok", "users": len(results), "digest": totals_digest(results)}
+        except Exception as e:
+            payload = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+        with os.fdopen(write_fd, 'w') as f:
+            json.dump(payload, f)
+        os._exit(0)
+
+    os.close(write_fd)
+    sampler = _TreeMemorySampler(pid)
+    sampler.start()
+    with os.fdopen(read_fd) as f:
+        raw = f.read()
+    sampler.stop()
+    _, wait_status, usage = os.wait4(pid, 0)
+    wall = time.perf_counter() - started
+    if raw:
+        payload = json.loads(raw)
+    else:
+        payload = {"status": "error", "error": f"engine exited with status {wait_status}"}
+    payload["wall_seconds"] = round(wall, 4)
+    payload["peak_rss_mb"] = max(_peak_rss_mb(usage), round((sampler.peak_kb or 0) / 1024, 1))
+    payload["rss_scope"] = "process" if sampler.peak_kb is None else "tree"
+    return payload
+
+
+def run_benchmarks(engines, scale_points, work_dir, users=1000, skew=1.1, seed=0,
+                   repeat=1, logger=None):
+    """
+    Benchmark ``engines`` on generated logs of each size in ``scale_points``.
+
+    Each (engine, size) pair is run ``repeat`` times; the fastest wall time
+    and the largest peak RSS are reported.
+
+    Returns:
+        list[dict]: one result per (engine, size) with ``engine``,
+            ``records``, ``bytes``, ``wall_seconds``, ``records_per_sec``,
+            ``peak_rss_mb``, ``rss_scope``, ``status``, ``users``, ``digest`` and
+            ``consistent`` (digest matches the first successful engine).
+    """
+    rows = []
+    for records in scale_points:
+        input_path = os.path.join(work_dir, f"bench_{records}_{users}_{skew}_{seed}.txt")
+        if not os.path.exists(input_path):
+            generate_logs(input_path, records, users=users, skew=skew, seed=seed)
+        size = os.path.getsize(input_path)
+        reference = None
+        for engine in engines:
+            runs = [run_engine(engine, input_path) for _ in range(repeat)]
+            best = min(runs, key=lambda run: run["wall_seconds"])
+            row = {
+                "engine": engine,
+                "records": records,
+                "bytes": size,
+                "users": best.get("users"),
+                "skew": skew,
+                "seed": seed,
+                "status": best["status"],
+                "wall_seconds": best["wall_seconds"],
+                "records_per_sec": round(records / best["wall_seconds"]),
+                "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+                "rss_scope": best["rss_scope"],
+                "digest": best.get("digest"),
+            }
+            if best["status"] != "ok":
+                row["error"] = best["error"]
+                row["records_per_sec"] = None
+            elif reference is None:
+                reference = row["digest"]
+            row["consistent"] = row["status"] == "ok" and row["digest"] == reference
+            rows.append(row)
+            if logger:
+                logger(row)
+    return rows
+
+
+def compare_results(current, baseline, tolerance=0.15):
+    """
+    Find throughput regressions against a baseline run.
+
+    Args:
+        current (list[dict]): rows from run_benchmarks.
+        baseline (list[dict]): rows from an earlier run.
+        tolerance (float): allowed fractional drop in records/sec.
+
+    Returns:
+        list[str]: one message per regressed, failed or inconsistent
+            (engine, records) pair.
+    """
+    previous = {(row["engine"], row["records"]): row for row in baseline}
+    problems = []
+    for row in current:
+        key = (row["engine"], row["records"])
+        if row["status"] != "ok" or not row["consistent"]:
+            problems.append(f"{key[0]} @ {key[1]} records: {row.get('error', 'results differ')}")
+            continue
+        before = previous.get(key)
+        if not before or not before.get("records_per_sec"):
+            continue
+        floor = before["records_per_sec"] * (1 - tolerance)
+        if row["records_per_sec"] < floor:
+            problems.append(
+                f"{key[0]} @ {key[1]} records: {row['records_per_sec']} records/sec, "
+                f"baseline {before['records_per_sec']}"
+            )
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the billing aggregation engines on synthetic logs"
+    )
+    parser.add_argument(
+        "--engines", default=",".join(LOCAL_ENGINES),
+        help=f"Comma-separated engines from {', '.join(ENGINES)}"
+    )
+    parser.add_argument(
+        "--records", default="10000,100000,1000000",
+        help="Comma-separated scale points (log lines)"
+    )
+    parser.add_argument("--users", type=int, default=1000, help="User cardinality")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of user traffic")
+    parser.add_argument("--seed", type=int, default=0, help="Generator seed")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per engine and scale point")
+    parser.add_argument(
+        "--work-dir", default=None,
+        help="Directory for generated logs (reused across runs; defaults to a temp dir)"
+    )
+    parser.add_argument("--output-path", default=None, help="Write results JSON here")
+    parser.add_argument("--baseline", default=None, help="Results JSON to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.15,
+        help="Allowed fractional throughput drop against --baseline"
+    )
+    args = parser.parse_args()
+
+    engines = [engine.strip() for engine in args.engines.split(",") if engine.strip()]
+    unknown = [engine for engine in engines if engine not in ENGINES]
+    if unknown:
+        parser.error(f"Unknown engines: {', '.join(unknown)}")
+    scale_points = [int(records) for records in args.records.split(",")]
+
+    def report(row):
+        print(
+            f"{row['engine']:>16} {row['records']:>10} records  "
+            f"{row['wall_seconds']:>8.3f}s  {row['records_per_sec'] or 0:>10} rec/s  "
+            f"{row['peak_rss_mb']:>8.1f} MB  {row['status']}"
+            f"{'  MISMATCH' if row['status'] == 'ok' and not row['consistent'] else ''}",
+            file=sys.stderr,
+        )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = args.work_dir or tmp_dir
+        os.makedirs(work_dir, exist_ok=True)
+        rows = run_benchmarks(
+            engines, scale_points, work_dir, users=args.users, skew=args.skew,
+            seed=args.seed, repeat=args.repeat, logger=report,
+        )
+
+    document = {
+        "version": RESULTS_VERSION,
+        "created": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": rows,
+    }
+    if args.output_path:
+        with open(args.output_path, 'w') as f:
+            json.dump(document, f, indent=2)
+    else:
+        json.dump(document, sys.stdout, indent=2)
+        print()
+
+    baseline = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    problems = compare_results(rows, baseline, args.tolerance)
+    for problem in problems:
+        print(f"REGRESSION {problem}", file=sys.stderr)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Compact binary billing results with an indexed per-user lookup:
+- write_billing_index: write sorted per-user totals to an index file
+- BillingIndex: memory-mapped reader with O(log n) lookups by user
+  (binary search over the sorted keys) and range scans, without reading
+  or parsing the rest of the file
+
+File layout (all integers little-endian)::
+
+    header   magic "BILLIDX1", version u32, reserved u32, count u64, key bytes u64
+    offsets  (count + 1) x u64: start of each user's key in the key heap
+    values   count x (duration_ms i64, cost_micros i64)
+    keys     UTF-8 user names, concatenated in sorted order
+
+Users are sorted by their UTF-8 bytes, which is the same order as the
+sorted text output. Costs are stored exactly in micro-units, so text
+lines can be regenerated with format_billing_line.
+"""
+
+import argparse
+import bisect
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+
+MAGIC = b"BILLIDX1"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<8sIIQQ")
+_OFFSET = struct.Struct("<Q")
+_VALUE = struct.Struct("<qq")
+# Users buffered per write by write_billing_index
+WRITE_CHUNK = 4096
+
+
+def _write_chunk(f, column):
+    if sys.byteorder == "big":
+        column.byteswap()
+    f.write(column.tobytes())
+
+
+def write_billing_index(path, records):
+    """
+    Write per-user totals as a billing index, replacing ``path`` atomically.
+
+    Records are streamed to disk in chunks of WRITE_CHUNK users: offsets go
+    straight into the output file, values and keys into temporary sections
+    that are appended once the count is known, and the header is written
+    last. Memory use does not grow with the number of users.
+
+    Args:
+        path (str): local output file.
+        records (Iterable[tuple[str | bytes, int, int]]): (user,
+            duration_ms, cost_micros), users as str or UTF-8 bytes, sorted
+            by user with no duplicates; may be a stream, e.g. from
+            RDD.toLocalIterator.
+
+    Returns:
+        int: number of users written.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    section_dir = os.path.dirname(os.path.abspath(path))
+    try:
+        with open(tmp_path, 'wb') as f, \
+                tempfile.TemporaryFile(dir=section_dir) as values_f, \
+                tempfile.TemporaryFile(dir=section_dir) as keys_f:
+            f.write(b"\0" * _HEADER.size)
+            offsets = array("Q", [0])
+            values = array("q")
+            keys = bytearray()
+            count = key_bytes = 0
+            previous = None
+            for user, duration, cost in records:
+                key = user if isinstance(user, bytes) else user.encode("utf-8")
+                if previous is not None and key <= previous:
+                    raise ValueError(f"Users must be sorted and unique, got "
+                                     f"'{key.decode('utf-8')}' after '{previous.decode('utf-8')}'")
+                try:
+                    values.extend((duration, cost))
+                except OverflowError:
+                    raise ValueError(f"Totals of '{key.decode('utf-8')}' do not fit in 64 bits")
+                keys += key
+                key_bytes += len(key)
+                offsets.append(key_bytes)
+                count += 1
+                previous = key
+                if len(offsets) >= WRITE_CHUNK:
+                    _write_chunk(f, offsets)
+                    _write_chunk(values_f, values)
+                    keys_f.write(keys)
+                    offsets, values, keys = array("Q"), array("q"), bytearray()
+            _write_chunk(f, offsets)
+            _write_chunk(values_f, values)
+            keys_f.write(keys)
+            for section in (values_f, keys_f):
+                section.seek(0)
+                shutil.copyfileobj(section, f)
+            f.seek(0)
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0, count, key_bytes))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return count
+
+
+class _Keys:
+    # Sequence view of the sorted keys, for bisect
+    def __init__(self, index):
+        self._index = index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, i):
+        return self._index._key(i)
+
+
+class BillingIndex:
+    """
+    Memory-mapped reader for a file written by write_billing_index.
+
+    Use as a context manager, or call close(). Records are
+    (user, duration_ms, cost_micros) tuples.
+
+    Args:
+        path (str): local index file.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _HEADER.size:
+                raise ValueError(f"Not a billing index: {path}")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, count, key_bytes = _HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Not a billing index: {path}")
+        if version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Unsupported billing index version {version}: {path}")
+        self._count = count
+        self._offsets_at = _HEADER.size
+        self._values_at = self._offsets_at + (count + 1) * _OFFSET.size
+        self._keys_at = self._values_at + count * _VALUE.size
+        if self._keys_at + key_bytes != size:
+            self.close()
+            raise ValueError(f"Truncated or corrupt billing index: {path}")
+        self._keys = _Keys(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._mmap.close()
+
+    def __len__(self):
+        return self._count
+
+    def _key(self, i):
+        start, end = struct.unpack_from("<QQ", self._mmap, self._offsets_at + i * _OFFSET.size)
+        return self._mmap[self._keys_at + start:self._keys_at + end]
+
+    def _record(self, i):
+        duration, cost = _VALUE.unpack_from(self._mmap, self._values_at + i * _VALUE.size)
+        return self._key(i).decode("utf-8"), duration, cost
+
+    def get(self, user, default=None):
+        """
+        Totals of one user by binary search.
+
+        Returns:
+            tuple[int, int] | None: (duration_ms, cost_micros), or ``default``.
+        """
+        key = user.encode("utf-8")
+        i = bisect.bisect_left(self._keys, key)
+        if i < self._count and self._key(i) == key:
+            return _VALUE.unpack_from(self._mmap, self._values_at + i * _VALUE.size)
+        return default
+
+    def __contains__(self, user):
+        return self.get(user) is not None
+
+    def range(self, start=None, end=None):
+        """
+        Yield records with ``start <= user < end`` in user order; either
+        bound may be None.
+        """
+        lo = 0 if start is None else bisect.bisect_left(self._keys, start.encode("utf-8"))
+        hi = self._count if end is None else bisect.bisect_left(self._keys, end.encode("utf-8"))
+        for i in range(lo, hi):
+            yield self._record(i)
+
+    def prefix(self, prefix):
+        """Yield records of the users whose names start with ``prefix``."""
+        key = prefix.encode("utf-8")
+        for i in range(bisect.bisect_left(self._keys, key), self._count):
+            if not self._key(i).startswith(key):
+                break
+            yield self._record(i)
+
+    def __iter__(self):
+        return self.range()
+
+
+def main():
+    from mapreduce_billing.naive_aggregation import format_billing_line
+
+    parser = argparse.ArgumentParser(description="Look up users in a billing index")
+    parser.add_argument("index_path", help="Index file (<output>.idx)")
+    parser.add_argument("--user", action="append", default=[], help="User to look up (repeatable)")
+    parser.add_argument("--start", default=None, help="First user of a range scan")
+    parser.add_argument("--end", default=None, help="End of a range scan (exclusive)")
+    parser.add_argument("--prefix", default=None, help="Scan users with this name prefix")
+    args = parser.parse_args()
+
+    with BillingIndex(args.index_path) as index:
+        if args.user:
+            for user in args.user:
+                totals = index.get(user)
+                print(format_billing_line(user, *totals) if totals else f"{user}: not found")
+            return
+        records = index.prefix(args.prefix) if args.prefix else index.range(args.start, args.end)
+        for record in records:
+            print(format_billing_line(*record))
+
+
+if __name__ == "__main__":
+    main()
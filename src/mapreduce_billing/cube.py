@@ -0,0 +1,299 @@
+"""
+Multi-dimensional cost rollups over user, task and status class, built in
+the same scan of the logs as billing:
+- status_class: the 2xx/4xx/5xx class of a status code
+- parse_grouping_sets: "cube", "rollup" or explicit grouping sets such as
+  ``task,status_class,user+task,total``
+- map_cube_records: combine each partition's lines into (user, task, status
+  class) cells, then expand the cells into every grouping set, so the
+  shuffle carries one row per distinct key and partition, not per record
+- aggregate_cube: single-node equivalent producing the same cube
+- cube_user_totals / cube_user_totals_rdd: billing totals from the
+  ("user",) grouping set
+- write_cube / save_cube_rdd / read_cube: CSV tables of the cube
+
+Cube keys are (user, task, status_class) with ALL ("") in the dimensions a
+grouping set rolls up; log tokens are never empty, so keys of different
+grouping sets cannot collide. Values are (requests, duration_ms,
+cost_micros), combined with windowed.reduce_windowed.
+"""
+
+import csv
+import glob
+import io
+import itertools
+import os
+from utils.io import iter_lines
+from .fast_parser import RateTable
+from .naive_aggregation import load_rates, parse_record
+from .rates import rates_value
+from .windowed import reduce_windowed
+
+DIMENSIONS = ("user", "task", "status_class")
+ALL = ""
+USER_SET = ("user",)
+CUBE_COLUMNS = ("grouping",) + DIMENSIONS + ("requests", "duration_ms", "cost_micros")
+
+
+def status_class(status: str):
+    """``2xx``, ``4xx``, ... for a three-digit status code, else ``other``."""
+    if len(status) == 3 and status.isascii() and status.isdigit():
+        return status[0] + "xx"
+    return "other"
+
+
+def parse_grouping_sets(spec: str):
+    """
+    Parse a grouping set specification.
+
+    Args:
+        spec (str): ``cube`` (every subset of DIMENSIONS), ``rollup``
+            (user+task+status_class, user+task, user, total) or a
+            comma-separated list of sets, each a ``+``-joined list of
+            dimensions or ``total``.
+
+    Returns:
+        list[tuple[str, ...]]: grouping sets, dimensions in DIMENSIONS order.
+    """
+    spec = spec.strip()
+    if spec == "cube":
+        return [
+            dims
+            for size in range(len(DIMENSIONS), -1, -1)
+            for dims in itertools.combinations(DIMENSIONS, size)
+        ]
+    if spec == "rollup":
+        return [DIMENSIONS[:size] for size in range(len(DIMENSIONS), -1, -1)]
+
+    sets = []
+    for name in spec.split(","):
+        name = name.strip()
+        if not name:
+            raise ValueError(f"Empty grouping set in '{spec}'")
+        dims = () if name == "total" else tuple(dim.strip() for dim in name.split("+"))
+        unknown = [dim for dim in dims if dim not in DIMENSIONS]
+        if unknown:
+            raise ValueError(
+                f"Unknown dimension '{unknown[0]}', expected one of {', '.join(DIMENSIONS)}"
+            )
+        dims = tuple(dim for dim in DIMENSIONS if dim in dims)
+        if dims not in sets:
+            sets.append(dims)
+    return sets
+
+
+def grouping_of(key):
+    """Grouping set of a cube key: the dimensions it is not rolled up over."""
+    return tuple(dim for dim, value in zip(DIMENSIONS, key) if value != ALL)
+
+
+def grouping_name(dims):
+    """CSV label of a grouping set, e.g. ``user+task`` or ``total``."""
+    return "+".join(dims) or "total"
+
+
+def _add_cell(cells, user, task, status, duration, rate):
+    key = (user, task, status_class(status))
+    cost = duration * rate(task)
+    cell = cells.get(key)
+    if cell is None:
+        cells[key] = [1, duration, cost]
+    else:
+        cell[0] += 1
+        cell[1] += duration
+        cell[2] += cost
+
+
+def expand_cells(cells, grouping_sets):
+    """
+    Roll (user, task, status_class) cells up into every grouping set.
+
+    Args:
+        cells (dict): (user, task, status_class) to (requests, duration_ms,
+            cost_micros).
+        grouping_sets (list[tuple[str, ...]]): see parse_grouping_sets.
+
+    Returns:
+        dict: cube key to (requests, duration_ms, cost_micros).
+    """
+    masks = [tuple(dim in dims for dim in DIMENSIONS) for dims in grouping_sets]
+    cube = {}
+    for cell, value in cells.items():
+        value = tuple(value)
+        for mask in masks:
+            key = tuple(part if keep else ALL for part, keep in zip(cell, mask))
+            cube[key] = reduce_windowed(cube[key], value) if key in cube else value
+    return cube
+
+
+def map_cube_records(lines_rdd, grouping_sets, rates=None, counters=None, on_error="fail"):
+    """
+    Transform an RDD of log lines into (cube key, (requests, duration_ms,
+    cost_micros)) pairs, combined within each partition. Reduce them with
+    windowed.reduce_windowed.
+
+    Args:
+        lines_rdd (pyspark.RDD[str]): RDD where each element is a log line string.
+        grouping_sets (list[tuple[str, ...]]): see parse_grouping_sets.
+        rates (pyspark.Broadcast | dict | None): per-task rates, ideally a
+            broadcast from rates.broadcast_rates; loaded on the driver if None.
+        counters (metrics.LineCounters | None): see map_reduce.map_records.
+        on_error (str): see map_reduce.map_records.
+
+    Returns:
+        pyspark.RDD[((str, str, str), (int, int, int))]: keyed cube rows.
+    """
+    if rates is None:
+        rates = load_rates()
+
+    def to_pairs(lines):
+        rate = RateTable(rates_value(rates)).rate
+        cells = {}
+        count = malformed = 0
+        for count, line in enumerate(lines, 1):
+            try:
+                _, user, task, status, duration = parse_record(line)
+            except ValueError:
+                if on_error == "fail":
+                    raise
+                if line.strip():
+                    malformed += 1
+                continue
+            _add_cell(cells, user, task, status, duration, rate)
+        if counters is not None:
+            counters.records.add(count)
+            counters.malformed.add(malformed)
+        return iter(expand_cells(cells, grouping_sets).items())
+
+    return lines_rdd.mapPartitions(to_pairs)
+
+
+def aggregate_cube(input_path: str, grouping_sets, rates=None):
+    """
+    Single-node cube of a log file, costed with ``rates`` (a
+    RateTableSnapshot or dict; loaded if None).
+
+    Returns:
+        dict: cube key to (requests, duration_ms, cost_micros).
+    """
+    rate = RateTable(rates_value(rates)).rate
+    cells = {}
+    for line in iter_lines(input_path):
+        if not line.strip():
+            continue
+        _, user, task, status, duration = parse_record(line)
+        _add_cell(cells, user, task, status, duration, rate)
+    return expand_cells(cells, grouping_sets)
+
+
+def cube_user_totals(cube):
+    """
+    Per-user billing totals from a cube with the ("user",) grouping set.
+
+    Returns:
+        dict[str, tuple[int, int]]: user to (total_duration_ms, total_cost_micros).
+    """
+    return {
+        key[0]: (duration, cost)
+        for key, (_, duration, cost) in cube.items()
+        if grouping_of(key) == USER_SET
+    }
+
+
+def cube_user_totals_rdd(cube_rdd):
+    """
+    Per-user billing totals from a reduced cube RDD with the ("user",)
+    grouping set, so billing and the cube come from a single scan.
+
+    Returns:
+        pyspark.RDD[(str, (int, int))]: user to (duration, cost_micros) tuples.
+    """
+    return cube_rdd.filter(lambda pair: grouping_of(pair[0]) == USER_SET).map(
+        lambda pair: (pair[0][0], (pair[1][1], pair[1][2]))
+    )
+
+
+def _sort_key(key):
+    return (grouping_name(grouping_of(key)),) + key
+
+
+def format_cube_rows(cube_items):
+    """CSV rows for (key, value) cube items, in the order given."""
+    for key, (requests, duration, cost) in cube_items:
+        yield [grouping_name(grouping_of(key)), *key, requests, duration, cost]
+
+
+def write_cube(path: str, cube_items, grouping_sets=None):
+    """
+    Write cube items as a CSV table with a header row, ordered by grouping
+    set and then key.
+
+    Args:
+        path (str): output file.
+        cube_items (Iterable[tuple]): (key, (requests, duration_ms,
+            cost_micros)) pairs.
+        grouping_sets (list[tuple[str, ...]] | None): only write these sets.
+    """
+    if grouping_sets is not None:
+        cube_items = [item for item in cube_items if grouping_of(item[0]) in grouping_sets]
+    out_dir = os.path.dirname(path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CUBE_COLUMNS)
+        writer.writerows(format_cube_rows(sorted(cube_items, key=lambda item: _sort_key(item[0]))))
+
+
+def save_cube_rdd(cube_rdd, path: str, grouping_sets=None, single_file: bool = False):
+    """
+    Write a reduced cube RDD from the executors as sorted CSV part files,
+    each starting with a header row.
+
+    Args:
+        cube_rdd (pyspark.RDD): cube key to (requests, duration_ms, cost_micros).
+        path (str): output directory (local, HDFS or S3).
+        grouping_sets (list[tuple[str, ...]] | None): only write these sets.
+        single_file (bool): sort into one partition so a single part file
+            is written.
+    """
+    def to_csv(partition):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="")
+        writer.writerow(CUBE_COLUMNS)
+        yield buffer.getvalue()
+        for row in format_cube_rows((key[1:], value) for key, value in partition):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow(row)
+            yield buffer.getvalue()
+
+    if grouping_sets is not None:
+        cube_rdd = cube_rdd.filter(lambda pair: grouping_of(pair[0]) in grouping_sets)
+    num_partitions = 1 if single_file else None
+    (
+        cube_rdd
+        .map(lambda pair: (_sort_key(pair[0]), pair[1]))
+        .sortByKey(numPartitions=num_partitions)
+        .mapPartitions(to_csv)
+        .saveAsTextFile(path)
+    )
+
+
+def read_cube(path: str):
+    """
+    Read a cube table written by write_cube, or a directory of part files
+    written by save_cube_rdd.
+
+    Returns:
+        dict: cube key to (requests, duration_ms, cost_micros).
+    """
+    paths = sorted(glob.glob(os.path.join(path, "part-*"))) if os.path.isdir(path) else [path]
+    cube = {}
+    for part_path in paths:
+        with open(part_path, newline='') as f:
+            for row in csv.DictReader(f):
+                cube[tuple(row[dim] for dim in DIMENSIONS)] = (
+                    int(row["requests"]), int(row["duration_ms"]), int(row["cost_micros"])
+                )
+    return cube
@@ -0,0 +1,118 @@
+"""
+DataFrame-native billing aggregation for Spark (runs entirely in the JVM):
+- parse_records_df: split raw log lines into typed columns
+- parse_lines_df: the (user, task, duration_ms) columns needed for billing
+- aggregate_df: join per-task rates as a broadcast lookup and sum per user
+"""
+
+from pyspark.sql import functions as F
+from .rates import to_micros
+
+# Same rules as parse_line: five whitespace-separated fields and an integer
+# duration with an "ms" suffix.
+DURATION_PATTERN = r"^([+-]?\d+)ms$"
+TIMESTAMP_FORMAT = "yyyy-MM-dd'T'HH:mm:ssX"
+
+
+def parse_records_df(lines_df):
+    """
+    Parse a DataFrame of raw log lines into all typed log columns without
+    Python UDFs.
+
+    Blank lines are skipped; any other malformed line fails the job, matching
+    the behaviour of parse_line on the RDD path. Timestamps and status codes
+    are not validated (parse_line ignores them) and become null if unparsable.
+
+    Args:
+        lines_df (pyspark.sql.DataFrame): DataFrame with a single string column
+            ``value``, as returned by ``spark.read.text``.
+
+    Returns:
+        pyspark.sql.DataFrame: columns ``timestamp`` (timestamp), ``date``
+            (date), ``user`` (string), ``task`` (string), ``status`` (int) and
+            ``duration_ms`` (long).
+    """
+    line = F.regexp_replace(F.col("value"), r"^\s+|\s+$", "")
+    parts = F.split(line, r"\s+")
+    timestamp = parts.getItem(0)
+    duration = parts.getItem(4)
+
+    valid_line = F.size(parts) == 5
+    valid_duration = duration.rlike(DURATION_PATTERN)
+
+    parsed = (
+        lines_df
+        .where(F.length(line) > 0)
+        .select(
+            F.to_timestamp(timestamp, TIMESTAMP_FORMAT).alias("timestamp"),
+            F.to_date(F.substring(timestamp, 1, 10)).alias("date"),
+            parts.getItem(1).alias("user"),
+            parts.getItem(2).alias("task"),
+            parts.getItem(3).cast("int").alias("status"),
+            F.when(
+                valid_line & valid_duration,
+                F.regexp_extract(duration, DURATION_PATTERN, 1).cast("long"),
+            ).otherwise(
+                F.raise_error(
+                    F.when(
+                        valid_line,
+                        F.concat(F.lit("Invalid duration format: '"), duration, F.lit("'")),
+                    ).otherwise(
+                        F.concat(F.lit("Invalid log line: '"), line, F.lit("'"))
+                    )
+                )
+            ).alias("duration_ms"),
+        )
+    )
+    return parsed
+
+
+def parse_lines_df(lines_df):
+    """
+    Parse a DataFrame of raw log lines into the columns needed for billing.
+
+    Args:
+        lines_df (pyspark.sql.DataFrame): DataFrame with a single string column
+            ``value``, as returned by ``spark.read.text``.
+
+    Returns:
+        pyspark.sql.DataFrame: columns ``user`` (string), ``task`` (string) and
+            ``duration_ms`` (long).
+    """
+    return parse_records_df(lines_df).select("user", "task", "duration_ms")
+
+
+def aggregate_df(records_df, rates):
+    """
+    Compute per-user totals from parsed records.
+
+    Args:
+        records_df (pyspark.sql.DataFrame): columns ``user``, ``task`` and
+            ``duration_ms``, e.g. from parse_lines_df.
+        rates (dict[str, float]): per-task cost per millisecond; tasks without
+            a rate are billed at 0.
+
+    Returns:
+        pyspark.sql.DataFrame: columns ``user``, ``total_duration_ms`` and
+            ``total_cost_micros`` (exact integer micro-units, as on the RDD
+            path).
+    """
+    spark = records_df.sparkSession
+    rates_df = spark.createDataFrame(
+        [(task, to_micros(rate)) for task, rate in rates.items()],
+        "task string, rate_micros long"
+    )
+
+    costed = (
+        records_df
+        .join(F.broadcast(rates_df), on="task", how="left")
+        .select(
+            "user",
+            "duration_ms",
+            (F.col("duration_ms") * F.coalesce(F.col("rate_micros"), F.lit(0))).alias("cost_micros"),
+        )
+    )
+    return costed.groupBy("user").agg(
+        F.sum("duration_ms").alias("total_duration_ms"),
+        F.sum("cost_micros").alias("total_cost_micros"),
+    )
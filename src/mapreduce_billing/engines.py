@@ -0,0 +1,474 @@
+"""
+Local execution backends for the RDD code path (map_records,
+reduce_records and the windowed, cube and skew functions):
+- SerialContext: runs every partition in the calling process
+- ProcessPoolContext: runs partitions in forked workers of a
+  concurrent.futures process pool; reduceByKey combines map-side and
+  exchanges hash-partitioned buckets through shared memory
+- create_context: the context for a ``--backend`` flag ("serial" or
+  "processes"; the "spark" backend is a SparkContext itself)
+- aggregate_mapreduce: billing totals of a log file through map_records
+  and reduce_records on a local backend, shaped like aggregate_naive's
+
+The contexts provide the part of the SparkContext API this package uses
+(textFile, parallelize, union, broadcast, accumulator, defaultParallelism,
+stop) and LocalRDD the part of the RDD API (map, filter, mapPartitions,
+mapPartitionsWithIndex, reduceByKey, sortByKey, coalesce, sample,
+persist, collect, count, aggregate, countByKey, toLocalIterator,
+saveAsTextFile). Transformations are lazy. Each shuffle or action runs one
+stage over all partitions. Workers are forked for every stage, so closures,
+broadcasts and earlier results reach them without pickling, and keys hash
+the same way in every worker.
+"""
+
+import copy
+import functools
+import itertools
+import multiprocessing
+import os
+import pickle
+import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from utils.io import S3_SCHEMES, iter_lines, list_input_files
+from .map_reduce import map_records, reduce_records
+from .parallel_aggregation import split_byte_ranges
+from .rates import rates_value
+
+BACKENDS = ("serial", "processes")
+
+# Stage run by the forked workers of ProcessPoolContext: (task, accumulators)
+_STAGE = None
+
+
+class LocalBroadcast:
+    """Broadcast variable of a local context; workers inherit the value."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def unpersist(self, blocking=False):
+        pass
+
+    def destroy(self, blocking=False):
+        pass
+
+
+class _AddParam:
+    # Default AccumulatorParam for numbers, as in Spark
+    def zero(self, value):
+        return type(value)()
+
+    def addInPlace(self, value1, value2):
+        return value1 + value2
+
+
+class LocalAccumulator:
+    """
+    Accumulator of a local context. Adds made in a worker are sent back with
+    the task's result and merged into the driver's value.
+    """
+
+    def __init__(self, value, param):
+        self._initial = value
+        self._value = value
+        self._param = param
+
+    @property
+    def value(self):
+        return self._value
+
+    def add(self, term):
+        self._value = self._param.addInPlace(self._value, term)
+
+    def __iadd__(self, term):
+        self.add(term)
+        return self
+
+    def _zero(self):
+        self._value = self._param.zero(self._initial)
+
+    def _merge(self, delta):
+        self._value = self._param.addInPlace(self._value, delta)
+
+
+class LocalRDD:
+    """
+    A partitioned, lazily computed dataset of a local context.
+
+    Args:
+        context (SerialContext): the owning context.
+        num_partitions (int): number of partitions.
+        compute (Callable[[int], Iterator]): iterator over one partition.
+        parents (tuple[LocalRDD, ...]): RDDs ``compute`` reads from.
+    """
+
+    def __init__(self, context, num_partitions, compute, parents=()):
+        self.context = context
+        self._num_partitions = num_partitions
+        self._compute = compute
+        self._parents = parents
+        self._cache = None
+
+    def _prepare(self):
+        # Run the shuffles this RDD depends on, before its stage is forked
+        if self._cache is None:
+            for parent in self._parents:
+                parent._prepare()
+
+    def _iter(self, index):
+        if self._cache is not None:
+            return iter(self._cache[index])
+        return self._compute(index)
+
+    def getNumPartitions(self):
+        return self._num_partitions
+
+    def mapPartitionsWithIndex(self, f):
+        return LocalRDD(
+            self.context, self._num_partitions, lambda i: iter(f(i, self._iter(i))), (self,)
+        )
+
+    def mapPartitions(self, f):
+        return self.mapPartitionsWithIndex(lambda _, iterator: f(iterator))
+
+    def map(self, f):
+        return self.mapPartitions(lambda iterator: map(f, iterator))
+
+    def flatMap(self, f):
+        return self.mapPartitions(lambda iterator: itertools.chain.from_iterable(map(f, iterator)))
+
+    def filter(self, f):
+        return self.mapPartitions(lambda iterator: filter(f, iterator))
+
+    def coalesce(self, numPartitions, shuffle=False):
+        n = self._num_partitions
+        if numPartitions >= n:
+            return self
+        groups = [range(i * n // numPartitions, (i + 1) * n // numPartitions)
+                  for i in range(numPartitions)]
+        return LocalRDD(
+            self.context, numPartitions,
+            lambda i: itertools.chain.from_iterable(self._iter(j) for j in groups[i]),
+            (self,),
+        )
+
+    def reduceByKey(self, func, numPartitions=None):
+        return _ShuffledRDD(self, func, numPartitions or self._num_partitions)
+
+    def sortByKey(self, ascending=True, numPartitions=None, keyfunc=lambda key: key):
+        items = sorted(self.collect(), key=lambda pair: keyfunc(pair[0]), reverse=not ascending)
+        return self.context._materialize(items, numPartitions or self._num_partitions)
+
+    def sample(self, withReplacement, fraction, seed=None):
+        if withReplacement:
+            raise ValueError("Local backends only sample without replacement")
+        seed = random.randrange(2 ** 32) if seed is None else seed
+
+        def select(index, iterator):
+            rng = random.Random(seed + index)
+            return (item for item in iterator if rng.random() < fraction)
+
+        return self.mapPartitionsWithIndex(select)
+
+    def persist(self, storageLevel=None):
+        # Materialized at once, so later actions neither recompute the
+        # lineage nor add to its accumulators again
+        if self._cache is None:
+            self._cache = self.context._run(self, lambda _, iterator: list(iterator))
+        return self
+
+    cache = persist
+
+    def unpersist(self, blocking=False):
+        self._cache = None
+        return self
+
+    def collect(self):
+        partitions = self.context._run(self, lambda _, iterator: list(iterator))
+        return [item for partition in partitions for item in partition]
+
+    def toLocalIterator(self):
+        return iter(self.collect())
+
+    def count(self):
+        return sum(self.context._run(self, lambda _, iterator: sum(1 for _ in iterator)))
+
+    def aggregate(self, zeroValue, seqOp, combOp):
+        partials = self.context._run(
+            self, lambda _, iterator: functools.reduce(seqOp, iterator, copy.deepcopy(zeroValue))
+        )
+        return functools.reduce(combOp, partials, zeroValue)
+
+    def countByKey(self):
+        counts = Counter()
+        for partial in self.context._run(self, lambda _, iterator: Counter(k for k, _ in iterator)):
+            counts.update(partial)
+        return dict(counts)
+
+    def saveAsTextFile(self, path):
+        if "://" in path:
+            raise ValueError(f"Local backends only write local paths, got '{path}'")
+        os.makedirs(path)
+
+        def write(index, iterator):
+            with open(os.path.join(path, f"part-{index:05d}"), 'w', encoding='utf-8') as f:
+                for item in iterator:
+                    f.write(f"{item}\n")
+
+        self.context._run(self, write)
+        open(os.path.join(path, "_SUCCESS"), 'w').close()
+
+
+class _ShuffledRDD(LocalRDD):
+    # Output of reduceByKey, held by the driver once its shuffle has run
+    def __init__(self, parent, func, num_partitions):
+        super().__init__(parent.context, num_partitions, self._read, (parent,))
+        self._func = func
+        self._partitions = None
+
+    def _read(self, index):
+        return iter(self._partitions[index])
+
+    def _prepare(self):
+        if self._cache is None and self._partitions is None:
+            parent = self._parents[0]
+            parent._prepare()
+            self._partitions = self.context._shuffle(parent, self._func, self._num_partitions)
+
+
+def _combine(pairs, func):
+    combined = {}
+    for key, value in pairs:
+        combined[key] = func(combined[key], value) if key in combined else value
+    return combined
+
+
+def _hash_partition(combined, num_partitions):
+    buckets = [[] for _ in range(num_partitions)]
+    for item in combined.items():
+        buckets[hash(item[0]) % num_partitions].append(item)
+    return buckets
+
+
+def _merge(buckets, func):
+    return list(_combine(itertools.chain.from_iterable(buckets), func).items())
+
+
+class SerialContext:
+    """
+    Runs RDD stages partition by partition in the calling process.
+
+    Args:
+        parallelism (int | None): default partition count (defaults to the
+            CPU count), as ``sc.defaultParallelism``.
+    """
+
+    def __init__(self, parallelism=None):
+        self.defaultParallelism = parallelism or os.cpu_count() or 1
+        self._accumulators = []
+
+    def textFile(self, name, minPartitions=None):
+        """
+        Lines of local files or S3 objects (comma-separated paths, each a
+        file, directory, glob or S3 URI). Local files are split into
+        newline-aligned byte ranges in proportion to their size.
+        """
+        target = minPartitions or self.defaultParallelism
+        files = [entry for path in name.split(",") for entry in list_input_files(path)]
+        total = sum(size for _, size, _ in files) or 1
+        splits = []
+        for path, size, _ in files:
+            if path.startswith(S3_SCHEMES):
+                splits.append((path, 0, None))
+            elif size:
+                ranges = split_byte_ranges(path, max(1, round(target * size / total)))
+                splits.extend((path, start, end) for start, end in ranges)
+        return LocalRDD(self, len(splits), lambda i: iter_lines(*splits[i]))
+
+    def parallelize(self, c, numSlices=None):
+        data = list(c)
+        return self._materialize(data, numSlices or min(self.defaultParallelism, len(data)) or 1)
+
+    def _materialize(self, data, num_partitions):
+        n = len(data)
+        partitions = [data[i * n // num_partitions:(i + 1) * n // num_partitions]
+                      for i in range(num_partitions)]
+        return LocalRDD(self, num_partitions, lambda i: iter(partitions[i]))
+
+    def union(self, rdds):
+        index = [(rdd, i) for rdd in rdds for i in range(rdd.getNumPartitions())]
+        return LocalRDD(self, len(index), lambda i: index[i][0]._iter(index[i][1]), tuple(rdds))
+
+    def broadcast(self, value):
+        return LocalBroadcast(value)
+
+    def accumulator(self, value, accum_param=None):
+        accumulator = LocalAccumulator(value, accum_param or _AddParam())
+        self._accumulators.append(accumulator)
+        return accumulator
+
+    def stop(self):
+        pass
+
+    def _run(self, rdd, action):
+        """Run ``action(index, iterator)`` on every partition of ``rdd``."""
+        rdd._prepare()
+        return [action(i, rdd._iter(i)) for i in range(rdd.getNumPartitions())]
+
+    def _shuffle(self, parent, func, num_partitions):
+        """Partitions of ``parent`` reduced by key with ``func``."""
+        buckets = self._run(
+            parent, lambda _, pairs: _hash_partition(_combine(pairs, func), num_partitions)
+        )
+        return [_merge([b[j] for b in buckets], func) for j in range(num_partitions)]
+
+
+def _run_task(index):
+    task, accumulators = _STAGE
+    for accumulator in accumulators:
+        accumulator._zero()
+    result = task(index)
+    return result, [accumulator.value for accumulator in accumulators]
+
+
+def _put_shared(bucket):
+    if not bucket:
+        return None
+    payload = pickle.dumps(bucket, pickle.HIGHEST_PROTOCOL)
+    block = shared_memory.SharedMemory(create=True, size=len(payload))
+    block.buf[:len(payload)] = payload
+    block.close()
+    return block.name, len(payload)
+
+
+def _get_shared(ref):
+    if ref is None:
+        return []
+    block = shared_memory.SharedMemory(name=ref[0])
+    view = block.buf[:ref[1]]
+    try:
+        return pickle.loads(view)
+    finally:
+        view.release()
+        block.close()
+
+
+def _unlink_shared(refs):
+    for ref in refs:
+        if ref is not None:
+            try:
+                block = shared_memory.SharedMemory(name=ref[0])
+            except FileNotFoundError:
+                continue
+            block.close()
+            block.unlink()
+
+
+class ProcessPoolContext(SerialContext):
+    """
+    Runs each stage's partitions in a pool of forked worker processes.
+
+    Map tasks of reduceByKey combine their partition, hash-partition it
+    into one bucket per reduce partition and leave each bucket in a shared
+    memory block; reduce tasks read their bucket of every map task
+    straight from shared memory. Only the block names pass through the pool.
+
+    Args:
+        workers (int | None): worker processes and default partition count
+            (defaults to the CPU count).
+    """
+
+    def __init__(self, workers=None):
+        super().__init__(workers)
+        self.workers = self.defaultParallelism
+        self._mp_context = multiprocessing.get_context("fork")
+
+    def _run(self, rdd, action):
+        rdd._prepare()
+        return self._run_tasks(lambda i: action(i, rdd._iter(i)), rdd.getNumPartitions())
+
+    def _run_tasks(self, task, num_tasks, cleanup=None):
+        global _STAGE
+        if num_tasks == 0:
+            return []
+        # Workers share the driver's tracker, so shared memory they create
+        # is released by the driver's unlink rather than on worker exit
+        resource_tracker.ensure_running()
+        _STAGE = (task, self._accumulators)
+        try:
+            with ProcessPoolExecutor(min(self.workers, num_tasks),
+                                     mp_context=self._mp_context) as pool:
+                futures = [pool.submit(_run_task, i) for i in range(num_tasks)]
+                outputs, error = [], None
+                for future in futures:
+                    try:
+                        outputs.append(future.result())
+                    except BaseException as e:
+                        error = error or e
+        finally:
+            _STAGE = None
+        if error is not None:
+            if cleanup is not None:
+                for result, _ in outputs:
+                    cleanup(result)
+            raise error
+
+        results = []
+        for result, deltas in outputs:
+            for accumulator, delta in zip(self._accumulators, deltas):
+                accumulator._merge(delta)
+            results.append(result)
+        return results
+
+    def _shuffle(self, parent, func, num_partitions):
+        def map_task(index):
+            buckets = _hash_partition(_combine(parent._iter(index), func), num_partitions)
+            return [_put_shared(bucket) for bucket in buckets]
+
+        blocks = self._run_tasks(map_task, parent.getNumPartitions(), cleanup=_unlink_shared)
+        try:
+            return self._run_tasks(
+                lambda j: _merge((_get_shared(refs[j]) for refs in blocks), func),
+                num_partitions,
+            )
+        finally:
+            for refs in blocks:
+                _unlink_shared(refs)
+
+
+def create_context(backend="processes", workers=None):
+    """
+    Local context for a backend name from BACKENDS.
+
+    Args:
+        backend (str): "serial" or "processes".
+        workers (int | None): worker processes (and default partitions).
+    """
+    if backend == "serial":
+        return SerialContext(workers)
+    if backend == "processes":
+        return ProcessPoolContext(workers)
+    raise ValueError(f"Unknown backend '{backend}', expected one of {', '.join(BACKENDS)}")
+
+
+def aggregate_mapreduce(input_path: str, backend: str = "processes", workers: int = None,
+                        rates=None):
+    """
+    Billing totals through map_records and reduce_records on a local backend,
+    costed with ``rates`` (a RateTableSnapshot or dict; loaded if None).
+
+    Returns:
+        dict[str, dict]: user to {'total_duration_ms': int, 'total_cost_micros': int}.
+    """
+    sc = create_context(backend, workers)
+    try:
+        rates_bc = sc.broadcast(rates_value(rates))
+        totals = map_records(sc.textFile(input_path), rates_bc).reduceByKey(reduce_records).collect()
+    finally:
+        sc.stop()
+    return {
+        user: {'total_duration_ms': duration, 'total_cost_micros': cost}
+        for user, (duration, cost) in totals
+    }
@@ -0,0 +1,122 @@
+"""
+Fast-path log parsing shared by the single-node and Spark engines:
+- RateTable: task rates compiled into a dense task index of integer
+  micro-unit rates, so each distinct task token is resolved once
+- parse_fields / parse_fields_bytes: parse_line without the strip, the
+  exception handler or the string slicing on well-formed lines
+- iter_parsed: stream (user, task, duration_ms) from a log file as bytes
+  tokens, tokenizing whole blocks at a time
+
+Anything the fast path does not recognise is handed to parse_line, so
+results and error messages are identical to parse_line's.
+"""
+
+import io
+from utils.io import iter_blocks
+from .naive_aggregation import parse_line
+from .rates import to_micros
+
+BLOCK_SIZE = 8 * 1024 * 1024
+
+# Longer durations go through parse_line, whose int() limits and errors apply
+_MAX_DURATION_LEN = 20
+
+# Bytes on which bytes.split() and str.split() (or universal newlines)
+# disagree; a block containing any of them is parsed through parse_line.
+_IRREGULAR = (b"\r", b"\x1c", b"\x1d", b"\x1e", b"\x1f")
+
+
+class RateTable:
+    """
+    Per-task rates in integer micro-units per ms, indexed by dense task codes.
+
+    Task tokens (str or bytes) are interned into ``codes`` on first sight and
+    their rate stored at the same position in ``rates``; unknown tasks cost 0.
+    """
+
+    def __init__(self, rates):
+        self._rates_by_name = dict(rates)
+        self.codes = {}
+        self.rates = []
+
+    def code(self, task):
+        """Dense code of a task token, assigning the next code if unseen."""
+        code = self.codes.get(task)
+        if code is None:
+            name = task.decode("utf-8") if isinstance(task, bytes) else task
+            code = self.codes[task] = len(self.rates)
+            self.rates.append(to_micros(self._rates_by_name.get(name, 0)))
+        return code
+
+    def rate(self, task):
+        """Rate of a task token in micro-units per ms."""
+        return self.rates[self.code(task)]
+
+
+def parse_fields(line: str):
+    """
+    Equivalent of parse_line for str lines.
+
+    Returns:
+        tuple[str, str, int]: (user, task, duration_ms).
+    """
+    parts = line.split()
+    if len(parts) == 5:
+        duration = parts[4]
+        digits = duration[:-2]
+        if (duration[-2:] == "ms" and len(duration) <= _MAX_DURATION_LEN
+                and digits.isascii() and digits.isdigit()):
+            return parts[1], parts[2], int(digits)
+    return parse_line(line)
+
+
+def parse_fields_bytes(line: bytes):
+    """
+    Equivalent of parse_line for a bytes line from a block accepted by
+    is_regular_block.
+
+    Returns:
+        tuple[bytes, bytes, int]: (user, task, duration_ms).
+    """
+    parts = line.split()
+    if len(parts) == 5:
+        duration = parts[4]
+        digits = duration[:-2]
+        if duration[-2:] == b"ms" and len(duration) <= _MAX_DURATION_LEN and digits.isdigit():
+            return parts[1], parts[2], int(digits)
+    user, task, duration = parse_line(line.decode("utf-8"))
+    return user.encode("utf-8"), task.encode("utf-8"), duration
+
+
+def is_regular_block(block: bytes):
+    """True if bytes-level splitting of the block matches parse_line's."""
+    return block.isascii() and not any(sep in block for sep in _IRREGULAR)
+
+
+def iter_parsed(input_path: str, block_size: int = BLOCK_SIZE):
+    """
+    Lazily yield (user, task, duration_ms) for every non-blank line of a log
+    file, with user and task as bytes tokens.
+
+    Args:
+        input_path (str): local path or S3 URI.
+        block_size (int): bytes read and split per batch.
+    """
+    for block in iter_blocks(input_path, block_size):
+        if is_regular_block(block):
+            for line in block.split(b"\n"):
+                parts = line.split()
+                if len(parts) == 5:
+                    duration = parts[4]
+                    digits = duration[:-2]
+                    if (duration[-2:] == b"ms" and len(duration) <= _MAX_DURATION_LEN
+                            and digits.isdigit()):
+                        yield parts[1], parts[2], int(digits)
+                        continue
+                if parts:
+                    yield parse_fields_bytes(line)
+        else:
+            for line in io.StringIO(block.decode("utf-8"), newline=None):
+                if line.strip():
+                    user, task, duration = parse_line(line)
+                    yield user.encode("utf-8"), task.encode("utf-8"), duration
@@ -0,0 +1,191 @@
+"""
+Incremental billing with persisted per-user partial aggregates:
+- IncrementalState: manifest of processed input files plus one file of
+  per-user (duration_ms, cost_micros) partials per input
+- aggregate_incremental: aggregate only new or changed inputs and merge them
+  with the stored partials through reduce_records
+
+State directory layout::
+
+    <state_dir>/manifest.json
+    <state_dir>/partials/<sha1 of input path>.json
+"""
+
+import hashlib
+import json
+import os
+from utils.io import list_input_files
+from .map_reduce import reduce_records
+
+MANIFEST_VERSION = 2
+# Version 1 partials hold float costs; they are recomputed as micro-units
+_RECOMPUTE_VERSIONS = (1,)
+
+
+def _write_json(path, payload):
+    # Write-then-rename so a crashed run never leaves a truncated file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def merge_totals(totals, partials):
+    """
+    Merge per-user (duration_ms, cost_micros) partials into ``totals`` in place.
+
+    Args:
+        totals (dict[str, tuple[int, int]]): running totals.
+        partials (dict[str, tuple[int, int]]): totals for one input.
+
+    Returns:
+        dict[str, tuple[int, int]]: ``totals``.
+    """
+    for user, record in partials.items():
+        if user in totals:
+            totals[user] = reduce_records(totals[user], record)
+        else:
+            totals[user] = tuple(record)
+    return totals
+
+
+class IncrementalState:
+    """
+    Persisted record of which inputs have been aggregated and their partials.
+
+    An input is reprocessed if its size or version (mtime or ETag) differs
+    from the manifest, and its partials are dropped if it disappears. If the
+    rate table version differs from the one the partials were costed with,
+    every input is reprocessed.
+    """
+
+    def __init__(self, state_dir, rates_version=None):
+        self.state_dir = state_dir
+        self.partials_dir = os.path.join(state_dir, "partials")
+        self.manifest_path = os.path.join(state_dir, "manifest.json")
+        os.makedirs(self.partials_dir, exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get("version") in _RECOMPUTE_VERSIONS:
+                manifest = {"inputs": {}}
+            elif manifest.get("version") != MANIFEST_VERSION:
+                raise ValueError(
+                    f"Unsupported manifest version in {self.manifest_path}: "
+                    f"{manifest.get('version')}"
+                )
+            self.inputs = manifest["inputs"]
+            if rates_version is not None and manifest.get("rates_version") != rates_version:
+                self.inputs = {}
+        else:
+            self.inputs = {}
+        self.rates_version = rates_version
+
+    def _partials_path(self, path):
+        name = hashlib.sha1(path.encode("utf-8")).hexdigest()
+        return os.path.join(self.partials_dir, f"{name}.json")
+
+    def pending(self, files):
+        """
+        Return the inputs that are new or have changed since they were recorded.
+
+        Args:
+            files (list[tuple[str, int, str]]): (path, size, version) tuples,
+                as returned by utils.io.list_input_files.
+
+        Returns:
+            list[str]: paths that need to be aggregated.
+        """
+        return [
+            path for path, size, version in files
+            if self.inputs.get(path, {}).get("size") != size
+            or self.inputs.get(path, {}).get("version") != version
+        ]
+
+    def record(self, path, size, version, partials):
+        """
+        Store the per-user partials for one input and mark it processed.
+
+        Args:
+            path (str): input file.
+            size (int): input size in bytes.
+            version (str): input version (mtime or ETag).
+            partials (dict[str, tuple[int, int]]): per-user totals for the input.
+        """
+        partials_path = self._partials_path(path)
+        _write_json(partials_path, {user: list(record) for user, record in partials.items()})
+        self.inputs[path] = {
+            "size": size,
+            "version": version,
+            "partials": os.path.basename(partials_path),
+        }
+
+    def forget_missing(self, files):
+        """Drop recorded inputs that are no longer part of the input set."""
+        present = {path for path, _, _ in files}
+        for path in list(self.inputs):
+            if path not in present:
+                entry = self.inputs.pop(path)
+                partials_path = os.path.join(self.partials_dir, entry["partials"])
+                if os.path.exists(partials_path):
+                    os.remove(partials_path)
+
+    def save(self):
+        """Persist the manifest; call after all record() calls succeed."""
+        _write_json(self.manifest_path, {
+            "version": MANIFEST_VERSION,
+            "rates_version": self.rates_version,
+            "inputs": self.inputs,
+        })
+
+    def totals(self):
+        """
+        Merge all stored partials.
+
+        Returns:
+            dict[str, tuple[int, int]]: user to (total_duration_ms, total_cost_micros).
+        """
+        totals = {}
+        for path in sorted(self.inputs):
+            partials_path = os.path.join(self.partials_dir, self.inputs[path]["partials"])
+            with open(partials_path) as f:
+                merge_totals(totals, json.load(f))
+        return totals
+
+
+def aggregate_incremental(input_path, state_dir, aggregate_files, logger=None,
+                          rates_version=None):
+    """
+    Aggregate only unseen or changed input files and merge with stored partials.
+
+    Args:
+        input_path (str): file, directory, glob or S3 prefix of log files.
+        state_dir (str): directory holding the manifest and partials.
+        aggregate_files (Callable[[list[str]], dict[str, dict[str, tuple]]]):
+            aggregates a batch of files, returning per-user (duration_ms, cost_micros)
+            partials keyed by file path.
+        logger (logging.Logger | None): progress logger.
+        rates_version (str | None): version of the rate table in use; stored
+            partials costed with another version are recomputed.
+
+    Returns:
+        dict[str, tuple[int, int]]: user to (total_duration_ms, total_cost_micros)
+            across every input file.
+    """
+    state = IncrementalState(state_dir, rates_version)
+    files = list_input_files(input_path)
+    pending = state.pending(files)
+    if logger:
+        logger.info(
+            f"Incremental mode: {len(files)} input files, {len(pending)} new or changed"
+        )
+
+    if pending:
+        partials_by_file = aggregate_files(pending)
+        pending_set = set(pending)
+        for path, size, version in files:
+            if path in pending_set:
+                state.record(path, size, version, partials_by_file.get(path, {}))
+    state.forget_missing(files)
+    state.save()
+    return state.totals()
@@ -0,0 +1,126 @@
+"""
+Columnar ingest for API logs:
+- ingest_logs: convert raw api_logs text into Parquet partitioned by date
+- read_billing_columns: read back only the columns the billing job needs
+"""
+
+import sys
+import argparse
+from mapreduce_billing.dataframe_aggregation import parse_records_df
+
+LOG_COLUMNS = ("timestamp", "user", "task", "status", "duration_ms")
+BILLING_COLUMNS = ("user", "task", "duration_ms")
+PARTITION_COLUMN = "date"
+MAX_RECORDS_PER_FILE = 5_000_000
+
+
+def ingest_logs(spark, input_path, output_path, compression="snappy", num_partitions=None,
+                max_records_per_file=MAX_RECORDS_PER_FILE):
+    """
+    Parse raw log text once and store it as typed, date-partitioned Parquet.
+
+    Rows are range-partitioned by (date, user), so a large day is split
+    across tasks by user range instead of landing in a single task, while
+    each task still writes to only one or two date directories. Rows are
+    sorted by user and task within each file so the dictionary encoded
+    string columns compress into long runs. Only the dates present in the
+    input are overwritten, so re-ingesting a day leaves the others untouched.
+
+    Args:
+        spark (pyspark.sql.SparkSession): active session.
+        input_path (str): raw log text (local path, glob or S3 URI).
+        output_path (str): root directory of the Parquet dataset.
+        compression (str): Parquet compression codec.
+        num_partitions (int | None): write tasks; defaults to
+            ``spark.sql.shuffle.partitions``.
+        max_records_per_file (int): rows per Parquet file before a task
+            starts a new one (0 for no limit).
+
+    Returns:
+        pyspark.sql.DataFrame: the parsed records that were written.
+    """
+    spark.conf.set("spark.sql.sources.partitionOverwriteMode", "dynamic")
+    num_partitions = num_partitions or int(spark.conf.get("spark.sql.shuffle.partitions"))
+    # The date leads the sort so the partitioned writer keeps this order
+    records_df = (
+        parse_records_df(spark.read.text(input_path))
+        .select(PARTITION_COLUMN, *LOG_COLUMNS)
+        .repartitionByRange(num_partitions, PARTITION_COLUMN, "user")
+        .sortWithinPartitions(PARTITION_COLUMN, "user", "task")
+    )
+    (
+        records_df.write
+        .mode("overwrite")
+        .partitionBy(PARTITION_COLUMN)
+        .option("compression", compression)
+        .option("maxRecordsPerFile", max_records_per_file)
+        .option("parquet.enable.dictionary", "true")
+        .parquet(output_path)
+    )
+    return records_df
+
+
+def read_billing_columns(spark, path):
+    """
+    Read the (user, task, duration_ms) columns from an ingested dataset.
+
+    Parquet column pruning means the timestamp and status columns are never
+    read from storage. ``path`` may be the dataset root or a single
+    ``date=YYYY-MM-DD`` partition directory.
+
+    Args:
+        spark (pyspark.sql.SparkSession): active session.
+        path (str): Parquet dataset written by ingest_logs.
+
+    Returns:
+        pyspark.sql.DataFrame: columns ``user``, ``task`` and ``duration_ms``.
+    """
+    return spark.read.parquet(path).select(*BILLING_COLUMNS)
+
+
+def main():
+    # spark_job imports this module for read_billing_columns
+    from mapreduce_billing.spark_job import setup_logging, build_spark_session
+
+    logger = setup_logging()
+    parser = argparse.ArgumentParser(
+        description="Convert raw API logs to date-partitioned Parquet"
+    )
+    parser.add_argument(
+        "--input-path", required=True,
+        help="Path to raw API logs (local or S3 URI)"
+    )
+    parser.add_argument(
+        "--output-path", required=True,
+        help="Root directory of the Parquet dataset (local or S3 URI)"
+    )
+    parser.add_argument(
+        "--compression", default="snappy",
+        help="Parquet compression codec (snappy, zstd, gzip, none)"
+    )
+    parser.add_argument(
+        "--partitions", type=int, default=None,
+        help="Write tasks (default: spark.sql.shuffle.partitions)"
+    )
+    parser.add_argument(
+        "--max-records-per-file", type=int, default=MAX_RECORDS_PER_FILE,
+        help="Rows per Parquet file before starting a new one (0: no limit)"
+    )
+    args = parser.parse_args()
+
+    try:
+        logger.info(f"Ingesting {args.input_path} into {args.output_path}")
+        spark = build_spark_session(logger)
+        ingest_logs(
+            spark, args.input_path, args.output_path, args.compression,
+            args.partitions, args.max_records_per_file,
+        )
+        spark.stop()
+        logger.info("Ingest completed successfully")
+    except Exception:
+        logger.exception("Ingest failed unexpectedly")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
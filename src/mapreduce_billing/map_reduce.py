@@ -1,40 +1,145 @@
 """
 Core MapReduce functions for Spark billing aggregation:
-- map_records: convert each log line into (user, (duration_ms, cost))
+- map_records: convert each log line into (user, (duration_ms, cost_micros))
+- map_parsed_records: convert each parsed (user, task, duration_ms) record
+  into (user, (duration_ms, cost_micros))
 - reduce_records: sum durations and costs across records for a given user
+- malformed_lines / check_error_rate: side output and abort threshold for
+  the "skip" and "quarantine" error policies
+
+Costs are integer micro-units (see rates.to_micros), so totals are exact
+whatever the partitioning and reduction order.
 """
 
-from .naive_aggregation import load_rates, parse_line
+import json
+from .fast_parser import RateTable, parse_fields
+from .rates import rates_value
+from .sketches import BillingSketches
+
+# fail: a malformed line fails the job; skip: drop and count it;
+# quarantine: also write it to a side output
+ERROR_POLICIES = ("fail", "skip", "quarantine")
 
-def map_records(lines_rdd):
+def map_records(lines_rdd, rates=None, counters=None, on_error="fail", sketches=None):
     """
-    Transform an RDD of log lines into an RDD of (user, (duration_ms, cost)).
+    Transform an RDD of log lines into an RDD of (user, (duration_ms, cost_micros)).
 
     Args:
         lines_rdd (pyspark.RDD[str]): RDD where each element is a log line string.
+        rates (pyspark.Broadcast | dict | None): per-task rates, ideally a
+            broadcast from rates.broadcast_rates; loaded on the driver if None.
+        counters (metrics.LineCounters | None): accumulators for the lines
+            read and the malformed lines dropped, added to once per partition.
+        on_error (str): one of ERROR_POLICIES. Unless "fail", malformed
+            lines are dropped (and counted); blank lines are dropped silently.
+        sketches (pyspark.Accumulator | None): accumulator of
+            sketches.BillingSketches (see SketchAccumulatorParam), fed every
+            mapped record in the same pass.
 
     Returns:
-        pyspark.RDD[(str, (int, float))]: RDD of user to (duration, cost) tuples.
+        pyspark.RDD[(str, (int, int))]: RDD of user to (duration, cost_micros) tuples.
     """
-    rates = load_rates()
+    if rates is None:
+        rates = rates_value(None)
 
-    def to_pair(line):
-        user, task, duration = parse_line(line)
-        rate = rates.get(task, 0.0)
-        cost = duration * rate
-        return user, (duration, cost)
+    def to_pairs(lines):
+        # One rate table per partition, built from the executor's broadcast copy
+        rate = RateTable(rates_value(rates)).rate
+        observe = local_sketches = None
+        if sketches is not None:
+            local_sketches = BillingSketches()
+            observe = local_sketches.add
+        count = malformed = 0
+        for count, line in enumerate(lines, 1):
+            try:
+                user, task, duration = parse_fields(line)
+            except ValueError:
+                if on_error == "fail":
+                    raise
+                if line.strip():
+                    malformed += 1
+                continue
+            cost = duration * rate(task)
+            if observe is not None:
+                observe(user, task, duration, cost)
+            yield user, (duration, cost)
+        if counters is not None:
+            counters.records.add(count)
+            counters.malformed.add(malformed)
+        if local_sketches is not None:
+            sketches.add(local_sketches)
 
-    return lines_rdd.map(to_pair)
+    return lines_rdd.mapPartitions(to_pairs)
+
+def map_parsed_records(records_rdd, rates=None):
+    """
+    Transform an RDD of already-parsed records (e.g. rows read back from the
+    columnar ingest output) into an RDD of (user, (duration_ms, cost_micros)).
+
+    Args:
+        records_rdd (pyspark.RDD[(str, str, int)]): RDD of (user, task, duration_ms).
+        rates (pyspark.Broadcast | dict | None): see map_records.
+
+    Returns:
+        pyspark.RDD[(str, (int, int))]: RDD of user to (duration, cost_micros) tuples.
+    """
+    if rates is None:
+        rates = rates_value(None)
+
+    def to_pairs(records):
+        rate = RateTable(rates_value(rates)).rate
+        for user, task, duration in records:
+            yield user, (duration, duration * rate(task))
+
+    return records_rdd.mapPartitions(to_pairs)
 
 def reduce_records(a, b):
     """
     Combine two (duration, cost) tuples by summing their components.
 
     Args:
-        a (tuple[int, float]): (duration_ms, cost)
-        b (tuple[int, float]): (duration_ms, cost)
+        a (tuple[int, int]): (duration_ms, cost_micros)
+        b (tuple[int, int]): (duration_ms, cost_micros)
 
     Returns:
-        tuple[int, float]: summed (duration_ms, cost)
+        tuple[int, int]: summed (duration_ms, cost_micros)
     """
     return a[0] + b[0], a[1] + b[1]
+
+
+def malformed_lines(lines_rdd, parse=parse_fields):
+    """
+    Select the non-blank lines that map_records drops under the "skip" and
+    "quarantine" policies, with the parser's error for each.
+
+    Args:
+        lines_rdd (pyspark.RDD[str]): log lines.
+        parse (Callable[[str], object]): parser that raises ValueError on a
+            malformed line, matching the map function that dropped them.
+
+    Returns:
+        pyspark.RDD[str]: JSON objects with ``error`` and ``line``.
+    """
+    def select(lines):
+        for line in lines:
+            try:
+                parse(line)
+            except ValueError as e:
+                if line.strip():
+                    yield json.dumps({"error": str(e), "line": line})
+
+    return lines_rdd.mapPartitions(select)
+
+
+def check_error_rate(records, malformed, max_error_rate):
+    """
+    Abort a run whose share of malformed lines is too high.
+
+    Raises:
+        ValueError: if ``malformed / records`` exceeds ``max_error_rate``.
+    """
+    if records and malformed / records > max_error_rate:
+        raise ValueError(
+            f"{malformed} of {records} lines malformed "
+            f"({malformed / records:.4%}), above the limit of {max_error_rate:.4%}"
+        )
@@ -0,0 +1,267 @@
+"""
+Per-stage instrumentation for the Spark billing job:
+- LineCounters: Spark accumulators for the lines the Python map functions
+  read and the malformed lines they drop, added once per partition
+- JobMetrics: driver wall time per logical stage, each run under its own
+  Spark job group so Spark's stages can be attributed to it
+- spark_stage_metrics: input, shuffle and task-time figures per Spark stage
+  and task durations per executor, read from the driver's status REST API
+  (the store Spark's own listener fills from scheduler events)
+- prometheus_text / write_prometheus: export for the node_exporter textfile
+  collector; JobMetrics.to_json gives one structured log line for fluent-bit
+
+Spark pipelines narrow transformations, so parsing and mapping run in the
+same Spark stage as the shuffle write ("map"); the shuffle read and reduce
+form the next one ("reduce").
+"""
+
+import json
+import os
+import time
+import urllib.request
+from contextlib import contextmanager
+from datetime import datetime
+
+METRIC_PREFIX = "billing_job"
+JOB_GROUP_PREFIX = "billing-"
+REST_TIMEOUT_SECONDS = 5
+
+# Status API stage field -> reported name
+_STAGE_FIELDS = {
+    "numTasks": "tasks",
+    "numFailedTasks": "failed_tasks",
+    "inputBytes": "input_bytes",
+    "inputRecords": "input_records",
+    "outputBytes": "output_bytes",
+    "shuffleReadBytes": "shuffle_read_bytes",
+    "shuffleReadRecords": "shuffle_read_records",
+    "shuffleWriteBytes": "shuffle_write_bytes",
+    "shuffleWriteRecords": "shuffle_write_records",
+    "memoryBytesSpilled": "memory_bytes_spilled",
+    "diskBytesSpilled": "disk_bytes_spilled",
+}
+_STAGE_TOTALS = ("input_bytes", "input_records", "shuffle_read_bytes", "shuffle_write_bytes")
+
+
+class LineCounters:
+    """Accumulators for the lines the Python map functions read and drop."""
+
+    def __init__(self, sc):
+        self.records = sc.accumulator(0)
+        self.malformed = sc.accumulator(0)
+
+    def values(self):
+        """Driver-side totals of the accumulators."""
+        return {"records": self.records.value, "malformed_records": self.malformed.value}
+
+
+def _get_json(url):
+    with urllib.request.urlopen(url, timeout=REST_TIMEOUT_SECONDS) as response:
+        return json.load(response)
+
+
+def _stage_kind(stage):
+    if stage.get("shuffleReadBytes") or stage.get("shuffleReadRecords"):
+        return "reduce"
+    if stage.get("shuffleWriteBytes") or stage.get("shuffleWriteRecords"):
+        return "map"
+    return "scan"
+
+
+def spark_stage_metrics(ui_url, app_id, job_groups):
+    """
+    Fetch per-stage and per-executor metrics from the Spark status API.
+
+    Args:
+        ui_url (str): driver UI address, ``sc.uiWebUrl``.
+        app_id (str): ``sc.applicationId``.
+        job_groups (Iterable[str]): job groups whose stages to report.
+
+    Returns:
+        dict: ``stages`` (job group to a list of Spark stage dicts with
+            ``stage_id``, ``name``, ``kind`` ("scan", "map" or "reduce"),
+            ``status``, ``wall_seconds``, ``executor_run_seconds`` and the
+            input/shuffle/spill counters) and ``executors`` (executor id to
+            ``tasks``, ``failed_tasks``, ``task_seconds`` and
+            ``gc_seconds``).
+    """
+    base = f"{ui_url.rstrip('/')}/api/v1/applications/{app_id}"
+    job_groups = set(job_groups)
+    group_of_stage = {}
+    for job in _get_json(f"{base}/jobs"):
+        if job.get("jobGroup") in job_groups:
+            for stage_id in job.get("stageIds", []):
+                group_of_stage[stage_id] = job["jobGroup"]
+
+    stages = {group: [] for group in job_groups}
+    for stage in _get_json(f"{base}/stages?details=false"):
+        group = group_of_stage.get(stage["stageId"])
+        if group is None or stage.get("status") == "SKIPPED":
+            continue
+        row = {
+            "stage_id": stage["stageId"],
+            "attempt": stage.get("attemptId", 0),
+            "name": stage.get("name", ""),
+            "kind": _stage_kind(stage),
+            "status": stage.get("status"),
+            "wall_seconds": _stage_wall_seconds(stage),
+            "executor_run_seconds": stage.get("executorRunTime", 0) / 1000,
+        }
+        row.update({name: stage.get(field, 0) for field, name in _STAGE_FIELDS.items()})
+        stages[group].append(row)
+    for rows in stages.values():
+        rows.sort(key=lambda row: (row["stage_id"], row["attempt"]))
+
+    executors = {
+        executor["id"]: {
+            "tasks": executor.get("totalTasks", 0),
+            "failed_tasks": executor.get("failedTasks", 0),
+            "task_seconds": executor.get("totalDuration", 0) / 1000,
+            "gc_seconds": executor.get("totalGCTime", 0) / 1000,
+        }
+        for executor in _get_json(f"{base}/allexecutors")
+        if executor["id"] != "driver" or executor.get("totalTasks")
+    }
+    return {"stages": stages, "executors": executors}
+
+
+def _stage_wall_seconds(stage):
+    # Timestamps look like 2025-05-04T19:39:27.123GMT
+    try:
+        start, end = (
+            datetime.strptime(stage[key], "%Y-%m-%dT%H:%M:%S.%fGMT")
+            for key in ("submissionTime", "completionTime")
+        )
+    except (KeyError, ValueError):
+        return None
+    return round((end - start).total_seconds(), 3)
+
+
+class JobMetrics:
+    """
+    Wall time, counters and Spark stage metrics for one billing run.
+
+    Args:
+        sc (pyspark.SparkContext | None): if given, each stage runs under the
+            job group ``billing-<stage>`` and Spark metrics can be collected.
+    """
+
+    def __init__(self, sc=None):
+        self.sc = sc
+        self.started = time.time()
+        self.status = "running"
+        self.stages = {}
+        self.counters = {}
+        self.executors = {}
+        self.wall_seconds = None
+        self._clock = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        """Time a logical stage and tag the Spark jobs it triggers."""
+        if self.sc is not None:
+            self.sc.setJobGroup(JOB_GROUP_PREFIX + name, f"billing {name} stage")
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = self.stages.setdefault(name, {"wall_seconds": 0.0})
+            record["wall_seconds"] = round(record["wall_seconds"] + time.perf_counter() - start, 4)
+            if self.sc is not None:
+                self.sc.setLocalProperty("spark.jobGroup.id", None)
+
+    def add_counters(self, **values):
+        """Record run-level counters, e.g. records or input bytes."""
+        self.counters.update(values)
+
+    def collect_spark(self):
+        """Attach Spark stage and executor metrics for the timed stages."""
+        groups = {JOB_GROUP_PREFIX + name: name for name in self.stages}
+        spark = spark_stage_metrics(self.sc.uiWebUrl, self.sc.applicationId, groups)
+        for group, rows in spark["stages"].items():
+            record = self.stages[groups[group]]
+            record["spark_stages"] = rows
+            for field in _STAGE_TOTALS:
+                record[field] = sum(row[field] for row in rows)
+            record["executor_run_seconds"] = round(
+                sum(row["executor_run_seconds"] for row in rows), 3
+            )
+        self.executors = spark["executors"]
+
+    def finish(self, status):
+        """Mark the run finished with ``status`` ("succeeded" or "failed")."""
+        self.status = status
+        self.wall_seconds = round(time.perf_counter() - self._clock, 4)
+
+    def as_dict(self):
+        """The metrics as a JSON-serializable document."""
+        return {
+            "event": f"{METRIC_PREFIX}_metrics",
+            "app_id": getattr(self.sc, "applicationId", None),
+            "status": self.status,
+            "started": round(self.started, 3),
+            "wall_seconds": self.wall_seconds,
+            "counters": self.counters,
+            "stages": self.stages,
+            "executors": self.executors,
+        }
+
+    def to_json(self):
+        """The metrics as one JSON line."""
+        return json.dumps(self.as_dict(), sort_keys=True, separators=(",", ":"))
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+def prometheus_text(metrics):
+    """
+    Render a JobMetrics.as_dict() document in the Prometheus text format.
+
+    Returns:
+        str: gauges prefixed ``billing_job_``, one sample per line.
+    """
+    p = METRIC_PREFIX
+    samples = [
+        (f"{p}_last_run_timestamp_seconds", "", metrics["started"]),
+        (f"{p}_success", "", 1 if metrics["status"] == "succeeded" else 0),
+    ]
+    if metrics["wall_seconds"] is not None:
+        samples.append((f"{p}_wall_seconds", "", metrics["wall_seconds"]))
+    for name, value in sorted(metrics["counters"].items()):
+        if isinstance(value, (int, float)):
+            samples.append((f"{p}_{name}", "", value))
+    for name, stage in metrics["stages"].items():
+        labels = _labels(stage=name)
+        samples.append((f"{p}_stage_wall_seconds", labels, stage["wall_seconds"]))
+        for field in ("executor_run_seconds",) + _STAGE_TOTALS:
+            if field in stage:
+                samples.append((f"{p}_stage_{field}", labels, stage[field]))
+    for executor, summary in sorted(metrics["executors"].items()):
+        labels = _labels(executor=executor)
+        samples.append((f"{p}_executor_tasks", labels, summary["tasks"]))
+        samples.append((f"{p}_executor_failed_tasks", labels, summary["failed_tasks"]))
+        samples.append((f"{p}_executor_task_seconds", labels, summary["task_seconds"]))
+        samples.append((f"{p}_executor_gc_seconds", labels, summary["gc_seconds"]))
+
+    # Samples of one metric must be contiguous; the sort is stable
+    samples.sort(key=lambda sample: sample[0])
+    lines, typed = [], set()
+    for name, labels, value in samples:
+        if name not in typed:
+            lines.append(f"# TYPE {name} gauge")
+            typed.add(name)
+        lines.append(f"{name}{labels} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(metrics, path):
+    """
+    Write a textfile-collector file, replacing it atomically so the
+    collector never reads a partial file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(prometheus_text(metrics))
+    os.replace(tmp_path, path)
@@ -1,50 +1,85 @@
 import os
 import argparse
-from dotenv import load_dotenv
+import json
+from utils.io import S3_SCHEMES
+from mapreduce_billing.rates import format_cost, load_rate_table, rates_value
 
 
 def load_rates():
-    load_dotenv()  
-    rates = {}
-    for name, val in os.environ.items():
-        if name.startswith("RATE_"):
-            task = name.split("_", 1)[1]
-            try:
-                rates[task] = float(val)
-            except ValueError:
-                raise ValueError(f"Invalid rate for {task}: {val}")
-    return rates
+    return load_rate_table().rates
 
 
 def parse_line(line: str):
+    _, user, task, _, duration_ms = parse_record(line)
+    return user, task, duration_ms
+
+
+def parse_record(line: str):
+    # The one place log lines are validated: parse_line, the fast parsers'
+    # fallback and the windowed and cube engines all go through here
     parts = line.strip().split()
     if len(parts) != 5:
         raise ValueError(f"Invalid log line: '{line.strip()}'")
-    _, user, task, _, duration = parts
+    timestamp, user, task, status, duration = parts
     if not duration.endswith("ms"):
         raise ValueError(f"Invalid duration format: '{duration}'")
     try:
         duration_ms = int(duration[:-2])
     except ValueError:
         raise ValueError(f"Cannot parse duration: '{duration}'")
-    return user, task, duration_ms
+    return timestamp, user, task, status, duration_ms
+
+
+def format_billing_line(user: str, duration: int, cost_micros: int):
+    return f"{user}: total_duration={duration}ms, total_cost={format_cost(cost_micros)}"
+
 
+def aggregate_naive(input_path: str, sketches=None, rates=None):
+    from mapreduce_billing.fast_parser import RateTable, iter_parsed
 
-def aggregate_naive(input_path: str):
-    rates = load_rates()
+    rate_table = RateTable(rates_value(rates))
+    codes, rates = rate_table.codes, rate_table.rates
+    observe = sketches.add if sketches is not None else None
     totals = {}
-    with open(input_path, 'r') as f:
-        for line in f:
-            if not line.strip():
-                continue
-            user, task, duration = parse_line(line)
-            rate = rates.get(task, 0.0)
-            cost = duration * rate
-            if user not in totals:
-                totals[user] = {'total_duration_ms': 0, 'total_cost': 0.0}
-            totals[user]['total_duration_ms'] += duration
-            totals[user]['total_cost'] += cost
-    return totals
+    for user, task, duration in iter_parsed(input_path):
+        code = codes.get(task)
+        cost = duration * (rates[code] if code is not None else rate_table.rate(task))
+        if observe is not None:
+            observe(user, task, duration, cost)
+        record = totals.get(user)
+        if record is None:
+            totals[user] = [duration, cost]
+        else:
+            record[0] += duration
+            record[1] += cost
+    return {
+        user.decode('utf-8'): {'total_duration_ms': duration, 'total_cost_micros': cost}
+        for user, (duration, cost) in totals.items()
+    }
+
+
+def sorted_records(results):
+    for user, metrics in sorted(results.items()):
+        yield user, metrics['total_duration_ms'], metrics['total_cost_micros']
+
+
+def write_billing(output_path: str, results, rate_table):
+    write_billing_records(output_path, sorted_records(results), rate_table)
+
+
+def write_billing_records(output_path: str, records, rate_table):
+    out_dir = os.path.dirname(output_path)
+    if out_dir and not os.path.exists(out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+
+    # Write results, already sorted by user
+    with open(output_path, 'w') as out_f:
+        for user, duration, cost in records:
+            out_f.write(format_billing_line(user, duration, cost) + "\n")
+
+    # Record which rate table the totals were costed with
+    with open(f"{os.path.splitext(output_path)[0]}.rates.json", 'w') as rates_f:
+        json.dump(rate_table.stamp(), rates_f, indent=2)
 
 
 def main():
@@ -53,26 +88,184 @@ def main():
     )
     parser.add_argument(
         "--input-path", required=True,
-        help="Path to the API logs text file"
+        help="Path to the API logs text file, or an S3 URI of an object or prefix"
     )
     parser.add_argument(
         "--output-path", default="./data/billing.txt",
         help="Path to write billing output file"
     )
+    parser.add_argument(
+        "--engine", choices=("python", "numpy", "parallel", "mapreduce"), default="python",
+        help="Line-by-line Python loop, vectorized NumPy batches, one "
+             "process per byte range of the file, or the Spark job's "
+             "map/reduce functions on a local backend"
+    )
+    parser.add_argument(
+        "--backend", choices=("serial", "processes"), default="processes",
+        help="Local backend of the mapreduce engine: this process, or a pool "
+             "of worker processes"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Worker processes for the parallel and mapreduce engines "
+             "(default: CPU count)"
+    )
+    parser.add_argument(
+        "--state-dir", default=None,
+        help="Incremental mode: only aggregate input files not yet recorded "
+             "in this directory and merge them with the stored partials"
+    )
+    parser.add_argument(
+        "--window", choices=("month", "day", "hour", "minute"), default=None,
+        help="Also write a (bucket, user, task) rollup at this granularity"
+    )
+    parser.add_argument(
+        "--rollup-path", default=None,
+        help="Where to write the rollup CSV (default: next to --output-path)"
+    )
+    parser.add_argument(
+        "--cube", default=None,
+        help="Also write a cost cube over user, task and status class: 'cube', "
+             "'rollup' or grouping sets such as 'task,status_class,user+task,total'"
+    )
+    parser.add_argument(
+        "--cube-path", default=None,
+        help="Where to write the cube CSV (default: next to --output-path)"
+    )
+    parser.add_argument(
+        "--analytics", action="store_true",
+        help="Also build mergeable usage sketches (distinct users and duration "
+             "quantiles per task, heaviest users) and write them next to the output"
+    )
+    parser.add_argument(
+        "--memory-budget", type=int, default=None,
+        help="Keep memory to about this many MiB (per-user totals and read "
+             "buffers) and spill sorted runs to disk beyond it (python engine)"
+    )
+    parser.add_argument(
+        "--spill-dir", default=None,
+        help="Directory for spilled runs (default: the system temp directory)"
+    )
+    parser.add_argument(
+        "--index", action="store_true",
+        help="Also write a binary results file with a sorted user index "
+             "(<output>.idx) for per-user lookups"
+    )
     args = parser.parse_args()
+    if args.engine == "parallel" and args.input_path.startswith(S3_SCHEMES):
+        parser.error("--engine parallel splits local files into byte ranges; "
+                     "use another engine for S3 input")
+    if args.window and (args.engine != "python" or args.state_dir):
+        parser.error("--window requires --engine python without --state-dir")
+    if args.analytics and (args.engine != "python" or args.state_dir or args.window):
+        parser.error("--analytics requires --engine python without --state-dir or --window")
 
-    results = aggregate_naive(args.input_path)
+    if args.memory_budget is not None and (
+            args.engine != "python" or args.state_dir or args.window or args.analytics
+            or args.cube or args.memory_budget <= 0):
+        parser.error("--memory-budget must be positive and requires --engine python "
+                     "without --state-dir, --window, --analytics or --cube")
+    if args.cube:
+        from mapreduce_billing.cube import parse_grouping_sets
 
-    out_dir = os.path.dirname(args.output_path)
-    if out_dir and not os.path.exists(out_dir):
-        os.makedirs(out_dir, exist_ok=True)
+        if args.engine != "python" or args.state_dir or args.window or args.analytics:
+            parser.error("--cube requires --engine python without --state-dir, "
+                         "--window or --analytics")
+        try:
+            cube_sets = parse_grouping_sets(args.cube)
+        except ValueError as e:
+            parser.error(f"--cube: {e}")
+
+    # Loaded once: every engine costs with this table, and its version is
+    # what the output's .rates.json records
+    rate_table = load_rate_table()
+
+    if args.engine == "numpy":
+        from mapreduce_billing.numpy_aggregation import aggregate_numpy
+        aggregate = lambda path: aggregate_numpy(path, rates=rate_table)
+    elif args.engine == "parallel":
+        from mapreduce_billing.parallel_aggregation import aggregate_parallel
+        aggregate = lambda path: aggregate_parallel(path, args.workers, rate_table)
+    elif args.engine == "mapreduce":
+        from mapreduce_billing.engines import aggregate_mapreduce
+        aggregate = lambda path: aggregate_mapreduce(path, args.backend, args.workers, rate_table)
+    else:
+        aggregate = lambda path: aggregate_naive(path, rates=rate_table)
+
+    spilled = None
+    if args.memory_budget:
+        from mapreduce_billing.spill import aggregate_spilling
+
+        spilled = aggregate_spilling(
+            args.input_path, args.memory_budget * 1024 * 1024, args.spill_dir, rate_table
+        )
+    elif args.state_dir:
+        from mapreduce_billing.incremental import aggregate_incremental
+
+        def aggregate_files(paths):
+            return {
+                path: {
+                    user: (metrics['total_duration_ms'], metrics['total_cost_micros'])
+                    for user, metrics in aggregate(path).items()
+                }
+                for path in paths
+            }
+
+        totals = aggregate_incremental(
+            args.input_path, args.state_dir, aggregate_files,
+            rates_version=rate_table.version
+        )
+        results = {
+            user: {'total_duration_ms': duration, 'total_cost_micros': cost}
+            for user, (duration, cost) in totals.items()
+        }
+    elif args.window:
+        from mapreduce_billing.windowed import aggregate_windowed, user_totals, write_rollup
+
+        rollup = aggregate_windowed(args.input_path, args.window, rate_table)
+        rollup_path = args.rollup_path or (
+            f"{os.path.splitext(args.output_path)[0]}_rollup_{args.window}.csv"
+        )
+        write_rollup(rollup_path, rollup.items())
+        results = {
+            user: {'total_duration_ms': duration, 'total_cost_micros': cost}
+            for user, (duration, cost) in user_totals(rollup).items()
+        }
+    elif args.cube:
+        from mapreduce_billing.cube import USER_SET, aggregate_cube, cube_user_totals, write_cube
+
+        # Billing comes from the ("user",) set of the same cube
+        billing_sets = cube_sets if USER_SET in cube_sets else cube_sets + [USER_SET]
+        cube = aggregate_cube(args.input_path, billing_sets, rate_table)
+        cube_path = args.cube_path or f"{os.path.splitext(args.output_path)[0]}_cube.csv"
+        write_cube(cube_path, cube.items(), cube_sets)
+        results = {
+            user: {'total_duration_ms': duration, 'total_cost_micros': cost}
+            for user, (duration, cost) in cube_user_totals(cube).items()
+        }
+    elif args.analytics:
+        from mapreduce_billing.sketches import BillingSketches, save_sketches
+
+        sketches = BillingSketches()
+        results = aggregate_naive(args.input_path, sketches, rate_table)
+        save_sketches(sketches, f"{os.path.splitext(args.output_path)[0]}.sketches.json")
+        print(json.dumps(sketches.summary(), indent=2))
+    else:
+        results = aggregate(args.input_path)
+
+    if spilled is not None:
+        records = spilled.sorted_items
+    else:
+        records = lambda: sorted_records(results)
+    try:
+        write_billing_records(args.output_path, records(), rate_table)
+        if args.index:
+            from mapreduce_billing.billing_index import write_billing_index
 
-    # Write results
-    with open(args.output_path, 'w') as out_f:
-        for user, metrics in sorted(results.items()):
-            duration = metrics['total_duration_ms']
-            cost = metrics['total_cost']
-            out_f.write(f"{user}: total_duration={duration}ms, total_cost={cost:.2f}\n")
+            write_billing_index(f"{os.path.splitext(args.output_path)[0]}.idx", records())
+    finally:
+        if spilled is not None:
+            spilled.close()
 
 
 if __name__ == "__main__":
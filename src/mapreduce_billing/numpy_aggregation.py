@@ -0,0 +1,306 @@
+"""
+Vectorized single-node billing aggregation with NumPy:
+- aggregate_numpy: locate the fields of large blocks of the log file in
+  bulk, map users and tasks to integer codes with np.unique (only distinct
+  tokens reach Python) and sum durations and costs with np.bincount
+
+Blocks that cannot be tokenized safely in bulk (non-ASCII bytes, tabs or
+carriage returns, irregular spacing, lines without exactly five fields or
+unusual durations) fall back to parse_line, so results and error messages
+match aggregate_naive. Blocks whose costs or running totals could overflow
+int64 are summed with Python integers instead, so totals stay exact.
+"""
+
+import io
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from utils.io import iter_blocks
+from .naive_aggregation import parse_line
+from .rates import rates_value, to_micros
+
+BLOCK_SIZE = 64 * 1024 * 1024
+
+# Separators on which str.split(), bytes.split() and universal newlines can
+# disagree, and NUL, which _Codes.encode_spans pads tokens with; any of them
+# sends the block down the line-by-line path.
+_IRREGULAR = (b"\t", b"\x0b", b"\x0c", b"\r", b"\x1c", b"\x1d", b"\x1e", b"\x1f", b"\x00")
+
+# Longest duration (digits plus "ms") that cannot overflow int64
+_MAX_DURATION_LEN = 20
+
+# Longer user or task tokens are coded one at a time instead of packed
+_MAX_PACKED_LEN = 64
+
+# Odd 64-bit multiplier mixing the packed words of a token into one hash
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+# float64 bincount sums integers exactly below this bound
+_EXACT_FLOAT_SUM = 2 ** 53
+
+# int64 sums are exact while every partial sum stays below this bound
+_INT64_LIMIT = 2 ** 63
+
+
+class _Codes(dict):
+    """Token to dense integer code, assigning the next code to unseen tokens."""
+
+    def __missing__(self, token):
+        code = self[token] = len(self)
+        return code
+
+    def encode(self, tokens):
+        """Codes of a list of byte tokens, looked up one at a time."""
+        return np.fromiter(map(self.__getitem__, tokens), np.int64, len(tokens))
+
+    def encode_spans(self, buf, starts, ends):
+        """
+        Codes of the tokens ``buf[starts[i]:ends[i]]`` as an int64 array.
+
+        Tokens are packed into rows of uint64 words, hashed and deduplicated
+        with np.unique, so only the block's distinct tokens reach Python.
+        Tokens must not contain NUL bytes, which the packing pads with, and
+        ``buf`` must extend _MAX_PACKED_LEN bytes past the last token.
+        """
+        lengths = ends - starts
+        width = int(lengths.max())
+        if width > _MAX_PACKED_LEN:
+            return self.encode([buf[s:e].tobytes() for s, e in zip(starts.tolist(), ends.tolist())])
+        words = -(-width // 8)
+        packed = _windows(buf, starts, 8 * words)
+        packed *= np.arange(8 * words) < lengths[:, None]
+        packed = packed.view(np.uint64)
+        hashes = packed[:, 0].copy()
+        for j in range(1, words):
+            hashes *= _HASH_MULTIPLIER
+            hashes ^= packed[:, j]
+        _, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+        if not np.array_equal(packed, packed[first][inverse]):
+            # Two distinct tokens share a hash
+            return self.encode([buf[s:e].tobytes() for s, e in zip(starts.tolist(), ends.tolist())])
+        distinct = [buf[s:e].tobytes() for s, e in zip(starts[first].tolist(), ends[first].tolist())]
+        return self.encode(distinct)[inverse]
+
+
+def _windows(buf, starts, width):
+    """Copies of the ``width`` bytes of ``buf`` from each of ``starts``, one per row."""
+    return sliding_window_view(buf, width)[starts]
+
+
+def _field_spans(block):
+    """
+    Start and end offsets of the five fields of every non-empty line, as
+    two (lines, 5) arrays over the block's bytes. The returned buffer is
+    the block followed by _MAX_PACKED_LEN zero bytes.
+
+    Returns None unless every line of the block is empty or exactly five
+    ASCII tokens separated by single spaces.
+    """
+    if not block.isascii() or any(sep in block for sep in _IRREGULAR):
+        return None
+    buf = np.frombuffer(block, dtype=np.uint8)
+    seps = np.flatnonzero((buf == 32) | (buf == 10))
+    is_newline = buf[seps] == 10
+    # Only empty lines may put two separators next to each other
+    adjacent = np.flatnonzero(np.diff(seps) == 1)
+    if not np.all(is_newline[adjacent] & is_newline[adjacent + 1]):
+        return None
+    if buf[0] == 32 or buf[-1] == 32:
+        return None
+
+    line_ends = np.flatnonzero(is_newline)
+    if buf[-1] != 10:
+        line_ends = np.append(line_ends, len(seps))
+        line_stops = np.append(seps[is_newline], len(buf))
+    else:
+        line_stops = seps[is_newline]
+    spaces = np.diff(line_ends, prepend=-1) - 1
+    empty = np.diff(line_stops, prepend=-1) == 1
+    if not np.all((spaces == 4) | ((spaces == 0) & empty)):
+        return None
+
+    full = spaces == 4
+    line_starts = np.concatenate(([0], line_stops[:-1] + 1))[full]
+    field_seps = seps[~is_newline].reshape(-1, 4)
+    starts = np.column_stack((line_starts, field_seps + 1))
+    ends = np.column_stack((field_seps, line_stops[full]))
+    return np.concatenate((buf, np.zeros(_MAX_PACKED_LEN, np.uint8))), starts, ends
+
+
+def _parse_durations(buf, starts, ends):
+    """
+    Convert ``NNNms`` tokens at the given offsets to int64 in one pass.
+
+    Returns None unless every token is ASCII digits followed by "ms".
+    """
+    lengths = ends - starts
+    digits = lengths - 2
+    if digits.min() < 1 or lengths.max() > _MAX_DURATION_LEN:
+        return None
+    if not (np.all(buf[ends - 2] == ord("m")) and np.all(buf[ends - 1] == ord("s"))):
+        return None
+    width = int(digits.max())
+    present = np.arange(width) < digits[:, None]
+    chars = _windows(buf, starts, width)
+    if not np.all(((chars >= ord("0")) & (chars <= ord("9"))) | ~present):
+        return None
+    durations = np.zeros(len(starts), dtype=np.int64)
+    for j in range(width):
+        digit = chars[:, j].astype(np.int64) - ord("0")
+        durations = np.where(present[:, j], durations * 10 + digit, durations)
+    return durations
+
+
+def _tokenize_block(block):
+    """
+    Locate users, tasks and durations of a block in bulk.
+
+    Returns:
+        tuple | None: ``(buf, starts, ends)`` spans of the users and of the
+            tasks, and the int64 durations; None if the block needs the
+            line-by-line fallback.
+    """
+    spans = _field_spans(block)
+    if spans is None:
+        return None
+    buf, starts, ends = spans
+    if not len(starts):
+        return (buf, starts[:, 1], ends[:, 1]), (buf, starts[:, 2], ends[:, 2]), np.zeros(0, np.int64)
+    durations = _parse_durations(buf, starts[:, 4], ends[:, 4])
+    if durations is None:
+        return None
+    return (buf, starts[:, 1], ends[:, 1]), (buf, starts[:, 2], ends[:, 2]), durations
+
+
+def _parse_block_lines(block):
+    """
+    Line-by-line fallback using parse_line, mirroring aggregate_naive.
+    Durations are returned as Python ints, which may not fit in int64.
+    """
+    users, tasks, durations = [], [], []
+    for line in io.StringIO(block.decode("utf-8"), newline=None):
+        if not line.strip():
+            continue
+        user, task, duration = parse_line(line)
+        users.append(user.encode("utf-8"))
+        tasks.append(task.encode("utf-8"))
+        durations.append(duration)
+    return users, tasks, durations
+
+
+def _sum_by_code(codes, values, size):
+    """Exact int64 per-code sums of int64 ``values``."""
+    # bincount accumulates in float64, which is exact while every partial sum
+    # fits in 53 bits; otherwise use the slower integer scatter-add.
+    if len(values) and _max_abs(values) * len(values) < _EXACT_FLOAT_SUM:
+        return np.rint(np.bincount(codes, weights=values, minlength=size)).astype(np.int64)
+    sums = np.zeros(size, dtype=np.int64)
+    np.add.at(sums, codes, values)
+    return sums
+
+
+def _max_abs(values):
+    # In Python ints: np.abs overflows on the int64 minimum
+    return max(int(values.max()), -int(values.min()))
+
+
+def _as_int64(durations):
+    """Durations as an int64 array, or None if one does not fit."""
+    if isinstance(durations, np.ndarray):
+        return durations
+    try:
+        return np.array(durations, dtype=np.int64)
+    except OverflowError:
+        return None
+
+
+def _add_exact(totals, users_idx, tasks_idx, durations, rates):
+    """Add a block to per-code Python-int [duration, cost] totals."""
+    for user, task, duration in zip(users_idx.tolist(), tasks_idx.tolist(), durations):
+        cost = duration * rates[task]
+        entry = totals.get(user)
+        if entry is None:
+            totals[user] = [duration, cost]
+        else:
+            entry[0] += duration
+            entry[1] += cost
+
+
+def _grow(array, size):
+    if size <= len(array):
+        return array
+    grown = np.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def aggregate_numpy(input_path: str, block_size: int = BLOCK_SIZE, rates=None):
+    """
+    Vectorized equivalent of aggregate_naive.
+
+    Args:
+        input_path (str): local path or S3 URI of the API logs.
+        block_size (int): bytes read and tokenized per batch.
+        rates (RateTableSnapshot | dict | None): per-task rates, loaded
+            if None.
+
+    Returns:
+        dict[str, dict]: user to {'total_duration_ms': int, 'total_cost_micros': int}.
+    """
+    rates = rates_value(rates)
+    user_codes = _Codes()
+    task_codes = _Codes()
+    rate_vector = np.zeros(0, dtype=np.int64)
+    durations_total = np.zeros(0, dtype=np.int64)
+    costs_total = np.zeros(0, dtype=np.int64)
+    # Upper bounds of any int64 running total, kept in Python ints, and the
+    # exact totals of blocks that would have exceeded them
+    duration_bound = cost_bound = 0
+    exact_totals = {}
+
+    for block in iter_blocks(input_path, block_size):
+        parsed = _tokenize_block(block)
+        if parsed is None:
+            users, tasks, durations = _parse_block_lines(block)
+            if not durations:
+                continue
+            users_idx, tasks_idx = user_codes.encode(users), task_codes.encode(tasks)
+        else:
+            users, tasks, durations = parsed
+            if not len(durations):
+                continue
+            users_idx, tasks_idx = user_codes.encode_spans(*users), task_codes.encode_spans(*tasks)
+        n = len(durations)
+        if len(task_codes) > len(rate_vector):
+            rate_vector = np.array(
+                [to_micros(rates.get(task.decode("utf-8"), 0)) for task in task_codes],
+                dtype=np.int64,
+            )
+        n_users = len(user_codes)
+        int_durations = _as_int64(durations)
+        bounds = None
+        if int_durations is not None:
+            max_duration = _max_abs(int_durations)
+            bounds = (duration_bound + max_duration * n,
+                      cost_bound + max_duration * _max_abs(rate_vector) * n)
+        if bounds is None or max(bounds) >= _INT64_LIMIT:
+            # int64 could overflow: sum this block in Python ints instead
+            if isinstance(durations, np.ndarray):
+                durations = durations.tolist()
+            _add_exact(exact_totals, users_idx, tasks_idx, durations, rate_vector.tolist())
+            continue
+        duration_bound, cost_bound = bounds
+        costs = int_durations * rate_vector[tasks_idx]
+
+        durations_total = _grow(durations_total, n_users)
+        costs_total = _grow(costs_total, n_users)
+        durations_total[:n_users] += _sum_by_code(users_idx, int_durations, n_users)
+        costs_total[:n_users] += _sum_by_code(users_idx, costs, n_users)
+
+    results = {}
+    for user, code in user_codes.items():
+        duration, cost = exact_totals.get(code, (0, 0))
+        if code < len(durations_total):
+            duration += int(durations_total[code])
+            cost += int(costs_total[code])
+        results[user.decode("utf-8")] = {'total_duration_ms': duration, 'total_cost_micros': cost}
+    return results
@@ -0,0 +1,111 @@
+"""
+Multi-process single-node billing aggregation:
+- split_byte_ranges: cut a log file into newline-aligned byte ranges
+- aggregate_parallel: aggregate each range in its own worker process and
+  merge the partial per-user totals in the parent with reduce_records
+"""
+
+import os
+from multiprocessing import Pool
+from utils.io import iter_lines
+from .fast_parser import RateTable, parse_fields
+from .map_reduce import reduce_records
+from .rates import rates_value
+
+
+def split_byte_ranges(input_path: str, num_ranges: int):
+    """
+    Split a file into at most ``num_ranges`` contiguous byte ranges, each
+    starting at the beginning of a line and ending just after a newline (or
+    at end of file).
+
+    Args:
+        input_path (str): path to the API logs text file.
+        num_ranges (int): desired number of ranges.
+
+    Returns:
+        list[tuple[int, int]]: (start, end) byte offsets, end exclusive.
+    """
+    size = os.path.getsize(input_path)
+    if size == 0:
+        return []
+    boundaries = [0]
+    with open(input_path, 'rb') as f:
+        for i in range(1, num_ranges):
+            offset = size * i // num_ranges
+            if offset <= boundaries[-1]:
+                continue
+            # Move forward to the first line that starts at or after offset
+            f.seek(offset - 1)
+            f.readline()
+            boundaries.append(f.tell())
+    boundaries.append(size)
+    return [
+        (start, end)
+        for start, end in zip(boundaries, boundaries[1:])
+        if end > start
+    ]
+
+
+def _aggregate_range(task):
+    input_path, start, end, rates = task
+    rate_table = RateTable(rates)
+    totals = {}
+    for line in iter_lines(input_path, start, end):
+        if not line.strip():
+            continue
+        user, task_name, duration = parse_fields(line)
+        record = (duration, duration * rate_table.rate(task_name))
+        if user in totals:
+            totals[user] = reduce_records(totals[user], record)
+        else:
+            totals[user] = record
+    return totals
+
+
+def _merge_into(totals, partial):
+    # Folds the smaller dict into the larger and returns the larger
+    if len(totals) < len(partial):
+        totals, partial = partial, totals
+    for user, record in partial.items():
+        if user in totals:
+            totals[user] = reduce_records(totals[user], record)
+        else:
+            totals[user] = record
+    return totals
+
+
+def aggregate_parallel(input_path: str, workers: int = None, rates=None):
+    """
+    Parallel equivalent of aggregate_naive using one process per byte range.
+
+    Args:
+        input_path (str): path to the API logs text file.
+        workers (int): number of worker processes (defaults to CPU count).
+        rates (RateTableSnapshot | dict | None): per-task rates, loaded
+            if None.
+
+    Returns:
+        dict[str, dict]: user to {'total_duration_ms': int, 'total_cost_micros': int}.
+    """
+    workers = workers or os.cpu_count() or 1
+    rates = rates_value(rates)
+    ranges = split_byte_ranges(input_path, workers)
+    if not ranges:
+        return {}
+
+    # Each partial crosses the process boundary once and is merged in the
+    # parent as it arrives; merging in the pool would pickle the growing
+    # totals back and forth on every round
+    totals = {}
+    with Pool(processes=min(workers, len(ranges))) as pool:
+        for partial in pool.imap_unordered(
+            _aggregate_range,
+            [(input_path, start, end, rates) for start, end in ranges],
+        ):
+            totals = _merge_into(totals, partial)
+
+    return {
+        user: {'total_duration_ms': duration, 'total_cost_micros': cost}
+        for user, (duration, cost) in totals.items()
+    }
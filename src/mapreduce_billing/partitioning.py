@@ -0,0 +1,111 @@
+"""
+Input and shuffle partition planning for the Spark job:
+- available_parallelism: task slots the job can scale to, from the executor
+  and dynamic allocation settings
+- plan_partitions: split size, input partitions and shuffle partitions for
+  a listed input, coalescing many small files into fewer tasks
+- plan_input: list a local path, glob or S3 prefix and plan it
+"""
+
+import math
+import os
+from utils.io import S3_SCHEMES, list_input_files
+
+MIB = 1024 * 1024
+MIN_SPLIT_BYTES = 8 * MIB
+MAX_SPLIT_BYTES = 128 * MIB
+TASKS_PER_CORE = 2
+
+
+def available_parallelism(conf, default_parallelism=1):
+    """
+    Number of concurrent tasks the job can scale to.
+
+    With dynamic allocation this is maxExecutors times executor cores, not
+    the handful of executors that happen to be up when the job starts.
+
+    Args:
+        conf (Callable[[str, str], str]): Spark conf lookup, e.g.
+            ``sc.getConf().get``.
+        default_parallelism (int): ``sc.defaultParallelism``, used as a floor.
+
+    Returns:
+        int: task slots.
+    """
+    cores = int(conf("spark.executor.cores", "1"))
+    if conf("spark.dynamicAllocation.enabled", "false").lower() == "true":
+        executors = int(conf("spark.dynamicAllocation.maxExecutors", "0"))
+    else:
+        executors = int(conf("spark.executor.instances", "0"))
+    return max(executors * cores, default_parallelism, 1)
+
+
+def plan_partitions(file_sizes, parallelism, tasks_per_core=TASKS_PER_CORE,
+                    min_split_bytes=MIN_SPLIT_BYTES, max_split_bytes=MAX_SPLIT_BYTES):
+    """
+    Choose split and partition counts for an input.
+
+    Splits aim for ``tasks_per_core`` tasks per slot, but never go below
+    ``min_split_bytes`` (so small inputs are not shredded into tiny tasks)
+    or above ``max_split_bytes`` (so huge inputs still have bounded tasks).
+
+    Args:
+        file_sizes (list[int]): size in bytes of every input file.
+        parallelism (int): task slots, see available_parallelism.
+
+    Returns:
+        dict: ``input_bytes``, ``files``, ``parallelism``, ``split_bytes``,
+            ``input_partitions`` (minPartitions for textFile),
+            ``shuffle_partitions`` and ``coalesce`` (True when there are more
+            files than planned input partitions).
+    """
+    total = sum(file_sizes)
+    slots = max(parallelism, 1) * tasks_per_core
+    split = min(max(math.ceil(total / slots), min_split_bytes), max_split_bytes)
+    input_partitions = max(1, math.ceil(total / split))
+    return {
+        "input_bytes": total,
+        "files": len(file_sizes),
+        "parallelism": parallelism,
+        "split_bytes": split,
+        "input_partitions": input_partitions,
+        "shuffle_partitions": min(input_partitions, slots),
+        "coalesce": len(file_sizes) > input_partitions,
+    }
+
+
+def plan_input(input_path, parallelism, recursive=False, **kwargs):
+    """
+    List ``input_path`` and plan its partitions.
+
+    ``s3a://`` and ``s3n://`` URIs are listed through S3 like ``s3://``
+    (S3 prefixes always include nested keys). If the input cannot be listed
+    (e.g. an HDFS path), the plan falls back to ``tasks_per_core`` input
+    partitions per task slot.
+
+    Args:
+        input_path (str): file, directory, glob or S3 URI.
+        parallelism (int): task slots, see available_parallelism.
+        recursive (bool): include files in subdirectories of a local
+            directory, as Spark does for partitioned Parquet datasets.
+    """
+    if "://" in input_path and not input_path.startswith(S3_SCHEMES):
+        slots = max(parallelism, 1) * kwargs.get("tasks_per_core", TASKS_PER_CORE)
+        return {
+            "input_bytes": None,
+            "files": None,
+            "parallelism": parallelism,
+            "split_bytes": None,
+            "input_partitions": slots,
+            "shuffle_partitions": slots,
+            "coalesce": False,
+        }
+    if recursive and os.path.isdir(input_path):
+        sizes = [
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(input_path)
+            for name in names
+        ]
+    else:
+        sizes = [size for _, size, _ in list_input_files(input_path)]
+    return plan_partitions(sizes, parallelism, **kwargs)
@@ -0,0 +1,156 @@
+"""
+Versioned per-task rate tables and fixed-point costs:
+- load_rate_table: load rates once from a JSON file, an S3 object or the
+  RATE_* environment, validate them and stamp them with a version
+- broadcast_rates / rates_value: ship a table to Spark executors once as a
+  broadcast variable instead of pickling it into every task closure
+- to_micros / format_cost: costs are integer micro-units (1e-6 of the
+  currency), so sums are exact and independent of reduction order
+
+Rates are cost per millisecond with at most six decimal places, so each
+record's cost ``duration_ms * to_micros(rate)`` is an exact integer.
+
+Rate file format::
+
+    {"version": "2025-05-01", "rates": {"login": 0.005, "createOrder": 0.010}}
+
+``version`` is optional; without it the version is derived from the rates,
+so identical tables always carry the same version.
+"""
+
+import hashlib
+import json
+import math
+import os
+from decimal import Decimal
+from typing import NamedTuple
+from dotenv import load_dotenv
+from utils.io import read_bytes
+
+RATES_PATH_ENV = "BILLING_RATES_PATH"
+MICROS_PER_UNIT = 1_000_000
+MICROS_PER_CENT = MICROS_PER_UNIT // 100
+
+
+def to_micros(rate):
+    """
+    Convert a rate (cost per ms) to integer micro-units per ms.
+
+    Raises:
+        ValueError: if the rate has more than six decimal places.
+    """
+    scaled = Decimal(repr(float(rate))) * MICROS_PER_UNIT
+    if scaled != scaled.to_integral_value():
+        raise ValueError(f"Rate {rate} has more than 6 decimal places")
+    return int(scaled)
+
+
+def format_cost(micros):
+    """Format a micro-unit amount as currency, rounding half-cents away from zero."""
+    cents, remainder = divmod(abs(micros), MICROS_PER_CENT)
+    if 2 * remainder >= MICROS_PER_CENT:
+        cents += 1
+    sign = "-" if micros < 0 and cents else ""
+    return f"{sign}{cents // 100}.{cents % 100:02d}"
+
+
+class RateTableSnapshot(NamedTuple):
+    """A validated, immutable set of per-task rates and where it came from."""
+    version: str
+    rates: dict
+    source: str
+
+    def stamp(self):
+        """JSON-serializable record of the rates used for a billing run."""
+        return {"version": self.version, "source": self.source, "rates": dict(sorted(self.rates.items()))}
+
+
+def validate_rates(rates):
+    """
+    Check task names and rates, returning them as a ``{str: float}`` dict.
+
+    Raises:
+        ValueError: for empty or whitespace-containing task names, and for
+            rates that are not finite non-negative numbers with at most six
+            decimal places.
+    """
+    validated = {}
+    for task, value in rates.items():
+        if not isinstance(task, str) or not task or task != "".join(task.split()):
+            raise ValueError(f"Invalid task name: '{task}'")
+        try:
+            rate = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid rate for {task}: {value}")
+        if not math.isfinite(rate) or rate < 0:
+            raise ValueError(f"Invalid rate for {task}: {value}")
+        try:
+            to_micros(rate)
+        except ValueError:
+            raise ValueError(f"Invalid rate for {task}: {value} (more than 6 decimal places)")
+        validated[task] = rate
+    return validated
+
+
+def rates_version(rates):
+    """Content-derived version of a rate table."""
+    canonical = json.dumps(sorted(rates.items()), separators=(",", ":"))
+    return "sha1:" + hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:12]
+
+
+def _rates_from_env():
+    load_dotenv()
+    return {
+        name.split("_", 1)[1]: value
+        for name, value in os.environ.items()
+        if name.startswith("RATE_")
+    }
+
+
+def load_rate_table(path=None):
+    """
+    Load and validate the rate table.
+
+    Args:
+        path (str | None): JSON rate file (local path or S3 URI). Defaults to
+            the BILLING_RATES_PATH environment variable; if that is unset or
+            empty, rates are read from RATE_<task> environment variables.
+
+    Returns:
+        RateTableSnapshot: the validated rates with their version and source.
+    """
+    load_dotenv()
+    path = path or os.getenv(RATES_PATH_ENV)
+    if not path:
+        rates = validate_rates(_rates_from_env())
+        return RateTableSnapshot(rates_version(rates), rates, "env")
+
+    try:
+        document = json.loads(read_bytes(path))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid rate file {path}: {e}")
+    if not isinstance(document, dict) or not isinstance(document.get("rates"), dict):
+        raise ValueError(f"Invalid rate file {path}: expected an object with a 'rates' mapping")
+    rates = validate_rates(document["rates"])
+    version = str(document.get("version") or rates_version(rates))
+    return RateTableSnapshot(version, rates, path)
+
+
+def broadcast_rates(sc, snapshot):
+    """Broadcast a snapshot's rates to the executors once."""
+    return sc.broadcast(snapshot.rates)
+
+
+def rates_value(rates):
+    """
+    Resolve the ``rates`` argument accepted by the map functions: a Spark
+    broadcast of a rates dict, a RateTableSnapshot, a plain dict, or None to
+    load the table.
+    """
+    if rates is None:
+        return load_rate_table().rates
+    if isinstance(rates, RateTableSnapshot):
+        return rates.rates
+    if hasattr(rates, "value"):
+        return rates.value
+    return rates
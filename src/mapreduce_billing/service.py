@@ -0,0 +1,284 @@
+"""
+Long-lived billing service for frequent small runs:
+- BillingService: runs billing jobs on an engine that stays warm between
+  them, either a SparkSession built once with spark_job.build_spark_session
+  or a single-node engine (no JVM at all)
+- serve: accept jobs as JSON lines over a local Unix domain socket
+- submit_job: send one job to a running service and wait for its result
+
+A job is ``{"input_path": ..., "output_path": ...}`` (output optional);
+``{"command": "ping"}`` and ``{"command": "shutdown"}`` are also accepted.
+The rate table is reloaded for every job, so rate changes need no restart.
+Jobs run one at a time in arrival order.
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import sys
+import time
+
+DEFAULT_SOCKET_PATH = "/tmp/billing-service.sock"
+LOCAL_ENGINES = ("python", "numpy", "parallel")
+ENGINES = LOCAL_ENGINES + ("spark",)
+
+
+class BillingService:
+    """
+    Holds a warm aggregation engine and runs billing jobs on it.
+
+    Args:
+        engine (str): "spark" or a single-node engine from LOCAL_ENGINES.
+        logger (logging.Logger | None): defaults to this module's logger.
+        spark (pyspark.sql.SparkSession | None): session for the "spark"
+            engine; built once from the environment if not given.
+        workers (int | None): worker processes for the "parallel" engine.
+    """
+
+    def __init__(self, engine="python", logger=None, spark=None, workers=None):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', expected one of {', '.join(ENGINES)}")
+        self.engine = engine
+        self.logger = logger or logging.getLogger(__name__)
+        self.workers = workers
+        self.spark = spark
+        self.jobs = 0
+        started = time.perf_counter()
+        if engine == "spark" and spark is None:
+            # Imported here so single-node services never load pyspark
+            from mapreduce_billing.spark_job import build_spark_session
+            self.spark = build_spark_session(self.logger)
+        self.startup_seconds = round(time.perf_counter() - started, 4)
+        self.logger.info(f"Billing service ready on {engine} in {self.startup_seconds}s")
+
+    def aggregate(self, input_path, rate_table):
+        """
+        Per-user totals of one input with the warm engine.
+
+        Returns:
+            dict[str, dict]: user to {'total_duration_ms': int, 'total_cost_micros': int}.
+        """
+        if self.engine == "spark":
+            return self._aggregate_spark(input_path, rate_table)
+        if self.engine == "numpy":
+            from mapreduce_billing.numpy_aggregation import aggregate_numpy
+            return aggregate_numpy(input_path, rates=rate_table.rates)
+        if self.engine == "parallel":
+            from mapreduce_billing.parallel_aggregation import aggregate_parallel
+            return aggregate_parallel(input_path, self.workers, rate_table.rates)
+        from mapreduce_billing.naive_aggregation import aggregate_naive
+        return aggregate_naive(input_path, rates=rate_table.rates)
+
+    def _aggregate_spark(self, input_path, rate_table):
+        from mapreduce_billing.map_reduce import map_records, reduce_records
+        from mapreduce_billing.rates import broadcast_rates
+
+        sc = self.spark.sparkContext
+        rates_bc = broadcast_rates(sc, rate_table)
+        try:
+            totals = map_records(sc.textFile(input_path), rates_bc).reduceByKey(reduce_records)
+            return {
+                user: {'total_duration_ms': duration, 'total_cost_micros': cost}
+                for user, (duration, cost) in totals.collect()
+            }
+        finally:
+            rates_bc.unpersist()
+
+    def run_job(self, job):
+        """
+        Run one billing job.
+
+        Args:
+            job (dict): ``input_path`` and optionally ``output_path``, where
+                billing lines and the rate stamp are written as by the naive job.
+
+        Returns:
+            dict: ``users``, ``total_duration_ms``, ``total_cost_micros``,
+                ``rates_version``, ``output_path`` and ``wall_seconds``.
+        """
+        from mapreduce_billing.naive_aggregation import write_billing
+        from mapreduce_billing.rates import load_rate_table
+
+        if not job.get("input_path"):
+            raise ValueError("Job is missing 'input_path'")
+        started = time.perf_counter()
+        rate_table = load_rate_table()
+        results = self.aggregate(job["input_path"], rate_table)
+        output_path = job.get("output_path")
+        if output_path:
+            write_billing(output_path, results, rate_table)
+        self.jobs += 1
+        return {
+            "users": len(results),
+            "total_duration_ms": sum(m['total_duration_ms'] for m in results.values()),
+            "total_cost_micros": sum(m['total_cost_micros'] for m in results.values()),
+            "rates_version": rate_table.version,
+            "output_path": output_path,
+            "wall_seconds": round(time.perf_counter() - started, 4),
+        }
+
+    def handle(self, request):
+        """
+        Answer one request; failures are reported in the response, so a bad
+        job never takes the service down.
+
+        Returns:
+            dict: ``status`` ("ok" or "error") with the job result, or ``error``.
+        """
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("Request must be a JSON object")
+            command = request.get("command", "run")
+            if command == "ping":
+                result = {"engine": self.engine, "jobs": self.jobs,
+                          "startup_seconds": self.startup_seconds}
+            elif command == "shutdown":
+                result = {"jobs": self.jobs}
+            elif command == "run":
+                result = self.run_job(request)
+                self.logger.info(f"Job on {request['input_path']} done: {result}")
+            else:
+                raise ValueError(f"Unknown command '{command}'")
+        except Exception as e:
+            self.logger.exception("Billing job failed")
+            return {"status": "error", "error": f"{type(e).__name__}: {e}"}
+        return {"status": "ok", **result}
+
+    def close(self):
+        """Stop the Spark session, if the service owns one."""
+        if self.spark is not None:
+            self.spark.stop()
+            self.spark = None
+
+
+def _read_message(stream):
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("Connection closed before a message was received")
+    return json.loads(line)
+
+
+def _write_message(stream, message):
+    stream.write(json.dumps(message).encode("utf-8") + b"\n")
+    stream.flush()
+
+
+def serve(service, socket_path=DEFAULT_SOCKET_PATH, ready=None):
+    """
+    Serve jobs on a Unix domain socket until a shutdown command arrives.
+    Each connection sends one JSON request line and receives one JSON
+    response line.
+
+    Args:
+        service (BillingService): the warm engine.
+        socket_path (str): socket file; a stale one is replaced, a live one
+            (another service) is an error.
+        ready (threading.Event | None): set once the socket accepts jobs.
+    """
+    if os.path.exists(socket_path):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                probe.connect(socket_path)
+        except OSError:
+            os.unlink(socket_path)
+        else:
+            raise RuntimeError(f"A billing service is already listening on {socket_path}")
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(socket_path)
+        os.chmod(socket_path, 0o600)
+        server.listen()
+        if ready is not None:
+            ready.set()
+        try:
+            while True:
+                conn, _ = server.accept()
+                request = None
+                with conn, conn.makefile("rwb") as stream:
+                    try:
+                        try:
+                            request = _read_message(stream)
+                        except ValueError as e:
+                            response = {"status": "error", "error": f"Bad request: {e}"}
+                        else:
+                            response = service.handle(request)
+                        _write_message(stream, response)
+                    except OSError as e:
+                        # The client went away; the service keeps running
+                        service.logger.warning(f"Dropped connection: {e}")
+                if isinstance(request, dict) and request.get("command") == "shutdown":
+                    break
+        finally:
+            os.unlink(socket_path)
+
+
+def submit_job(request, socket_path=DEFAULT_SOCKET_PATH, timeout=None):
+    """
+    Send one request to a running service.
+
+    Args:
+        request (dict): a job or command (see the module docstring).
+        timeout (float | None): seconds to wait for the reply.
+
+    Returns:
+        dict: the service's response.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.settimeout(timeout)
+        conn.connect(socket_path)
+        with conn.makefile("rwb") as stream:
+            _write_message(stream, request)
+            return _read_message(stream)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Warm billing aggregation service and its client"
+    )
+    parser.add_argument(
+        "--socket-path", default=os.getenv("BILLING_SERVICE_SOCKET", DEFAULT_SOCKET_PATH),
+        help="Unix domain socket the service listens on"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="Start the service")
+    serve_parser.add_argument(
+        "--engine", choices=ENGINES, default="python",
+        help="Keep a SparkSession warm, or run jobs on a single-node engine"
+    )
+    serve_parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Worker processes for the parallel engine (default: CPU count)"
+    )
+    submit_parser = commands.add_parser("submit", help="Run a job on a running service")
+    submit_parser.add_argument("--input-path", required=True, help="API logs (local or S3 URI)")
+    submit_parser.add_argument("--output-path", default=None, help="Write billing lines here")
+    commands.add_parser("ping", help="Check that the service is up")
+    commands.add_parser("shutdown", help="Stop the service")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        logging.basicConfig(
+            stream=sys.stdout,
+            level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO),
+            format="%(asctime)s %(levelname)s %(name)s - %(message)s"
+        )
+        service = BillingService(args.engine, workers=args.workers)
+        try:
+            serve(service, args.socket_path)
+        finally:
+            service.close()
+        return
+
+    if args.command == "submit":
+        request = {"input_path": args.input_path, "output_path": args.output_path}
+    else:
+        request = {"command": args.command}
+    response = submit_job(request, args.socket_path)
+    print(json.dumps(response, indent=2))
+    sys.exit(0 if response["status"] == "ok" else 1)
+
+
+if __name__ == "__main__":
+    main()
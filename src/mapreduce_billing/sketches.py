@@ -0,0 +1,423 @@
+"""
+Mergeable usage sketches computed alongside billing:
+- HyperLogLog: distinct users per task
+- DDSketch: duration quantiles per task with bounded relative error
+- HeavyHitters: heaviest users by cost (Misra-Gries summary)
+- BillingSketches: all of the above for one run; accumulates records with
+  ``add``, merges with other runs or partitions, and round-trips through JSON
+- SketchAccumulatorParam: lets a Spark accumulator merge partition sketches
+  during the billing map, so no extra pass over the logs is needed
+
+Every sketch has a fixed size or grows with the logarithm of the duration
+range, whatever the input volume. Merging is associative, so daily sketches
+can be combined into monthly ones without the raw logs.
+"""
+
+import argparse
+import base64
+import glob
+import hashlib
+import heapq
+import json
+import math
+import os
+
+SKETCHES_VERSION = 1
+HLL_PRECISION = 14
+RELATIVE_ACCURACY = 0.01
+TOP_CAPACITY = 1000
+
+# Records buffered by BillingSketches.add before folding them into sketches
+FLUSH_RECORDS = 1_000_000
+
+
+def _hash64(item):
+    if isinstance(item, str):
+        item = item.encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(item, digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """Distinct-count estimate with standard error of about 1.04 / sqrt(2**p)."""
+
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        if not 4 <= precision <= 18:
+            raise ValueError(f"HyperLogLog precision must be in [4, 18], got {precision}")
+        self.precision = precision
+        self.registers = registers if registers is not None else bytearray(1 << precision)
+
+    def add(self, item):
+        """Add a str or bytes item."""
+        h = _hash64(item)
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Union with another HyperLogLog of the same precision."""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLogs of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        """Estimated number of distinct items added."""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def to_dict(self):
+        return {
+            "precision": self.precision,
+            "registers": base64.b64encode(bytes(self.registers)).decode("ascii"),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["precision"], bytearray(base64.b64decode(data["registers"])))
+
+
+class DDSketch:
+    """
+    Quantiles of non-negative values within ``relative_accuracy`` of the
+    true value, from logarithmically sized buckets (Masson et al., 2019).
+
+    Bucket counts merge exactly, so results do not depend on how the data
+    was partitioned. Values below 1 share a single zero bucket.
+    """
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(f"relative_accuracy must be in (0, 1), got {relative_accuracy}")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value, count=1):
+        """Add ``count`` occurrences of ``value``."""
+        if value < 1:
+            self.zero_count += count
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.count += count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """Add another DDSketch with the same relative accuracy."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge DDSketches of different relative accuracy")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """Estimated ``q``-quantile (0 <= q <= 1), or None if empty."""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return max(self.min, 0)
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if rank < seen:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "bins": {str(index): count for index, count in sorted(self.bins.items())},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["relative_accuracy"])
+        sketch.bins = {int(index): count for index, count in data["bins"].items()}
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        sketch.min = data["min"]
+        sketch.max = data["max"]
+        return sketch
+
+
+class HeavyHitters:
+    """
+    Misra-Gries summary of weighted items keeping at most ``capacity``
+    counters.
+
+    Estimates are lower bounds; an item's true weight is at most its
+    estimate plus ``error``, and every item heavier than ``error`` is kept.
+    """
+
+    def __init__(self, capacity=TOP_CAPACITY):
+        self.capacity = capacity
+        self.counters = {}
+        self.error = 0
+
+    def update(self, weights):
+        """Add a mapping of item to weight."""
+        counters = self.counters
+        for item, weight in weights.items():
+            counters[item] = counters.get(item, 0) + weight
+        self._trim()
+        return self
+
+    def merge(self, other):
+        """Combine with another summary (Agarwal et al., mergeable summaries)."""
+        self.error += other.error
+        return self.update(other.counters)
+
+    def _trim(self):
+        if len(self.counters) <= self.capacity:
+            return
+        # Subtract the (capacity + 1)-th largest weight from every counter
+        cut = heapq.nlargest(self.capacity + 1, self.counters.values())[-1]
+        self.counters = {
+            item: weight - cut for item, weight in self.counters.items() if weight > cut
+        }
+        self.error += cut
+
+    def top(self, k):
+        """The ``k`` heaviest items as (item, estimated weight) pairs."""
+        return heapq.nlargest(k, self.counters.items(), key=lambda pair: (pair[1], pair[0]))
+
+    def to_dict(self):
+        return {"capacity": self.capacity, "error": self.error, "counters": self.counters}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["capacity"])
+        sketch.counters = dict(data["counters"])
+        sketch.error = data["error"]
+        return sketch
+
+
+def _text(token):
+    return token.decode("utf-8") if isinstance(token, bytes) else token
+
+
+class BillingSketches:
+    """
+    Per-task distinct users and duration quantiles plus the heaviest users
+    by cost, for one or more runs.
+
+    ``add`` buffers records and folds them into the sketches every
+    FLUSH_RECORDS records (and before any merge, query or serialization),
+    so each distinct user is hashed once per batch rather than per record.
+    """
+
+    def __init__(self, precision=HLL_PRECISION, relative_accuracy=RELATIVE_ACCURACY,
+                 top_capacity=TOP_CAPACITY):
+        self.precision = precision
+        self.relative_accuracy = relative_accuracy
+        self.records = 0
+        self.users = {}
+        self.durations = {}
+        self.top_users = HeavyHitters(top_capacity)
+        self._pending_tasks = {}
+        self._pending_costs = {}
+        self._pending = 0
+
+    def add(self, user, task, duration, cost):
+        """Add one record; user and task may be str or bytes tokens."""
+        pending = self._pending_tasks.get(task)
+        if pending is None:
+            pending = self._pending_tasks[task] = (set(), {})
+        pending[0].add(user)
+        pending[1][duration] = pending[1].get(duration, 0) + 1
+        self._pending_costs[user] = self._pending_costs.get(user, 0) + cost
+        self._pending += 1
+        if self._pending >= FLUSH_RECORDS:
+            self.flush()
+
+    def flush(self):
+        """Fold buffered records into the sketches."""
+        for task, (users, durations) in self._pending_tasks.items():
+            name = _text(task)
+            hll = self.users.get(name)
+            if hll is None:
+                hll = self.users[name] = HyperLogLog(self.precision)
+                self.durations[name] = DDSketch(self.relative_accuracy)
+            for user in users:
+                hll.add(user)
+            sketch = self.durations[name]
+            for duration, count in durations.items():
+                sketch.add(duration, count)
+        if self._pending_costs:
+            self.top_users.update(
+                {_text(user): cost for user, cost in self._pending_costs.items()}
+            )
+        self.records += self._pending
+        self._pending_tasks, self._pending_costs, self._pending = {}, {}, 0
+        return self
+
+    def merge(self, other):
+        """Merge another BillingSketches built with the same parameters."""
+        self.flush()
+        other.flush()
+        if (other.precision, other.relative_accuracy) != (self.precision, self.relative_accuracy):
+            raise ValueError("Cannot merge sketches built with different parameters")
+        for task, hll in other.users.items():
+            if task in self.users:
+                self.users[task].merge(hll)
+                self.durations[task].merge(other.durations[task])
+            else:
+                self.users[task] = HyperLogLog.from_dict(hll.to_dict())
+                self.durations[task] = DDSketch.from_dict(other.durations[task].to_dict())
+        self.top_users.merge(other.top_users)
+        self.records += other.records
+        return self
+
+    def summary(self, top=10, quantiles=(0.5, 0.99)):
+        """
+        Query the sketches.
+
+        Returns:
+            dict: ``records``, ``distinct_users``, ``top_users`` (user,
+                cost_micros lower bound and max_error) and per task
+                ``requests``, ``distinct_users`` and ``p<q>_ms`` durations.
+        """
+        self.flush()
+        all_users = HyperLogLog(self.precision)
+        for hll in self.users.values():
+            all_users.merge(hll)
+        tasks = {}
+        for task in sorted(self.users):
+            durations = self.durations[task]
+            row = {"requests": durations.count, "distinct_users": self.users[task].count()}
+            for q in quantiles:
+                value = durations.quantile(q)
+                row[f"p{q * 100:g}_ms"] = None if value is None else round(value, 1)
+            tasks[task] = row
+        return {
+            "records": self.records,
+            "distinct_users": all_users.count(),
+            "top_users": [
+                {"user": user, "cost_micros": cost, "max_error": self.top_users.error}
+                for user, cost in self.top_users.top(top)
+            ],
+            "tasks": tasks,
+        }
+
+    def to_dict(self):
+        self.flush()
+        return {
+            "version": SKETCHES_VERSION,
+            "precision": self.precision,
+            "relative_accuracy": self.relative_accuracy,
+            "records": self.records,
+            "tasks": {
+                task: {
+                    "users": self.users[task].to_dict(),
+                    "durations": self.durations[task].to_dict(),
+                }
+                for task in sorted(self.users)
+            },
+            "top_users": self.top_users.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("version") != SKETCHES_VERSION:
+            raise ValueError(f"Unsupported sketches version: {data.get('version')}")
+        sketches = cls(data["precision"], data["relative_accuracy"], data["top_users"]["capacity"])
+        sketches.records = data["records"]
+        for task, row in data["tasks"].items():
+            sketches.users[task] = HyperLogLog.from_dict(row["users"])
+            sketches.durations[task] = DDSketch.from_dict(row["durations"])
+        sketches.top_users = HeavyHitters.from_dict(data["top_users"])
+        return sketches
+
+    def __getstate__(self):
+        # Ship flushed sketches between Spark workers and the driver
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.__dict__.update(BillingSketches.from_dict(state).__dict__)
+
+
+class SketchAccumulatorParam:
+    """AccumulatorParam for ``sc.accumulator(BillingSketches(), SketchAccumulatorParam())``."""
+
+    def zero(self, value):
+        return BillingSketches(value.precision, value.relative_accuracy, value.top_users.capacity)
+
+    def addInPlace(self, value1, value2):
+        return value1.merge(value2)
+
+
+def save_sketches(sketches, path):
+    """Write sketches as JSON."""
+    with open(path, 'w') as f:
+        json.dump(sketches.to_dict(), f, separators=(",", ":"))
+
+
+def load_sketches(path):
+    """
+    Read sketches written by save_sketches, or the ``_sketches`` directory of
+    part files written by the Spark job.
+    """
+    paths = sorted(glob.glob(os.path.join(path, "part-*"))) if os.path.isdir(path) else [path]
+    merged = None
+    for part_path in paths:
+        with open(part_path) as f:
+            text = f.read().strip()
+        if text:
+            sketches = BillingSketches.from_dict(json.loads(text))
+            merged = sketches if merged is None else merged.merge(sketches)
+    if merged is None:
+        raise ValueError(f"No sketches found in {path}")
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Merge and query stored billing sketches (e.g. daily runs into a month)"
+    )
+    parser.add_argument(
+        "paths", nargs="+",
+        help="Sketch files (<output>.sketches.json) or Spark _sketches directories"
+    )
+    parser.add_argument("--top", type=int, default=10, help="Heaviest users to list")
+    parser.add_argument(
+        "--quantiles", default="0.5,0.99",
+        help="Comma-separated duration quantiles per task"
+    )
+    parser.add_argument("--output-path", default=None, help="Also save the merged sketches here")
+    args = parser.parse_args()
+
+    merged = load_sketches(args.paths[0])
+    for path in args.paths[1:]:
+        merged.merge(load_sketches(path))
+    if args.output_path:
+        save_sketches(merged, args.output_path)
+    quantiles = tuple(float(q) for q in args.quantiles.split(","))
+    print(json.dumps(merged.summary(args.top, quantiles), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Skew-aware reduction for pair RDDs dominated by a few hot keys:
+- find_hot_keys: pick the keys whose estimated share of the records exceeds
+  a fair reducer's load
+- salted_reduce: spread hot keys over N salted sub-keys for a first reduce,
+  then strip the salt and merge the sub-totals in a second reduce
+
+Cold keys always get salt 0, so the first reduce already yields their
+totals; only the hot keys' sub-totals go through the second reduce, which
+sees at most N records per hot key and partition.
+"""
+
+DEFAULT_SAMPLE_FRACTION = 0.01
+HOT_KEY_FACTOR = 2.0
+
+
+def find_hot_keys(key_counts, num_partitions, hot_factor=HOT_KEY_FACTOR):
+    """
+    Select keys whose record count exceeds ``hot_factor`` times a fair
+    reducer's share of all records.
+
+    Args:
+        key_counts (dict): key to (estimated) record count.
+        num_partitions (int): number of reduce partitions.
+        hot_factor (float): multiple of the fair share that makes a key hot.
+
+    Returns:
+        dict: hot key to record count.
+    """
+    total = sum(key_counts.values())
+    if not total:
+        return {}
+    limit = hot_factor * total / max(num_partitions, 1)
+    return {key: count for key, count in key_counts.items() if count > limit}
+
+
+def salt_partition(index, pairs, hot_keys, salts):
+    """
+    Key each (key, value) pair by (key, salt). Hot keys cycle through
+    ``salts`` sub-keys starting at an offset derived from the partition
+    index; every other key gets salt 0.
+    """
+    position = index
+    for key, value in pairs:
+        if key in hot_keys:
+            position += 1
+            yield (key, position % salts), value
+        else:
+            yield (key, 0), value
+
+
+def skew_stats(key_counts, hot_keys, num_partitions, salts, sample_fraction):
+    """
+    Summarize the sampled key distribution for logging.
+
+    Returns:
+        dict: estimated records and keys, the hot keys with their share of
+            the records, the largest key share, and the estimated largest
+            single-key load on one reducer before and after salting.
+    """
+    total = sum(key_counts.values())
+    top = max(key_counts.values(), default=0)
+    hot_top = max(hot_keys.values(), default=0)
+    cold_top = max(
+        (count for key, count in key_counts.items() if key not in hot_keys), default=0
+    )
+    return {
+        "sample_fraction": sample_fraction,
+        "estimated_records": round(total),
+        "estimated_keys": len(key_counts),
+        "partitions": num_partitions,
+        "salts": salts if hot_keys else 1,
+        "hot_keys": {key: round(count / total, 4) for key, count in sorted(hot_keys.items())},
+        "top_key_share": round(top / total, 4) if total else 0.0,
+        "max_key_load_before": round(top),
+        "max_key_load_after": round(max(hot_top / salts, cold_top)),
+    }
+
+
+def salted_reduce(pairs_rdd, reduce_fn, salts, num_partitions=None,
+                  sample_fraction=DEFAULT_SAMPLE_FRACTION, hot_factor=HOT_KEY_FACTOR,
+                  seed=None, sample_rdd=None):
+    """
+    reduceByKey that splits hot keys across ``salts`` reducers.
+
+    Key frequencies are estimated from a sample of the records. Sampling
+    ``pairs_rdd`` itself is an extra pass over its whole lineage, so when
+    the pairs are mapped from raw input, sample the input first and map
+    only the sample, and pass that as ``sample_rdd``.
+    ``reduce_fn`` must be associative and commutative, as for reduceByKey.
+
+    Args:
+        pairs_rdd (pyspark.RDD): (key, value) pairs.
+        reduce_fn (Callable): combines two values.
+        salts (int): number of sub-keys per hot key.
+        num_partitions (int | None): reduce partitions (defaults to the
+            input's partition count).
+        sample_fraction (float): fraction of records sampled.
+        hot_factor (float): see find_hot_keys.
+        seed (int | None): sampling seed.
+        sample_rdd (pyspark.RDD | None): pairs already sampled at
+            ``sample_fraction``, e.g. ``map_records(lines_rdd.sample(False,
+            fraction))`` without accumulators, so only the sampled lines are
+            parsed and none are counted twice. If None, ``pairs_rdd`` is
+            sampled.
+
+    Returns:
+        tuple[pyspark.RDD, dict]: the reduced (key, value) RDD and the
+            skew statistics from skew_stats.
+    """
+    num_partitions = num_partitions or pairs_rdd.getNumPartitions()
+    if sample_rdd is None:
+        sample_rdd = pairs_rdd.sample(False, sample_fraction, seed)
+    sampled = sample_rdd.countByKey()
+    key_counts = {key: count / sample_fraction for key, count in sampled.items()}
+    hot_keys = find_hot_keys(key_counts, num_partitions, hot_factor)
+    stats = skew_stats(key_counts, hot_keys, num_partitions, salts, sample_fraction)
+    if not hot_keys or salts < 2:
+        return pairs_rdd.reduceByKey(reduce_fn, num_partitions), stats
+
+    hot = frozenset(hot_keys)
+    partials = pairs_rdd.mapPartitionsWithIndex(
+        lambda index, pairs: salt_partition(index, pairs, hot, salts)
+    ).reduceByKey(reduce_fn, num_partitions)
+    # Both branches read the first reduce's shuffle output; only the hot
+    # sub-totals are shuffled again
+    cold_totals = partials.filter(lambda pair: pair[0][0] not in hot).map(_unsalt)
+    hot_totals = partials.filter(lambda pair: pair[0][0] in hot).map(_unsalt).reduceByKey(
+        reduce_fn, min(num_partitions, len(hot))
+    )
+    return pairs_rdd.context.union([cold_totals, hot_totals]), stats
+
+
+def _unsalt(pair):
+    (key, _), value = pair
+    return key, value
@@ -2,10 +2,32 @@ import os
 from datetime import datetime
 import sys
 import argparse
+import json
 import logging
 from dotenv import load_dotenv
 from pyspark.sql import SparkSession
-from mapreduce_billing.map_reduce import map_records, reduce_records
+from mapreduce_billing.map_reduce import (
+    ERROR_POLICIES, check_error_rate, malformed_lines, map_records, map_parsed_records,
+    reduce_records,
+)
+from mapreduce_billing.fast_parser import parse_fields
+from mapreduce_billing.naive_aggregation import format_billing_line, parse_record
+from mapreduce_billing.dataframe_aggregation import parse_lines_df, aggregate_df
+from mapreduce_billing.billing_index import write_billing_index
+from mapreduce_billing.engines import BACKENDS, create_context
+from mapreduce_billing.cube import (
+    USER_SET, cube_user_totals_rdd, map_cube_records, parse_grouping_sets, save_cube_rdd
+)
+from mapreduce_billing.ingest import read_billing_columns
+from mapreduce_billing.incremental import aggregate_incremental
+from mapreduce_billing.metrics import JobMetrics, LineCounters, write_prometheus
+from mapreduce_billing.rates import broadcast_rates, format_cost, load_rate_table
+from mapreduce_billing.partitioning import available_parallelism, plan_input
+from mapreduce_billing.sketches import BillingSketches, SketchAccumulatorParam
+from mapreduce_billing.skew import DEFAULT_SAMPLE_FRACTION, salted_reduce
+from mapreduce_billing.windowed import (
+    GRANULARITIES, bucket_key, map_windowed_records, reduce_windowed, rollup_user_totals, save_rollup_rdd
+)
 
 
 def setup_logging():
@@ -110,6 +132,254 @@ def build_spark_session(logger):
         sys.exit(1)
 
 
+def aggregate_files_rdd(sc, paths, rates=None, counters=None, on_error="fail"):
+    """
+    Aggregate several log files in one Spark job, keeping totals per file.
+
+    Args:
+        sc (pyspark.SparkContext): active context.
+        paths (list[str]): log files to aggregate.
+        rates (pyspark.Broadcast | None): broadcast per-task rates.
+        counters (metrics.LineCounters | None): see map_records.
+        on_error (str): see map_records.
+
+    Returns:
+        dict[str, dict[str, tuple[int, int]]]: file to user to
+            (duration_ms, cost_micros).
+    """
+    keyed = sc.union([
+        map_records(sc.textFile(path), rates, counters, on_error).map(
+            lambda pair, path=path: ((path, pair[0]), pair[1])
+        )
+        for path in paths
+    ])
+    partials = {}
+    for (path, user), record in keyed.reduceByKey(reduce_records).collect():
+        partials.setdefault(path, {})[user] = record
+    return partials
+
+
+def plan_job_partitions(spark, args, logger, sc=None):
+    """
+    Plan input and shuffle partitions from the input size and the task slots
+    the job can scale to, and apply the plan to Spark SQL reads and shuffles.
+    Without a Spark session (``--backend serial|processes``) the plan is
+    sized for the local context ``sc``.
+
+    Returns:
+        dict: the plan from partitioning.plan_partitions.
+    """
+    if spark is None:
+        plan = plan_input(args.input_path, sc.defaultParallelism)
+        logger.info(f"Partition plan: {plan}")
+        return plan
+    sc = spark.sparkContext
+    parallelism = available_parallelism(sc.getConf().get, sc.defaultParallelism)
+    plan = plan_input(
+        args.input_path, parallelism, recursive=args.input_format == "parquet"
+    )
+    logger.info(f"Partition plan: {plan}")
+    spark.conf.set("spark.sql.shuffle.partitions", str(plan["shuffle_partitions"]))
+    if plan["split_bytes"]:
+        spark.conf.set("spark.sql.files.maxPartitionBytes", str(plan["split_bytes"]))
+    return plan
+
+
+def read_lines_rdd(sc, input_path, plan):
+    """
+    Read log lines with the planned number of input partitions, merging the
+    splits of many small files into fewer tasks.
+    """
+    lines_rdd = sc.textFile(input_path, plan["input_partitions"])
+    if plan["coalesce"]:
+        lines_rdd = lines_rdd.coalesce(plan["input_partitions"])
+    return lines_rdd
+
+
+def build_user_totals(spark, args, logger, plan, rate_table, rates_bc, counters=None,
+                      sketches=None, sc=None):
+    """
+    Build the RDD of (user, (total_duration_ms, total_cost_micros)) for the engine,
+    input format and mode selected on the command line.
+
+    ``rate_table`` is the loaded RateTableSnapshot and ``rates_bc`` its
+    broadcast, shared by every Python map stage. ``counters`` (a
+    metrics.LineCounters) counts the text lines mapped in Python and the
+    malformed lines dropped under ``args.on_error``; ``sketches`` (an
+    accumulator of BillingSketches) is fed by the text map stage. ``sc`` is
+    the context of a local backend when ``spark`` is None.
+
+    In incremental mode the files aggregated are appended to
+    ``args.aggregated_paths``.
+    """
+    if spark is not None:
+        sc = spark.sparkContext
+    if args.state_dir:
+        def aggregate_files(paths):
+            partials = aggregate_files_rdd(sc, paths, rates_bc, counters, args.on_error)
+            args.aggregated_paths.extend(paths)
+            if counters is not None and args.on_error != "fail":
+                # Before the partials are stored, so a rejected run is redone
+                check_error_rate(counters.records.value, counters.malformed.value,
+                                 args.max_error_rate)
+            return partials
+
+        totals = aggregate_incremental(
+            args.input_path, args.state_dir, aggregate_files, logger,
+            rates_version=rate_table.version
+        )
+        return sc.parallelize(sorted(totals.items()))
+
+    if args.input_format == "parquet":
+        logger.debug("Reading billing columns from Parquet dataset")
+        records_df = read_billing_columns(spark, args.input_path)
+    elif args.engine == "dataframe":
+        logger.debug("Reading log lines as a DataFrame")
+        records_df = parse_lines_df(spark.read.text(args.input_path))
+
+    if args.engine == "dataframe":
+        logger.debug("Aggregating records with the DataFrame engine")
+        totals_df = aggregate_df(records_df, rate_table.rates)
+        return totals_df.rdd.map(lambda row: (row[0], (row[1], row[2])))
+
+    if args.input_format == "parquet":
+        logger.debug("Mapping parsed records")
+        user_pairs = map_parsed_records(records_df.rdd, rates_bc)
+    else:
+        logger.debug("Reading log lines from input path")
+        lines_rdd = read_lines_rdd(sc, args.input_path, plan)
+
+        logger.debug("Mapping records")
+        user_pairs = map_records(lines_rdd, rates_bc, counters, args.on_error, sketches)
+
+    if args.skew_salts > 1:
+        logger.debug(f"Reducing records with hot users split over {args.skew_salts} salts")
+        # Sample the input before mapping, and map the sample without
+        # accumulators so sampled lines are not counted twice
+        fraction = args.skew_sample_fraction
+        if args.input_format == "parquet":
+            sample_rdd = map_parsed_records(records_df.rdd.sample(False, fraction), rates_bc)
+        else:
+            sample_rdd = map_records(
+                lines_rdd.sample(False, fraction), rates_bc, on_error=args.on_error
+            )
+        user_totals, stats = salted_reduce(
+            user_pairs, reduce_records, args.skew_salts,
+            num_partitions=plan["shuffle_partitions"],
+            sample_fraction=fraction, sample_rdd=sample_rdd
+        )
+        logger.info(f"Skew statistics: {stats}")
+        return user_totals
+
+    logger.debug("Reducing records")
+    return user_pairs.reduceByKey(reduce_records, plan["shuffle_partitions"])
+
+
+def summarize_totals(user_totals):
+    """
+    Compute run-level summary metrics in a single pass over the totals.
+
+    Returns:
+        tuple[int, int, int]: (users, total_duration_ms, total_cost_micros).
+    """
+    return user_totals.aggregate(
+        (0, 0, 0),
+        lambda acc, pair: (acc[0] + 1, acc[1] + pair[1][0], acc[2] + pair[1][1]),
+        lambda a, b: (a[0] + b[0], a[1] + b[1], a[2] + b[2]),
+    )
+
+
+def write_results(user_totals, out_path, single_file=False, rate_table=None, sketches=None):
+    """
+    Sort totals by user and write billing lines directly from the executors,
+    without collecting them on the driver.
+
+    Args:
+        user_totals (pyspark.RDD[(str, (int, int))]): per-user totals.
+        out_path (str): output directory (local, HDFS or S3); one sorted
+            part file is written per partition.
+        single_file (bool): sort into one partition so a single part file
+            is written.
+        rate_table (RateTableSnapshot | None): if given, its version and
+            rates are written to ``<out_path>/_rates`` (ignored by readers
+            of the part files, like ``_SUCCESS``).
+        sketches (BillingSketches | None): if given, written as JSON to
+            ``<out_path>/_sketches`` (see sketches.load_sketches).
+    """
+    num_partitions = 1 if single_file else None
+    (
+        user_totals
+        .sortByKey(numPartitions=num_partitions)
+        .map(lambda pair: format_billing_line(pair[0], pair[1][0], pair[1][1]))
+        .saveAsTextFile(out_path)
+    )
+    if rate_table is not None:
+        user_totals.context.parallelize([json.dumps(rate_table.stamp())], 1).saveAsTextFile(
+            os.path.join(out_path, "_rates")
+        )
+    if sketches is not None:
+        user_totals.context.parallelize([json.dumps(sketches.to_dict())], 1).saveAsTextFile(
+            os.path.join(out_path, "_sketches")
+        )
+
+
+def write_results_index(user_totals, index_path):
+    """
+    Write the totals as a billing index (see billing_index) on the driver's
+    filesystem, streaming the sorted totals one partition at a time.
+
+    Returns:
+        int: number of users written.
+    """
+    records = (
+        (user, duration, cost)
+        for user, (duration, cost) in user_totals.sortByKey().toLocalIterator()
+    )
+    return write_billing_index(index_path, records)
+
+
+def write_quarantine(sc, input_paths, out_path, window=None, single_file=False):
+    """
+    Rescan the input and write its malformed lines (see malformed_lines) as
+    JSON part files. Only runs when lines were dropped, so clean inputs are
+    read once.
+
+    Args:
+        input_paths (list[str]): inputs of the run, as given to textFile.
+        window (str | None): the run's rollup granularity, if any; lines
+            whose timestamps cannot be bucketed are then malformed too.
+    """
+    lines_rdd = sc.textFile(",".join(input_paths))
+    if single_file:
+        lines_rdd = lines_rdd.coalesce(1)
+    if window:
+        parse = lambda line: bucket_key(parse_record(line)[0], window)
+    else:
+        parse = parse_fields
+    malformed_lines(lines_rdd, parse).saveAsTextFile(out_path)
+
+
+def report_metrics(metrics, logger, metrics_path=None):
+    """
+    Emit the run's metrics as one JSON line on stdout (merged into the
+    record by fluent-bit's kubernetes filter) and, if ``metrics_path`` is
+    given, as a Prometheus textfile. Must run before the session stops,
+    while the driver's status API is still up.
+    """
+    if metrics.sc is not None:
+        try:
+            metrics.collect_spark()
+        except Exception as e:
+            logger.warning(f"Spark stage metrics unavailable: {e}")
+    print(metrics.to_json(), flush=True)
+    if metrics_path:
+        try:
+            write_prometheus(metrics.as_dict(), metrics_path)
+            logger.info(f"Metrics written to {metrics_path}")
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {metrics_path}: {e}")
+
+
 def main():
     logger = setup_logging()
     parser = argparse.ArgumentParser(
@@ -121,46 +391,245 @@ def main():
     )
     parser.add_argument(
         "--output-dir", default=None,
-        help="If given, writes results to a timestamped file in this directory"
+        help="If given, writes results to a timestamped directory of sorted "
+             "part files in this directory"
+    )
+    parser.add_argument(
+        "--single-file", action="store_true",
+        help="Coalesce the sorted output into a single part file"
+    )
+    parser.add_argument(
+        "--engine", choices=("rdd", "dataframe"), default="rdd",
+        help="Aggregation engine: Python RDD map/reduce or JVM-native DataFrame"
+    )
+    parser.add_argument(
+        "--backend", choices=("spark",) + BACKENDS, default="spark",
+        help="Run the rdd engine on Spark, serially in this process, or on a "
+             "local pool of worker processes (text input, local output)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Worker processes and default partitions of the processes "
+             "backend (default: CPU count)"
+    )
+    parser.add_argument(
+        "--input-format", choices=("text", "parquet"), default="text",
+        help="Raw api_logs text, or the Parquet dataset written by ingest.py"
+    )
+    parser.add_argument(
+        "--state-dir", default=None,
+        help="Incremental mode: only aggregate input files not yet recorded "
+             "in this directory and merge them with the stored partials"
+    )
+    parser.add_argument(
+        "--window", choices=tuple(GRANULARITIES), default=None,
+        help="Also build a (bucket, user, task) rollup at this granularity and "
+             "write it next to the results"
+    )
+    parser.add_argument(
+        "--cube", default=None,
+        help="Also build a cost cube over user, task and status class in the "
+             "same scan: 'cube', 'rollup' or grouping sets such as "
+             "'task,status_class,user+task,total'"
+    )
+    parser.add_argument(
+        "--skew-salts", type=int, default=0,
+        help="Split users that dominate the sampled traffic over this many "
+             "sub-keys before the final merge (rdd engine; 0 disables)"
+    )
+    parser.add_argument(
+        "--skew-sample-fraction", type=float, default=DEFAULT_SAMPLE_FRACTION,
+        help="Fraction of records sampled to find hot users"
+    )
+    parser.add_argument(
+        "--on-error", choices=ERROR_POLICIES, default="fail",
+        help="Malformed lines: fail the job, skip and count them, or also "
+             "write them to a quarantine directory (rdd engine, text input)"
+    )
+    parser.add_argument(
+        "--max-error-rate", type=float, default=0.001,
+        help="With skip/quarantine, still abort when more than this fraction "
+             "of lines is malformed"
+    )
+    parser.add_argument(
+        "--quarantine-dir", default=None,
+        help="Where quarantined lines are written (default: --output-dir)"
+    )
+    parser.add_argument(
+        "--analytics", action="store_true",
+        help="Also build mergeable usage sketches in the map pass and write "
+             "them to <results>/_sketches (rdd engine, text input)"
+    )
+    parser.add_argument(
+        "--index-path", default=None,
+        help="Also write the results as a binary file with a sorted user "
+             "index to this local path on the driver"
+    )
+    parser.add_argument(
+        "--metrics-path", default=None,
+        help="Also write per-stage metrics to this Prometheus textfile "
+             "(e.g. in the node_exporter textfile collector directory)"
     )
     args = parser.parse_args()
+    if args.backend != "spark":
+        if args.engine != "rdd" or args.input_format != "text":
+            parser.error(f"--backend {args.backend} requires --engine rdd and --input-format text")
+        if "://" in (args.output_dir or "") or "://" in (args.quarantine_dir or ""):
+            parser.error(f"--backend {args.backend} writes local directories only")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be positive")
+    if args.skew_salts and (args.engine != "rdd" or args.state_dir or args.window):
+        parser.error("--skew-salts requires --engine rdd without --state-dir or --window")
+    if not 0 < args.skew_sample_fraction <= 1:
+        parser.error("--skew-sample-fraction must be in (0, 1]")
+    if args.state_dir and (args.engine != "rdd" or args.input_format != "text"):
+        parser.error("--state-dir requires --engine rdd and --input-format text")
+    if args.window and (args.engine != "rdd" or args.input_format != "text" or args.state_dir):
+        parser.error("--window requires --engine rdd and --input-format text without --state-dir")
+    if args.on_error != "fail" and (args.engine != "rdd" or args.input_format != "text"):
+        parser.error("--on-error skip/quarantine requires --engine rdd and --input-format text")
+    if not 0 <= args.max_error_rate <= 1:
+        parser.error("--max-error-rate must be in [0, 1]")
+    if args.analytics and (args.engine != "rdd" or args.input_format != "text"
+                           or args.state_dir or args.window):
+        parser.error("--analytics requires --engine rdd and --input-format text "
+                     "without --state-dir or --window")
+    if args.cube:
+        if (args.engine != "rdd" or args.input_format != "text" or args.state_dir
+                or args.window or args.skew_salts or args.analytics):
+            parser.error("--cube requires --engine rdd and --input-format text without "
+                         "--state-dir, --window, --skew-salts or --analytics")
+        try:
+            args.cube_sets = parse_grouping_sets(args.cube)
+        except ValueError as e:
+            parser.error(f"--cube: {e}")
+    args.quarantine_dir = args.quarantine_dir or args.output_dir
+    if args.on_error == "quarantine" and not args.quarantine_dir:
+        parser.error("--on-error quarantine requires --quarantine-dir or --output-dir")
+    args.aggregated_paths = []
 
+    metrics = None
     try:
         logger.info(f"Starting billing aggregation with input: {args.input_path}")
-        spark = build_spark_session(logger)
-        sc = spark.sparkContext
+        if args.backend == "spark":
+            spark = build_spark_session(logger)
+            sc = spark.sparkContext
+        else:
+            logger.info(f"Running on the local {args.backend} backend")
+            spark = None
+            sc = create_context(args.backend, args.workers)
+        metrics = JobMetrics(sc if spark is not None else None)
+        counters = LineCounters(sc)
+        sketches = None
+        if args.analytics:
+            sketches = sc.accumulator(BillingSketches(), SketchAccumulatorParam())
 
-        logger.debug("Reading log lines from input path")
-        # lines_rdd = sc.textFile(args.input_path)
-        lines_rdd = sc.textFile(args.input_path, 4)
+        rate_table = load_rate_table()
+        logger.info(
+            f"Rate table version {rate_table.version} from {rate_table.source} "
+            f"({len(rate_table.rates)} tasks)"
+        )
+        rates_bc = broadcast_rates(sc, rate_table)
 
-        logger.debug("Mapping records")
-        user_pairs = map_records(lines_rdd)
+        with metrics.stage("plan"):
+            plan = None if args.state_dir else plan_job_partitions(spark, args, logger, sc)
 
-        logger.debug("Reducing records")
-        user_totals = user_pairs.reduceByKey(reduce_records)
+        # Lazy: reading, parsing, mapping, the shuffle and the reduce all run
+        # in the summary action at the end of this stage
+        with metrics.stage("aggregate"):
+            rollup = cube = None
+            if args.window:
+                logger.debug(f"Building {args.window} rollup")
+                lines_rdd = read_lines_rdd(sc, args.input_path, plan)
+                rollup = (
+                    map_windowed_records(
+                        lines_rdd, args.window, rates_bc, counters, args.on_error
+                    )
+                    .reduceByKey(reduce_windowed, plan["shuffle_partitions"])
+                    .persist()
+                )
+                user_totals = rollup_user_totals(rollup)
+            elif args.cube:
+                # Billing comes from the ("user",) set of the same cube
+                logger.debug(f"Building cube of {args.cube_sets}")
+                lines_rdd = read_lines_rdd(sc, args.input_path, plan)
+                sets = args.cube_sets
+                billing_sets = sets if USER_SET in sets else sets + [USER_SET]
+                cube = (
+                    map_cube_records(lines_rdd, billing_sets, rates_bc, counters, args.on_error)
+                    .reduceByKey(reduce_windowed, plan["shuffle_partitions"])
+                    .persist()
+                )
+                user_totals = cube_user_totals_rdd(cube)
+            else:
+                user_totals = build_user_totals(
+                    spark, args, logger, plan, rate_table, rates_bc, counters, sketches, sc
+                )
+
+            # Reused by the summary and the writer, so compute the shuffle once
+            user_totals = user_totals.persist()
+            users, total_duration, total_cost = summarize_totals(user_totals)
+        logger.info(
+            f"Aggregated {users} users: total_duration={total_duration}ms, "
+            f"total_cost={format_cost(total_cost)}"
+        )
+        metrics.add_counters(
+            users=users, total_duration_ms=total_duration, total_cost_micros=total_cost,
+            input_bytes=plan["input_bytes"] if plan else None, **counters.values()
+        )
 
-        logger.info("Collecting results")
-        results = user_totals.collect()
-        for user, (duration, cost) in sorted(results, key=lambda x: x[0]):
-            logger.info(f"{user}: total_duration={duration}ms, total_cost={cost:.2f}")
+        if sketches is not None:
+            logger.info(f"Usage analytics: {json.dumps(sketches.value.summary())}")
+
+        ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+        malformed = counters.malformed.value
+        if malformed:
+            logger.warning(f"Dropped {malformed} malformed lines of {counters.records.value}")
+            if args.on_error == "quarantine":
+                quarantine_path = os.path.join(args.quarantine_dir, f"billing_quarantine_{ts}")
+                input_paths = args.aggregated_paths if args.state_dir else [args.input_path]
+                with metrics.stage("quarantine"):
+                    write_quarantine(
+                        sc, input_paths, quarantine_path, args.window,
+                        args.single_file
+                    )
+                logger.info(f"Malformed lines written to {quarantine_path}")
+            check_error_rate(counters.records.value, malformed, args.max_error_rate)
 
         if args.output_dir:
-            os.makedirs(args.output_dir, exist_ok=True)
-            ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-            filename = f"billing_results_{ts}.txt"
-            out_path = os.path.join(args.output_dir, filename)
-            with open(out_path, "w") as f:
-                for user, (duration, cost) in sorted(user_totals.collect(), key=lambda x: x[0]):
-                    f.write(f"{user}: total_duration={duration}ms, total_cost={cost:.2f}\n")
-        logger.info(f"Results written to {out_path}")
-        
-        spark.stop()
+            out_path = os.path.join(args.output_dir, f"billing_results_{ts}")
+            with metrics.stage("write"):
+                write_results(
+                    user_totals, out_path, args.single_file, rate_table,
+                    sketches.value if sketches is not None else None
+                )
+            logger.info(f"Results written to {out_path}")
+            if rollup is not None:
+                rollup_path = os.path.join(args.output_dir, f"billing_rollup_{args.window}_{ts}")
+                with metrics.stage("write_rollup"):
+                    save_rollup_rdd(rollup, rollup_path, args.single_file)
+                logger.info(f"Rollup written to {rollup_path}")
+            if cube is not None:
+                cube_path = os.path.join(args.output_dir, f"billing_cube_{ts}")
+                with metrics.stage("write_cube"):
+                    save_cube_rdd(cube, cube_path, args.cube_sets, args.single_file)
+                logger.info(f"Cube written to {cube_path}")
+
+        if args.index_path:
+            with metrics.stage("write_index"):
+                write_results_index(user_totals, args.index_path)
+            logger.info(f"Results index written to {args.index_path}")
+
+        metrics.finish("succeeded")
+        report_metrics(metrics, logger, args.metrics_path)
+        (spark or sc).stop()
         logger.info("Billing aggregation job completed successfully")
     except Exception:
         logger.exception("Billing aggregation job failed unexpectedly")
+        if metrics is not None:
+            metrics.finish("failed")
+            report_metrics(metrics, logger, args.metrics_path)
         sys.exit(1)
 
-
 if __name__ == "__main__":
     main()
@@ -0,0 +1,191 @@
+"""
+Out-of-core single-node aggregation for high user cardinality:
+- SpillingAccumulator: per-user totals in array-backed columns indexed by
+  interned user ids; past a memory budget the totals are written to disk
+  as a sorted run and the accumulator starts over
+- sorted_items: k-way merge of the runs and the in-memory remainder into
+  one sorted stream of (user, duration_ms, cost_micros), summing users
+  that appear in several runs
+- totals that would overflow the int64 columns are moved to a side table
+  of Python ints, so they stay exact like the in-memory engines
+- aggregate_spilling: aggregate_naive on a fixed memory budget
+
+Runs are billing index files (see billing_index), so the merge reads them
+through mmap without loading them.
+"""
+
+import heapq
+import os
+import shutil
+import tempfile
+from array import array
+from operator import itemgetter
+from .billing_index import BillingIndex, write_billing_index
+from .fast_parser import BLOCK_SIZE, RateTable, iter_parsed
+from .rates import rates_value
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+MIN_BLOCK_SIZE = 64 * 1024
+# Peak bytes held by iter_parsed per byte of block: the block itself and
+# the list of its lines
+READ_OVERHEAD = 3
+
+# Approximate bytes held per distinct user besides the key itself: the id
+# dict entry, the bytes object header, the two int64 columns and the key's
+# slot in the sorted list built when the totals are spilled
+_BYTES_PER_USER = 128
+
+
+class SpillingAccumulator:
+    """
+    Per-user (duration_ms, cost_micros) totals on a bounded memory budget.
+
+    Use as a context manager, or call close() to remove the spill files.
+
+    A user whose totals no longer fit in int64 has them moved to a table
+    of Python ints that is kept in memory across spills and merged into
+    sorted_items(); the user's column entries restart from zero.
+
+    Args:
+        memory_budget (int): approximate bytes of in-memory totals before
+            they are spilled to a sorted run.
+        spill_dir (str | None): parent directory for the run files
+            (default: the system temp directory).
+    """
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, spill_dir=None):
+        if memory_budget <= 0:
+            raise ValueError("memory_budget must be positive")
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.runs = []
+        self._tmp_dir = None
+        self._overflow = {}
+        self._reset()
+
+    def _reset(self):
+        self._ids = {}
+        self._durations = array("q")
+        self._costs = array("q")
+        self._bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, user, duration, cost):
+        """Add one record for ``user`` (str or UTF-8 bytes)."""
+        if isinstance(user, str):
+            user = user.encode("utf-8")
+        durations, costs = self._durations, self._costs
+        uid = self._ids.get(user)
+        if uid is None:
+            uid = self._ids[user] = len(durations)
+            durations.append(0)
+            costs.append(0)
+            self._bytes += _BYTES_PER_USER + len(user)
+        total_duration = durations[uid] + duration
+        total_cost = costs[uid] + cost
+        try:
+            durations[uid] = total_duration
+            costs[uid] = total_cost
+        except OverflowError:
+            overflow = self._overflow.setdefault(user, [0, 0])
+            overflow[0] += total_duration
+            overflow[1] += total_cost
+            durations[uid] = costs[uid] = 0
+        if self._bytes >= self.memory_budget:
+            self.spill()
+
+    def _sorted_memory(self, decode=True):
+        # Streams the totals in user order; only the sorted keys are
+        # materialized, one reference per user
+        ids, durations, costs = self._ids, self._durations, self._costs
+        for user in sorted(ids):
+            uid = ids[user]
+            yield user.decode("utf-8") if decode else user, durations[uid], costs[uid]
+
+    def spill(self):
+        """Write the in-memory totals to a sorted run and clear them."""
+        if not self._ids:
+            return
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix="billing-spill-", dir=self.spill_dir)
+        path = os.path.join(self._tmp_dir, f"run-{len(self.runs):05d}.idx")
+        write_billing_index(path, self._sorted_memory(decode=False))
+        self.runs.append(path)
+        self._reset()
+
+    def sorted_items(self):
+        """
+        Yield (user, duration_ms, cost_micros) for every user in user order.
+        Can be iterated more than once until the accumulator is closed.
+        """
+        readers = [BillingIndex(path) for path in self.runs]
+        try:
+            overflow = (
+                (user.decode("utf-8"), duration, cost)
+                for user, (duration, cost) in sorted(self._overflow.items())
+            )
+            merged = heapq.merge(
+                self._sorted_memory(), overflow, *(iter(reader) for reader in readers),
+                key=itemgetter(0),
+            )
+            current = None
+            for user, duration, cost in merged:
+                if current is not None and current[0] == user:
+                    current[1] += duration
+                    current[2] += cost
+                    continue
+                if current is not None:
+                    yield tuple(current)
+                current = [user, duration, cost]
+            if current is not None:
+                yield tuple(current)
+        finally:
+            for reader in readers:
+                reader.close()
+
+    def close(self):
+        """Remove the spill files."""
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+        self.runs = []
+        self._overflow = {}
+        self._reset()
+
+
+def aggregate_spilling(input_path: str, memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                       spill_dir: str = None, rates=None):
+    """
+    Equivalent of aggregate_naive whose memory use is bounded by
+    ``memory_budget`` instead of the number of users. ``rates`` (a
+    RateTableSnapshot or dict) is loaded if None.
+
+    The reader's block and its split lines take about READ_OVERHEAD times
+    the block size, so the block is sized from the budget and its working
+    set is charged against it; the accumulator gets the rest, and at least
+    a quarter of the budget.
+
+    Returns:
+        SpillingAccumulator: iterate sorted_items() for the totals, then
+            close it.
+    """
+    rate_table = RateTable(rates_value(rates))
+    codes, rates = rate_table.codes, rate_table.rates
+    block_size = max(MIN_BLOCK_SIZE, min(BLOCK_SIZE, memory_budget // (4 * READ_OVERHEAD)))
+    accumulator = SpillingAccumulator(
+        max(memory_budget - READ_OVERHEAD * block_size, memory_budget // 4, 1), spill_dir
+    )
+    add = accumulator.add
+    try:
+        for user, task, duration in iter_parsed(input_path, block_size):
+            code = codes.get(task)
+            add(user, duration, duration * (rates[code] if code is not None else rate_table.rate(task)))
+    except BaseException:
+        accumulator.close()
+        raise
+    return accumulator
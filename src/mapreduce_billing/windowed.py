@@ -0,0 +1,333 @@
+"""
+Time-windowed billing rollups per (time bucket, user, task):
+- map_windowed_records: convert each log line into
+  ((bucket, user, task), (requests, duration_ms, cost_micros))
+- reduce_windowed: sum requests, durations and costs; associative and
+  commutative, so reduceByKey combines map-side before the shuffle
+- aggregate_windowed: single-node equivalent producing the same rollup
+- coarsen / filter_rollup / window_totals: answer coarser windows from a
+  stored rollup without rescanning the raw logs
+
+Buckets are UTC ISO-8601 prefixes (``2025-05-02T23`` for an hour), so
+coarsening is truncation and windows compare lexicographically.
+"""
+
+import argparse
+import csv
+import glob
+import io
+import os
+from datetime import datetime, timezone
+from utils.io import iter_lines
+from mapreduce_billing.fast_parser import RateTable
+from mapreduce_billing.map_reduce import reduce_records
+from mapreduce_billing.naive_aggregation import load_rates, parse_record
+from mapreduce_billing.rates import rates_value
+
+# Length of the ISO-8601 prefix that identifies a bucket
+GRANULARITIES = {
+    "month": 7,
+    "day": 10,
+    "hour": 13,
+    "minute": 16,
+}
+ROLLUP_COLUMNS = ("bucket", "user", "task", "requests", "duration_ms", "cost_micros")
+
+
+def bucket_key(timestamp: str, granularity: str):
+    """
+    Label of the UTC bucket containing ``timestamp``.
+
+    Args:
+        timestamp (str): ISO-8601 timestamp, e.g. ``2025-05-02T23:16:50Z``.
+        granularity (str): one of GRANULARITIES.
+
+    Returns:
+        str: timestamp truncated to the bucket, e.g. ``2025-05-02T23``.
+    """
+    width = GRANULARITIES[granularity]
+    if len(timestamp) >= 20 and timestamp[-1] == "Z" and timestamp[10] == "T":
+        return timestamp[:width]
+    try:
+        parsed = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid timestamp: '{timestamp}'")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime("%Y-%m-%dT%H:%M:%S")[:width]
+
+
+def map_windowed_records(lines_rdd, granularity="hour", rates=None, counters=None,
+                         on_error="fail"):
+    """
+    Transform an RDD of log lines into ((bucket, user, task),
+    (requests, duration_ms, cost_micros)) pairs.
+
+    Args:
+        lines_rdd (pyspark.RDD[str]): RDD where each element is a log line string.
+        granularity (str): bucket size, one of GRANULARITIES.
+        rates (pyspark.Broadcast | dict | None): per-task rates, ideally a
+            broadcast from rates.broadcast_rates; loaded on the driver if None.
+        counters (metrics.LineCounters | None): see map_reduce.map_records.
+        on_error (str): see map_reduce.map_records; lines with unparsable
+            timestamps count as malformed.
+
+    Returns:
+        pyspark.RDD[((str, str, str), (int, int, int))]: keyed rollup rows.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: '{granularity}'")
+    if rates is None:
+        rates = load_rates()
+
+    def to_pairs(lines):
+        rate = RateTable(rates_value(rates)).rate
+        count = malformed = 0
+        for count, line in enumerate(lines, 1):
+            try:
+                timestamp, user, task, _, duration = parse_record(line)
+                bucket = bucket_key(timestamp, granularity)
+            except ValueError:
+                if on_error == "fail":
+                    raise
+                if line.strip():
+                    malformed += 1
+                continue
+            yield (bucket, user, task), (1, duration, duration * rate(task))
+        if counters is not None:
+            counters.records.add(count)
+            counters.malformed.add(malformed)
+
+    return lines_rdd.mapPartitions(to_pairs)
+
+
+def reduce_windowed(a, b):
+    """
+    Combine two (requests, duration_ms, cost_micros) tuples by summing their components.
+
+    Args:
+        a (tuple[int, int, int]): (requests, duration_ms, cost_micros)
+        b (tuple[int, int, int]): (requests, duration_ms, cost_micros)
+
+    Returns:
+        tuple[int, int, int]: summed (requests, duration_ms, cost_micros)
+    """
+    return a[0] + b[0], a[1] + b[1], a[2] + b[2]
+
+
+def rollup_user_totals(rollup_rdd):
+    """
+    Derive per-user billing totals from a reduced rollup RDD, so billing and
+    the rollup come from a single scan of the logs.
+
+    Args:
+        rollup_rdd (pyspark.RDD): output of map_windowed_records reduced with
+            reduce_windowed.
+
+    Returns:
+        pyspark.RDD[(str, (int, int))]: user to (duration, cost_micros) tuples.
+    """
+    return rollup_rdd.map(
+        lambda pair: (pair[0][1], (pair[1][1], pair[1][2]))
+    ).reduceByKey(reduce_records)
+
+
+def aggregate_windowed(input_path: str, granularity: str = "hour", rates=None):
+    """
+    Single-node rollup of a log file, costed with ``rates`` (a
+    RateTableSnapshot or dict; loaded if None).
+
+    Returns:
+        dict[tuple[str, str, str], tuple[int, int, int]]: (bucket, user, task)
+            to (requests, duration_ms, cost_micros).
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: '{granularity}'")
+    rate = RateTable(rates_value(rates)).rate
+    rollup = {}
+    for line in iter_lines(input_path):
+        if not line.strip():
+            continue
+        timestamp, user, task, _, duration = parse_record(line)
+        key = (bucket_key(timestamp, granularity), user, task)
+        value = (1, duration, duration * rate(task))
+        rollup[key] = reduce_windowed(rollup[key], value) if key in rollup else value
+    return rollup
+
+
+def user_totals(rollup):
+    """
+    Per-user billing totals from a rollup.
+
+    Returns:
+        dict[str, tuple[int, int]]: user to (total_duration_ms, total_cost_micros).
+    """
+    totals = {}
+    for (_, user, _), (_, duration, cost) in rollup.items():
+        record = (duration, cost)
+        totals[user] = reduce_records(totals[user], record) if user in totals else record
+    return totals
+
+
+def coarsen(rollup, granularity: str):
+    """
+    Re-bucket a rollup at a coarser granularity (e.g. hourly to daily).
+
+    Args:
+        rollup (dict): (bucket, user, task) to (requests, duration_ms, cost_micros).
+        granularity (str): target granularity; must not be finer than the
+            rollup's own buckets.
+
+    Returns:
+        dict: the rollup with buckets truncated to ``granularity``.
+    """
+    width = GRANULARITIES[granularity]
+    coarse = {}
+    for (bucket, user, task), value in rollup.items():
+        if len(bucket) < width:
+            raise ValueError(
+                f"Cannot derive {granularity} buckets from '{bucket}'"
+            )
+        key = (bucket[:width], user, task)
+        coarse[key] = reduce_windowed(coarse[key], value) if key in coarse else value
+    return coarse
+
+
+def filter_rollup(rollup, start=None, end=None, user=None, task=None):
+    """
+    Select rollup rows with buckets in ``[start, end)`` and an optional
+    user/task.
+
+    ``start`` and ``end`` are ISO-8601 prefixes at any granularity no finer
+    than the rollup, e.g. ``2025-05-02`` or ``2025-05-02T13``.
+
+    Returns:
+        dict: the matching (bucket, user, task) to (requests, duration_ms, cost_micros).
+    """
+    selected = {}
+    for key, value in rollup.items():
+        bucket, row_user, row_task = key
+        if start is not None and bucket[:len(start)] < start:
+            continue
+        if end is not None and bucket[:len(end)] >= end:
+            continue
+        if user is not None and row_user != user:
+            continue
+        if task is not None and row_task != task:
+            continue
+        selected[key] = value
+    return selected
+
+
+def window_totals(rollup, start=None, end=None, user=None, task=None):
+    """
+    Sum the rollup rows selected by filter_rollup.
+
+    Returns:
+        tuple[int, int, int]: (requests, duration_ms, cost_micros).
+    """
+    total = (0, 0, 0)
+    for value in filter_rollup(rollup, start, end, user, task).values():
+        total = reduce_windowed(total, value)
+    return total
+
+
+def format_rollup_rows(rollup_items):
+    """CSV rows for (key, value) rollup items, in the order given."""
+    for (bucket, user, task), (requests, duration, cost) in rollup_items:
+        yield [bucket, user, task, requests, duration, cost]
+
+
+def write_rollup(path: str, rollup_items):
+    """
+    Write rollup items as a CSV table with a header row.
+
+    Args:
+        path (str): output file.
+        rollup_items (Iterable[tuple]): ((bucket, user, task),
+            (requests, duration_ms, cost_micros)) pairs.
+    """
+    out_dir = os.path.dirname(path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(ROLLUP_COLUMNS)
+        writer.writerows(format_rollup_rows(sorted(rollup_items)))
+
+
+def save_rollup_rdd(rollup_rdd, path: str, single_file: bool = False):
+    """
+    Write a reduced rollup RDD from the executors as sorted CSV part files,
+    each starting with a header row.
+
+    Args:
+        rollup_rdd (pyspark.RDD): (bucket, user, task) to
+            (requests, duration_ms, cost_micros) pairs.
+        path (str): output directory (local, HDFS or S3).
+        single_file (bool): sort into one partition so a single part file
+            is written.
+    """
+    def to_csv(partition):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="")
+        writer.writerow(ROLLUP_COLUMNS)
+        yield buffer.getvalue()
+        for row in format_rollup_rows(partition):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow(row)
+            yield buffer.getvalue()
+
+    num_partitions = 1 if single_file else None
+    rollup_rdd.sortByKey(numPartitions=num_partitions).mapPartitions(to_csv).saveAsTextFile(path)
+
+
+def read_rollup(path: str):
+    """
+    Read a rollup table written by write_rollup, or a directory of part files
+    written by save_rollup_rdd.
+
+    Returns:
+        dict: (bucket, user, task) to (requests, duration_ms, cost_micros).
+    """
+    paths = sorted(glob.glob(os.path.join(path, "part-*"))) if os.path.isdir(path) else [path]
+    rollup = {}
+    for part_path in paths:
+        with open(part_path, newline='') as f:
+            for row in csv.DictReader(f):
+                rollup[(row["bucket"], row["user"], row["task"])] = (
+                    int(row["requests"]), int(row["duration_ms"]), int(row["cost_micros"])
+                )
+    return rollup
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Answer coarser windows from a stored billing rollup"
+    )
+    parser.add_argument(
+        "--rollup-path", required=True,
+        help="Rollup CSV (or directory of part files) written with --window"
+    )
+    parser.add_argument(
+        "--granularity", choices=tuple(GRANULARITIES), required=True,
+        help="Bucket size of the output table"
+    )
+    parser.add_argument(
+        "--output-path", required=True,
+        help="Path to write the coarsened rollup CSV"
+    )
+    parser.add_argument("--start", default=None, help="Inclusive ISO-8601 prefix")
+    parser.add_argument("--end", default=None, help="Exclusive ISO-8601 prefix")
+    parser.add_argument("--user", default=None, help="Only this user")
+    parser.add_argument("--task", default=None, help="Only this task")
+    args = parser.parse_args()
+
+    rollup = read_rollup(args.rollup_path)
+    selected = filter_rollup(rollup, args.start, args.end, args.user, args.task)
+    write_rollup(args.output_path, coarsen(selected, args.granularity).items())
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,32 @@
 """
 Configuration loader for billing aggregation pipeline.
 Loads environment variables from .env and provides a centralized Config class.
+
+Settings that need the network (the EKS endpoint) are resolved on first
+access, so importing this module never loads the AWS SDK or blocks.
 """
 import os
-import boto3
 from dotenv import load_dotenv
 
 # Load .env into environment
 load_dotenv()
 
+
+class _lazy_attribute:
+    """Class attribute computed on first access and then cached on the class."""
+
+    def __init__(self, resolve):
+        self.resolve = resolve
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner):
+        value = self.resolve(owner)
+        setattr(owner, self.name, value)
+        return value
+
+
 class Config:
     # Environment mode: 'local' or 'aws'
     ENVIRONMENT = os.getenv("ENVIRONMENT", "kub").lower()
@@ -17,26 +35,29 @@ class Config:
     # Spark master URLs
     SPARK_MASTER_URL_LOCAL = os.getenv("SPARK_MASTER_URL_LOCAL")
     SPARK_MASTER_URL_LOCAL_K8S   = os.getenv("SPARK_MASTER_URL_LOCAL_K8S")
-    SPARK_MASTER_URL_AWS   = os.getenv("SPARK_MASTER_URL_AWS")
-    
-    if ENVIRONMENT == "aws":
-        _eks_client = boto3.client(
-            "eks",
-            region_name=os.getenv("AWS_REGION", "us-east-2")
-        )
-        CLUSTER_NAME = os.getenv("EKS_CLUSTER_NAME")
-        if not CLUSTER_NAME:
+    CLUSTER_NAME = os.getenv("EKS_CLUSTER_NAME")
+
+    @_lazy_attribute
+    def SPARK_MASTER_URL_AWS(cls):
+        # Looked up from EKS only when first needed in aws mode
+        if cls.ENVIRONMENT != "aws":
+            return os.getenv("SPARK_MASTER_URL_AWS")
+        if not cls.CLUSTER_NAME:
             raise ValueError("When ENVIRONMENT=aws you must set EKS_CLUSTER_NAME in your .env")
-        cluster_info = _eks_client.describe_cluster(name=CLUSTER_NAME)
-        SPARK_MASTER_URL_AWS = f"k8s://{cluster_info['cluster']['endpoint']}"
-    
-    SPARK_MASTER_URL = (
-        SPARK_MASTER_URL_AWS
-        if ENVIRONMENT == "aws" else
-        SPARK_MASTER_URL_LOCAL_K8S
-        if ENVIRONMENT == "kub" else
-        SPARK_MASTER_URL_LOCAL
-    )
+        import boto3
+        eks_client = boto3.client("eks", region_name=cls.AWS_REGION)
+        cluster_info = eks_client.describe_cluster(name=cls.CLUSTER_NAME)
+        return f"k8s://{cluster_info['cluster']['endpoint']}"
+
+    @_lazy_attribute
+    def SPARK_MASTER_URL(cls):
+        return (
+            cls.SPARK_MASTER_URL_AWS
+            if cls.ENVIRONMENT == "aws" else
+            cls.SPARK_MASTER_URL_LOCAL_K8S
+            if cls.ENVIRONMENT == "kub" else
+            cls.SPARK_MASTER_URL_LOCAL
+        )
 
 
     # Spark application name
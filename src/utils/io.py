@@ -1,29 +1,325 @@
+import collections
+import functools
+import glob
+import itertools
+import mmap
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
 from urllib.parse import urlparse
 
-import boto3
-from botocore.exceptions import BotoCoreError, ClientError
+DEFAULT_BLOCK_SIZE = 64 * 1024 * 1024
+S3_CHUNK_SIZE = 1024 * 1024
+S3_PART_SIZE = 8 * 1024 * 1024
+S3_MAX_WORKERS = 16
+# Hadoop's s3a:// and s3n:// name the same objects as s3://
+S3_SCHEMES = ("s3://", "s3a://", "s3n://")
 
 
-def read_lines(path: str) -> list[str]:
-    if path.startswith("s3://"):
+@functools.lru_cache(maxsize=None)
+def _s3_client_for(pid: int):
+    # Imported lazily so local runs never load the AWS SDK
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client(
+        's3',
+        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+        region_name=os.getenv('AWS_REGION'),
+        config=Config(
+            max_pool_connections=2 * S3_MAX_WORKERS,
+            retries={'max_attempts': 5, 'mode': 'standard'},
+        ),
+    )
+
+
+def _s3_client():
+    # One pooled client per process: clients are thread-safe, but their
+    # connection pools must not be shared with forked children
+    return _s3_client_for(os.getpid())
+
+
+def _s3_body(path: str, start: int = 0, end: Optional[int] = None):
+    parsed = urlparse(path)
+    bucket = parsed.netloc
+    key = parsed.path.lstrip("/")
+    kwargs = {}
+    if start or end is not None:
+        last = "" if end is None else end - 1
+        kwargs['Range'] = f"bytes={start}-{last}"
+    return _s3_client().get_object(Bucket=bucket, Key=key, **kwargs)['Body']
+
+
+def _s3_get(path: str, start: int, end: int) -> bytes:
+    return _s3_body(path, start, end).read()
+
+
+def _iter_s3_lines(path: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+    # The GET is open-ended so the line straddling ``end`` is read whole;
+    # the body is closed at the first line starting at or after ``end``
+    body = _s3_body(path, start)
+    try:
+        pos = start
+        buffer = b""
+        while end is None or pos < end:
+            chunk = body.read(S3_CHUNK_SIZE)
+            if not chunk:
+                if buffer:
+                    yield buffer
+                return
+            lines = (buffer + chunk).split(b"\n")
+            buffer = lines.pop()
+            for line in lines:
+                if end is not None and pos >= end:
+                    return
+                yield line
+                pos += len(line) + 1
+    finally:
+        body.close()
+
+
+def list_input_files(path: str) -> list[tuple[str, int, str]]:
+    """
+    Expand an input path into the log files it refers to.
+
+    Accepts a single file, a directory (all regular files inside, not
+    recursive), a glob pattern, or an S3 URI naming an object or a prefix
+    (all objects under it, including nested keys). ``s3a://`` and
+    ``s3n://`` URIs are listed like ``s3://`` and keep their scheme in the
+    returned paths, so they can be handed back to Spark.
+
+    Returns:
+        list[tuple[str, int, str]]: sorted (path, size, version) tuples, where
+            version changes whenever the file content may have changed
+            (modification time for local files, ETag for S3 objects).
+    """
+    if path.startswith(S3_SCHEMES):
         parsed = urlparse(path)
         bucket = parsed.netloc
-        key = parsed.path.lstrip("/")
-        s3 = boto3.client(
-            's3',
-            aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-            region_name=os.getenv('AWS_REGION')
-        )
-        try:
-            obj = s3.get_object(Bucket=bucket, Key=key)
-            content = obj['Body'].read().decode('utf-8')
-        except (ClientError, BotoCoreError) as e:
-            raise
-        return content.splitlines()
+        prefix = parsed.path.lstrip("/")
+        paginator = _s3_client().get_paginator('list_objects_v2')
+        files = []
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                if obj['Key'].endswith("/"):
+                    continue
+                files.append((
+                    f"{parsed.scheme}://{bucket}/{obj['Key']}", obj['Size'], obj['ETag'].strip('"')
+                ))
+        # A URI naming an object means that object, not every key it prefixes
+        exact = [entry for entry in files if entry[0] == path]
+        return exact or sorted(files)
+
+    if os.path.isdir(path):
+        candidates = [os.path.join(path, name) for name in os.listdir(path)]
     else:
-        if not os.path.exists(path):
-            raise FileNotFoundError(f"Local file not found: {path}")
+        candidates = glob.glob(path)
+    files = []
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            stat = os.stat(candidate)
+            files.append((candidate, stat.st_size, str(stat.st_mtime_ns)))
+    if not files and not glob.has_magic(path) and not os.path.isdir(path):
+        raise FileNotFoundError(f"Local file not found: {path}")
+    return sorted(files)
+
+
+def _open_mmap(path: str):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Local file not found: {path}")
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _close_mmap(mm):
+    try:
+        mm.close()
+    except BufferError:
+        # A caller still holds a memoryview; the map is released with it
+        pass
+
+
+def iter_records(path: str, start: int = 0, end: Optional[int] = None) -> Iterator[memoryview]:
+    """
+    Lazily yield each line of a local file as a zero-copy memoryview over a
+    read-only memory map, without its trailing newline.
+
+    The views are only valid while the iterator is open; copy them with
+    ``bytes(view)`` to keep one. S3 URIs yield ``bytes`` lines instead.
+
+    Args:
+        path (str): local path or S3 URI.
+        start (int): byte offset of the first line (must start a line).
+        end (int | None): byte offset to stop at; a line starting before
+            ``end`` is yielded whole.
+    """
+    if path.startswith(S3_SCHEMES):
+        for line in _iter_s3_lines(path, start, end):
+            yield memoryview(line)
+        return
+
+    mm = _open_mmap(path)
+    if mm is None:
+        return
+    view = memoryview(mm)
+    try:
+        stop = len(mm) if end is None else min(end, len(mm))
+        pos = start
+        while pos < stop:
+            newline = mm.find(b"\n", pos)
+            if newline == -1:
+                newline = len(mm)
+            yield view[pos:newline]
+            pos = newline + 1
+    finally:
+        view.release()
+        _close_mmap(mm)
+
+
+def iter_lines(path: str, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+    """
+    Lazily yield decoded lines (without line endings) from a local file or
+    S3 object, keeping memory bounded regardless of file size.
+
+    Local files are streamed through the buffered reader. A whole S3 object
+    or prefix is downloaded concurrently by iter_s3_blocks; a byte range of
+    an object is streamed through a single GET from ``start`` that stops
+    after the line straddling ``end``.
+
+    Args:
+        path (str): local path or S3 URI.
+        start (int): byte offset of the first line (must start a line).
+        end (int | None): byte offset to stop at; a line starting before
+            ``end`` is yielded whole.
+    """
+    if path.startswith(S3_SCHEMES):
+        if start == 0 and end is None:
+            for block in iter_s3_blocks(path):
+                for line in block.splitlines():
+                    yield line.decode('utf-8')
+            return
+        for line in _iter_s3_lines(path, start, end):
+            yield line.decode('utf-8').rstrip("\r")
+        return
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Local file not found: {path}")
+    if start == 0 and end is None:
         with open(path, 'r', encoding='utf-8') as f:
-            return f.read().splitlines()
+            for line in f:
+                yield line.rstrip("\n")
+        return
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+        pos = start
+        for raw in f:
+            if end is not None and pos >= end:
+                break
+            pos += len(raw)
+            yield raw.decode('utf-8').rstrip("\r\n")
+
+
+def iter_s3_blocks(path: str, part_size: int = S3_PART_SIZE,
+                   max_workers: int = S3_MAX_WORKERS,
+                   max_pending: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Lazily yield line-aligned blocks of every object under an S3 URI,
+    downloading ranged parts concurrently while earlier ones are consumed.
+
+    Objects are listed once and cut into ``part_size`` byte ranges; up to
+    ``max_workers`` ranged GETs run at a time through the process's pooled
+    client, and at most ``max_pending`` parts are buffered ahead of the
+    consumer. Blocks come out in object and byte order, each ending on a line
+    boundary (or at the end of its object), so output is identical to a
+    sequential read.
+
+    Args:
+        path (str): S3 URI of an object or a prefix.
+        part_size (int): bytes per ranged GET.
+        max_workers (int): concurrent GETs.
+        max_pending (int | None): parts downloaded ahead of the consumer;
+            defaults to twice ``max_workers``. Memory use is bounded by
+            about ``max_pending * part_size``.
+    """
+    objects = list_input_files(path)
+    if not objects:
+        raise FileNotFoundError(f"No S3 objects found: {path}")
+    parts = (
+        (obj_path, start, min(start + part_size, size), start + part_size >= size)
+        for obj_path, size, _ in objects
+        for start in range(0, size, part_size)
+    )
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="s3-get") as pool:
+        def submit(part):
+            pending.append((part, pool.submit(_s3_get, *part[:3])))
+
+        try:
+            for part in itertools.islice(parts, max_pending or 2 * max_workers):
+                submit(part)
+            remainder = b""
+            while pending:
+                (_, _, _, last), future = pending.popleft()
+                for part in itertools.islice(parts, 1):
+                    submit(part)
+                data = remainder + future.result()
+                if last:
+                    remainder = b""
+                    if data:
+                        yield data
+                    continue
+                cut = data.rfind(b"\n") + 1
+                remainder = data[cut:]
+                if cut:
+                    yield data[:cut]
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def iter_blocks(path: str, block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[bytes]:
+    """
+    Lazily yield chunks of roughly ``block_size`` bytes that each end on a
+    line boundary, for engines that tokenize many lines at once.
+
+    S3 URIs may name a prefix; its objects are downloaded concurrently by
+    iter_s3_blocks, in blocks of at most S3_PART_SIZE bytes.
+
+    Args:
+        path (str): local path or S3 URI.
+        block_size (int): approximate number of bytes per block.
+    """
+    if path.startswith(S3_SCHEMES):
+        yield from iter_s3_blocks(path, part_size=min(block_size, S3_PART_SIZE))
+        return
+
+    mm = _open_mmap(path)
+    if mm is None:
+        return
+    try:
+        pos = 0
+        while pos < len(mm):
+            cut = mm.find(b"\n", min(pos + block_size, len(mm)) - 1)
+            end = len(mm) if cut == -1 else cut + 1
+            yield mm[pos:end]
+            pos = end
+    finally:
+        _close_mmap(mm)
+
+
+def read_bytes(path: str) -> bytes:
+    """Read a whole (small) local file or S3 object, e.g. a config file."""
+    if path.startswith(S3_SCHEMES):
+        return _s3_body(path).read()
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Local file not found: {path}")
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def read_lines(path: str) -> list[str]:
+    return list(iter_lines(path))
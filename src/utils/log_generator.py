@@ -0,0 +1,144 @@
+"""
+Seeded synthetic API log generator for tests and benchmarks.
+
+Writes lines in the ``<timestamp> <user> <task> <status> <duration>ms``
+format read by every aggregation engine. User traffic follows a Zipf
+distribution, so a few users dominate as with real tenants.
+"""
+
+import argparse
+import calendar
+import itertools
+import random
+import time
+
+DEFAULT_TASK_MIX = {
+    "login": 4.0,
+    "getUserProfile": 3.0,
+    "createOrder": 1.5,
+    "updateInventory": 1.0,
+    "deleteOrder": 0.5,
+}
+DEFAULT_STATUS_MIX = {"200": 0.90, "201": 0.05, "400": 0.03, "500": 0.02}
+DEFAULT_START = "2025-05-01T00:00:00Z"
+CHUNK_LINES = 100_000
+
+
+def parse_mix(spec: str):
+    """
+    Parse a ``name=weight,name=weight`` mix, e.g. ``login=5,createOrder=1``.
+
+    Returns:
+        dict[str, float]: name to relative weight.
+    """
+    mix = {}
+    for item in spec.split(","):
+        name, sep, weight = item.partition("=")
+        if not sep or not name.strip():
+            raise ValueError(f"Invalid mix entry: '{item}'")
+        mix[name.strip()] = float(weight)
+    if not mix or min(mix.values()) < 0 or sum(mix.values()) <= 0:
+        raise ValueError(f"Invalid mix: '{spec}'")
+    return mix
+
+
+def zipf_weights(users: int, skew: float):
+    """Cumulative Zipf weights for ranks 1..users; skew 0 is uniform."""
+    return list(itertools.accumulate(1.0 / rank ** skew for rank in range(1, users + 1)))
+
+
+def iter_log_lines(records: int, users: int = 1000, skew: float = 1.1,
+                   task_mix=None, status_mix=None, seed: int = 0,
+                   start: str = DEFAULT_START, span_seconds: int = 30 * 24 * 3600,
+                   min_duration_ms: int = 50, max_duration_ms: int = 2000):
+    """
+    Yield ``records`` synthetic log lines (without newlines).
+
+    The same arguments always produce the same lines.
+
+    Args:
+        records (int): number of lines.
+        users (int): user cardinality; users are named user1..userN in
+            decreasing order of traffic.
+        skew (float): Zipf exponent of the user distribution.
+        task_mix (dict[str, float] | None): task to relative weight.
+        status_mix (dict[str, float] | None): status code to relative weight.
+        seed (int): random seed.
+        start (str): UTC ISO-8601 timestamp of the first possible request.
+        span_seconds (int): timestamps fall in [start, start + span).
+        min_duration_ms (int): smallest duration.
+        max_duration_ms (int): largest duration.
+    """
+    rng = random.Random(seed)
+    task_mix = task_mix or DEFAULT_TASK_MIX
+    status_mix = status_mix or DEFAULT_STATUS_MIX
+    user_names = [f"user{rank}" for rank in range(1, users + 1)]
+    user_weights = zipf_weights(users, skew)
+    tasks = list(task_mix)
+    task_weights = list(itertools.accumulate(task_mix.values()))
+    statuses = list(status_mix)
+    status_weights = list(itertools.accumulate(status_mix.values()))
+    start_epoch = calendar.timegm(time.strptime(start, "%Y-%m-%dT%H:%M:%SZ"))
+
+    remaining = records
+    while remaining > 0:
+        n = min(remaining, CHUNK_LINES)
+        remaining -= n
+        chunk_users = rng.choices(user_names, cum_weights=user_weights, k=n)
+        chunk_tasks = rng.choices(tasks, cum_weights=task_weights, k=n)
+        chunk_statuses = rng.choices(statuses, cum_weights=status_weights, k=n)
+        for user, task, status in zip(chunk_users, chunk_tasks, chunk_statuses):
+            ts = time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ",
+                time.gmtime(start_epoch + rng.randrange(span_seconds))
+            )
+            duration = rng.randint(min_duration_ms, max_duration_ms)
+            yield f"{ts} {user} {task} {status} {duration}ms"
+
+
+def generate_logs(path: str, records: int, **kwargs):
+    """
+    Write synthetic log lines to ``path``; see iter_log_lines for options.
+
+    Returns:
+        int: bytes written.
+    """
+    written = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        lines = iter_log_lines(records, **kwargs)
+        while True:
+            chunk = "".join(f"{line}\n" for line in itertools.islice(lines, CHUNK_LINES))
+            if not chunk:
+                break
+            written += f.write(chunk)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic API logs")
+    parser.add_argument("--output-path", required=True, help="Log file to write")
+    parser.add_argument("--records", type=int, required=True, help="Number of lines")
+    parser.add_argument("--users", type=int, default=1000, help="User cardinality")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of user traffic")
+    parser.add_argument(
+        "--task-mix", type=parse_mix, default=None,
+        help="Relative task weights, e.g. login=5,createOrder=1"
+    )
+    parser.add_argument(
+        "--status-mix", type=parse_mix, default=None,
+        help="Relative status code weights, e.g. 200=9,500=1"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--start", default=DEFAULT_START, help="First timestamp (UTC)")
+    parser.add_argument("--span-days", type=float, default=30, help="Timestamp range in days")
+    args = parser.parse_args()
+
+    generate_logs(
+        args.output_path, args.records, users=args.users, skew=args.skew,
+        task_mix=args.task_mix, status_mix=args.status_mix, seed=args.seed,
+        start=args.start, span_seconds=int(args.span_days * 24 * 3600),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+# tests/conftest.py
+import pytest
+
+LOCAL_BACKENDS = ("serial", "processes")
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--backend", action="append", choices=LOCAL_BACKENDS + ("spark",), default=None,
+        help="Backend for tests using the ``context`` fixture; repeat for several "
+             "(default: serial and processes; spark needs a local Java install)"
+    )
+
+
+def pytest_generate_tests(metafunc):
+    if "context" in metafunc.fixturenames:
+        backends = metafunc.config.getoption("backend") or LOCAL_BACKENDS
+        metafunc.parametrize("context", backends, indirect=True)
+
+
+@pytest.fixture
+def context(request):
+    """A SparkContext-like context of the selected backend, stopped afterwards."""
+    if request.param == "spark":
+        from pyspark import SparkContext
+        sc = SparkContext("local[2]", "billing-tests")
+    else:
+        from mapreduce_billing.engines import create_context
+        sc = create_context(request.param, workers=2)
+    yield sc
+    sc.stop()
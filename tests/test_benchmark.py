@@ -0,0 +1,51 @@
+# tests/test_benchmark.py
+from mapreduce_billing.benchmark import ENGINES, compare_results, run_benchmarks
+
+
+def test_run_benchmarks_local_engines(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    rows = run_benchmarks(["python", "parallel"], [2000], str(tmp_path), users=50)
+    print("Benchmark rows:", rows)
+
+    assert [row["engine"] for row in rows] == ["python", "parallel"]
+    for row in rows:
+        assert row["status"] == "ok"
+        assert row["consistent"]
+        assert row["records"] == 2000
+        assert row["records_per_sec"] > 0
+        assert row["peak_rss_mb"] > 0
+    assert rows[0]["digest"] == rows[1]["digest"]
+
+
+def test_run_benchmarks_reports_engine_errors(tmp_path, monkeypatch):
+    monkeypatch.setitem(ENGINES, "broken", lambda path: 1 / 0)
+    rows = run_benchmarks(["broken"], [10], str(tmp_path))
+    assert rows[0]["status"] == "error"
+    assert "ZeroDivisionError" in rows[0]["error"]
+    assert compare_results(rows, []) == ["broken @ 10 records: ZeroDivisionError: division by zero"]
+
+
+def test_peak_memory_includes_descendants(tmp_path, monkeypatch):
+    import subprocess
+    import sys
+
+    def engine(path):
+        # Like a pool worker or the Spark JVM: memory held by a child process
+        subprocess.run([sys.executable, "-c", "import time; b = b'x' * (200 << 20); time.sleep(0.5)"],
+                       check=True)
+        return {}
+
+    monkeypatch.setitem(ENGINES, "forking", engine)
+    row, = run_benchmarks(["forking"], [10], str(tmp_path))
+    print("Forking engine:", row)
+    assert row["status"] == "ok"
+    if row["rss_scope"] == "tree":
+        assert row["peak_rss_mb"] > 150
+
+
+def test_compare_results_flags_throughput_drop():
+    row = {"engine": "python", "records": 1000, "status": "ok", "consistent": True}
+    baseline = [dict(row, records_per_sec=1000)]
+    assert compare_results([dict(row, records_per_sec=900)], baseline, tolerance=0.15) == []
+    problems = compare_results([dict(row, records_per_sec=800)], baseline, tolerance=0.15)
+    assert problems == ["python @ 1000 records: 800 records/sec, baseline 1000"]
@@ -0,0 +1,96 @@
+# tests/test_billing_index.py
+import pytest
+from mapreduce_billing.billing_index import BillingIndex, write_billing_index
+from mapreduce_billing.naive_aggregation import aggregate_naive, format_billing_line, write_billing
+from mapreduce_billing.rates import load_rate_table
+from utils.log_generator import generate_logs
+
+
+def test_round_trip_matches_text_output(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    monkeypatch.setenv("RATE_createOrder", "0.010")
+    log_path = str(tmp_path / "api_logs.txt")
+    generate_logs(log_path, 3000, users=200, seed=3)
+    results = aggregate_naive(log_path)
+    # Non-ASCII names must sort the same way in both formats
+    results["zoë"] = {"total_duration_ms": 5, "total_cost_micros": 25000}
+    results["zoe"] = {"total_duration_ms": 7, "total_cost_micros": 35000}
+
+    text_path = tmp_path / "billing.txt"
+    write_billing(str(text_path), results, load_rate_table())
+    index_path = str(tmp_path / "billing.idx")
+    count = write_billing_index(index_path, (
+        (user, m["total_duration_ms"], m["total_cost_micros"]) for user, m in sorted(results.items())
+    ))
+    assert count == len(results)
+
+    with BillingIndex(index_path) as index:
+        assert len(index) == len(results)
+        assert [format_billing_line(*record) for record in index] == text_path.read_text().splitlines()
+        for user, m in results.items():
+            assert index.get(user) == (m["total_duration_ms"], m["total_cost_micros"])
+
+
+def test_lookups_and_scans(tmp_path):
+    path = str(tmp_path / "billing.idx")
+    users = [f"user{i:03d}" for i in range(0, 100, 2)]
+    write_billing_index(path, ((user, i, i * 1000) for i, user in enumerate(users)))
+
+    with BillingIndex(path) as index:
+        assert index.get("user010") == (5, 5000)
+        assert index.get("user011") is None
+        assert index.get("aaa", (0, 0)) == (0, 0)
+        assert "user098" in index and "user099" not in index
+        scan = list(index.range("user011", "user020"))
+        print("Range scan:", scan)
+        assert scan == [("user012", 6, 6000), ("user014", 7, 7000),
+                        ("user016", 8, 8000), ("user018", 9, 9000)]
+        assert [user for user, _, _ in index.range(end="user004")] == ["user000", "user002"]
+        assert [user for user, _, _ in index.prefix("user09")] == [
+            "user090", "user092", "user094", "user096", "user098"
+        ]
+        assert list(index.prefix("x")) == []
+
+
+def test_empty_and_invalid(tmp_path):
+    path = str(tmp_path / "empty.idx")
+    assert write_billing_index(path, []) == 0
+    with BillingIndex(path) as index:
+        assert len(index) == 0
+        assert index.get("user1") is None
+        assert list(index) == []
+
+    with pytest.raises(ValueError, match="sorted and unique"):
+        write_billing_index(path, [("b", 1, 1), ("a", 1, 1)])
+    with pytest.raises(ValueError, match="64 bits"):
+        write_billing_index(path, [("a", 1, 1 << 64)])
+    assert not any(p.name.endswith(".tmp") for p in tmp_path.iterdir())
+
+    text = tmp_path / "billing.txt"
+    text.write_text("user1: total_duration=1ms, total_cost=0.01\n" * 4)
+    with pytest.raises(ValueError, match="Not a billing index"):
+        BillingIndex(str(text))
+
+    truncated = tmp_path / "truncated.idx"
+    write_billing_index(str(truncated), [("a", 1, 1), ("b", 2, 2)])
+    truncated.write_bytes(truncated.read_bytes()[:-1])
+    with pytest.raises(ValueError, match="corrupt"):
+        BillingIndex(str(truncated))
+
+
+def test_streams_in_chunks(monkeypatch, tmp_path):
+    import mapreduce_billing.billing_index as billing_index
+    monkeypatch.setattr(billing_index, "WRITE_CHUNK", 3)
+    path = str(tmp_path / "billing.idx")
+    users = [f"user{i:02d}" for i in range(10)]
+    # Users may also be given as UTF-8 bytes, as spilled runs do
+    records = [(user.encode("utf-8") if i % 2 else user, i, i * 10) for i, user in enumerate(users)]
+    assert write_billing_index(path, iter(records + [(b"zo\xc3\xab", 1, 2)])) == 11
+    with BillingIndex(path) as index:
+        assert list(index) == [(user, i, i * 10) for i, user in enumerate(users)] + [("zoë", 1, 2)]
+
+    with pytest.raises(ValueError, match="sorted and unique"):
+        write_billing_index(path, iter(records + [("a", 1, 1)]))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["billing.idx"]
+    with BillingIndex(path) as index:
+        assert len(index) == 11
@@ -0,0 +1,116 @@
+# tests/test_cube.py
+import pytest
+from mapreduce_billing.cube import (
+    ALL, USER_SET, aggregate_cube, cube_user_totals, cube_user_totals_rdd, map_cube_records,
+    parse_grouping_sets, read_cube, status_class, write_cube,
+)
+from mapreduce_billing.naive_aggregation import aggregate_naive
+from mapreduce_billing.windowed import reduce_windowed
+
+
+LINES = [
+    "2025-05-02T00:10:00Z user1 login 200 100ms",
+    "2025-05-02T00:50:00Z user1 login 500 300ms",
+    "2025-05-02T01:05:00Z user1 createOrder 201 200ms",
+    "2025-05-03T09:00:00Z user2 login 404 50ms",
+    "2025-05-03T09:01:00Z user2 login 200 10ms",
+]
+
+
+def create_temp_log(tmp_path, lines):
+    """
+    Helper to write a temporary log file and return its path.
+    """
+    log_file = tmp_path / "api_logs.txt"
+    log_file.write_text("\n".join(lines))
+    return str(log_file)
+
+
+@pytest.mark.parametrize("status, expected", [
+    ("200", "2xx"), ("201", "2xx"), ("404", "4xx"), ("503", "5xx"), ("OK", "other"), ("2000", "other"),
+])
+def test_status_class(status, expected):
+    assert status_class(status) == expected
+
+
+def test_parse_grouping_sets():
+    assert len(parse_grouping_sets("cube")) == 8
+    assert parse_grouping_sets("rollup") == [
+        ("user", "task", "status_class"), ("user", "task"), ("user",), ()
+    ]
+    assert parse_grouping_sets("task, status_class, task+user, total, user+task") == [
+        ("task",), ("status_class",), ("user", "task"), ()
+    ]
+    with pytest.raises(ValueError, match="Unknown dimension 'region'"):
+        parse_grouping_sets("user+region")
+    with pytest.raises(ValueError, match="Empty grouping set"):
+        parse_grouping_sets("user,,task")
+
+
+def test_aggregate_cube(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    monkeypatch.setenv("RATE_createOrder", "0.010")
+    sets = parse_grouping_sets("task,status_class,user+task,total")
+    cube = aggregate_cube(create_temp_log(tmp_path, LINES), sets + [USER_SET])
+    print("Cube:", cube)
+
+    assert cube[(ALL, "login", ALL)] == (4, 460, 460 * 5000)
+    assert cube[(ALL, ALL, "2xx")] == (3, 310, 110 * 5000 + 200 * 10000)
+    assert cube[(ALL, ALL, "5xx")] == (1, 300, 300 * 5000)
+    assert cube[("user1", "createOrder", ALL)] == (1, 200, 200 * 10000)
+    assert cube[(ALL, ALL, ALL)] == (5, 660, 460 * 5000 + 200 * 10000)
+    assert len(cube) == 2 + 3 + 3 + 1 + 2
+
+    # The ("user",) set reproduces billing
+    naive = aggregate_naive(create_temp_log(tmp_path, LINES))
+    assert cube_user_totals(cube) == {
+        user: (m["total_duration_ms"], m["total_cost_micros"]) for user, m in naive.items()
+    }
+
+
+def test_map_cube_records_combines_per_partition(monkeypatch, tmp_path, context):
+    monkeypatch.setenv("RATE_login", "0.005")
+    monkeypatch.setenv("RATE_createOrder", "0.010")
+    sets = parse_grouping_sets("cube")
+    rdd = context.union([context.parallelize(LINES[:3], 1), context.parallelize(LINES[3:], 1)])
+
+    pairs = map_cube_records(rdd, sets)
+    # One row per distinct key per partition, not one per record and set
+    assert pairs.mapPartitions(lambda rows: [sum(1 for _ in rows)]).collect() == [
+        len(aggregate_cube(create_temp_log(tmp_path, LINES[:3]), sets)),
+        len(aggregate_cube(create_temp_log(tmp_path, LINES[3:]), sets)),
+    ]
+    cube = dict(pairs.reduceByKey(reduce_windowed).collect())
+    assert cube == aggregate_cube(create_temp_log(tmp_path, LINES), sets)
+
+    totals = dict(cube_user_totals_rdd(context.parallelize(list(cube.items()), 2)).collect())
+    assert totals == {"user1": (600, 400 * 5000 + 200 * 10000), "user2": (60, 60 * 5000)}
+
+
+def test_map_cube_records_skips_malformed(monkeypatch, context):
+    monkeypatch.setenv("RATE_login", "0.005")
+    with pytest.raises(ValueError):
+        map_cube_records(context.parallelize(LINES + ["broken"], 1), [()]).collect()
+    cube = dict(
+        map_cube_records(context.parallelize(LINES + ["broken", ""], 1), [()], on_error="skip")
+        .collect()
+    )
+    assert cube[(ALL, ALL, ALL)][0] == 5
+
+
+def test_write_and_read_cube(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    monkeypatch.setenv("RATE_createOrder", "0.010")
+    sets = parse_grouping_sets("status_class,user+task")
+    cube = aggregate_cube(create_temp_log(tmp_path, LINES), sets + [USER_SET])
+    path = tmp_path / "cube.csv"
+    write_cube(str(path), cube.items(), sets)
+
+    rows = path.read_text().splitlines()
+    print("\n".join(rows))
+    assert rows[0] == "grouping,user,task,status_class,requests,duration_ms,cost_micros"
+    assert rows[1] == "status_class,,,2xx,3,310,2550000"
+    assert rows[-1] == "user+task,user2,login,,2,60,300000"
+    assert read_cube(str(path)) == {
+        key: value for key, value in cube.items() if key[0] == ALL or key[1] != ALL
+    }
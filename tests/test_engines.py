@@ -0,0 +1,179 @@
+# tests/test_engines.py
+import json
+import os
+import pytest
+from mapreduce_billing.cube import (
+    USER_SET, aggregate_cube, cube_user_totals, map_cube_records, parse_grouping_sets,
+)
+from mapreduce_billing.engines import ProcessPoolContext, aggregate_mapreduce, create_context
+from mapreduce_billing.map_reduce import map_records, reduce_records
+from mapreduce_billing.metrics import LineCounters
+from mapreduce_billing.naive_aggregation import aggregate_naive
+from mapreduce_billing.sketches import BillingSketches, SketchAccumulatorParam
+from mapreduce_billing.skew import salted_reduce
+from mapreduce_billing.windowed import (
+    aggregate_windowed, map_windowed_records, reduce_windowed, rollup_user_totals,
+)
+from utils.log_generator import generate_logs
+
+
+@pytest.fixture
+def log_path(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    monkeypatch.setenv("RATE_createOrder", "0.010")
+    path = str(tmp_path / "api_logs.txt")
+    generate_logs(path, 5000, users=300, seed=3)
+    return path
+
+
+def naive_totals(path):
+    return {
+        user: (m["total_duration_ms"], m["total_cost_micros"])
+        for user, m in aggregate_naive(path).items()
+    }
+
+
+def test_map_reduce_matches_naive(context, log_path):
+    counters = LineCounters(context)
+    lines = context.textFile(log_path, 4)
+    assert lines.getNumPartitions() >= 4
+    totals = map_records(lines, counters=counters).reduceByKey(reduce_records, 3).collect()
+    print("Users:", len(totals))
+    assert dict(totals) == naive_totals(log_path)
+    assert counters.values() == {"records": 5000, "malformed_records": 0}
+
+
+def test_accumulators_and_persist(context, log_path):
+    counters = LineCounters(context)
+    sketches = context.accumulator(BillingSketches(), SketchAccumulatorParam())
+    totals = map_records(
+        context.textFile(log_path), counters=counters, sketches=sketches
+    ).reduceByKey(reduce_records).persist()
+
+    # Actions on a persisted RDD do not map the lines again
+    assert totals.count() == len(naive_totals(log_path))
+    users, _, cost = totals.aggregate(
+        (0, 0, 0),
+        lambda acc, pair: (acc[0] + 1, acc[1] + pair[1][0], acc[2] + pair[1][1]),
+        lambda a, b: (a[0] + b[0], a[1] + b[1], a[2] + b[2]),
+    )
+    assert users == totals.count()
+    assert cost == sum(c for _, c in naive_totals(log_path).values())
+    assert counters.records.value == 5000
+    assert sketches.value.records == 5000
+
+
+def test_skip_malformed(context, tmp_path, monkeypatch):
+    monkeypatch.setenv("RATE_login", "0.005")
+    path = tmp_path / "api_logs.txt"
+    path.write_text("2025-05-02T00:00:00Z user1 login 200 100ms\nbroken\n" * 20)
+    counters = LineCounters(context)
+    pairs = map_records(context.textFile(str(path), 3), counters=counters, on_error="skip")
+    assert pairs.reduceByKey(reduce_records).collect() == [("user1", (2000, 2000 * 5000))]
+    assert counters.values() == {"records": 40, "malformed_records": 20}
+
+    with pytest.raises(ValueError, match="Invalid log line"):
+        map_records(context.textFile(str(path), 3)).reduceByKey(reduce_records).collect()
+
+
+def test_windowed_and_cube(context, log_path):
+    rollup = map_windowed_records(context.textFile(log_path), "day").reduceByKey(reduce_windowed)
+    assert dict(rollup.collect()) == aggregate_windowed(log_path, "day")
+    assert dict(rollup_user_totals(rollup).collect()) == naive_totals(log_path)
+
+    sets = parse_grouping_sets("rollup")
+    cube = dict(
+        map_cube_records(context.textFile(log_path), sets).reduceByKey(reduce_windowed).collect()
+    )
+    assert cube == aggregate_cube(log_path, sets)
+    assert USER_SET in sets and cube_user_totals(cube) == naive_totals(log_path)
+
+
+def test_salted_reduce(context, log_path):
+    totals, stats = salted_reduce(
+        map_records(context.textFile(log_path)), reduce_records, salts=4,
+        num_partitions=16, sample_fraction=0.5, seed=1
+    )
+    print("Skew statistics:", stats)
+    assert stats["hot_keys"]
+    assert dict(totals.collect()) == naive_totals(log_path)
+
+
+def test_sort_and_save(context, log_path, tmp_path):
+    totals = map_records(context.textFile(log_path)).reduceByKey(reduce_records)
+    ordered = totals.sortByKey(numPartitions=2)
+    assert ordered.getNumPartitions() == 2
+    assert [user for user, _ in ordered.collect()] == sorted(naive_totals(log_path))
+
+    out_dir = str(tmp_path / "out")
+    ordered.map(lambda pair: pair[0]).saveAsTextFile(out_dir)
+    assert sorted(os.listdir(out_dir)) == ["_SUCCESS", "part-00000", "part-00001"]
+    users = []
+    for name in ("part-00000", "part-00001"):
+        with open(os.path.join(out_dir, name)) as f:
+            users.extend(f.read().splitlines())
+    assert users == sorted(naive_totals(log_path))
+
+
+def test_parallelize_union_coalesce(context):
+    rdd = context.parallelize(range(10), 4)
+    assert rdd.getNumPartitions() == 4
+    both = context.union([rdd, context.parallelize([10, 11], 1)])
+    assert both.getNumPartitions() == 5
+    assert both.coalesce(2).getNumPartitions() == 2
+    assert sorted(both.coalesce(2).collect()) == list(range(12))
+    assert both.filter(lambda x: x % 2).map(lambda x: (x % 3, 1)).countByKey() == {0: 2, 1: 2, 2: 2}
+
+
+@pytest.mark.parametrize("backend", ["serial", "processes"])
+def test_aggregate_mapreduce(log_path, backend):
+    assert aggregate_mapreduce(log_path, backend, workers=3) == aggregate_naive(log_path)
+    with pytest.raises(ValueError, match="Unknown backend"):
+        create_context("threads")
+
+
+def test_process_shuffle_releases_shared_memory(monkeypatch, log_path):
+    import mapreduce_billing.engines as engines
+    released = []
+
+    def unlink_shared(refs, unlink=engines._unlink_shared):
+        released.extend(ref[0] for ref in refs if ref is not None)
+        unlink(refs)
+
+    monkeypatch.setattr(engines, "_unlink_shared", unlink_shared)
+    sc = ProcessPoolContext(workers=2)
+    pairs = map_records(sc.textFile(log_path, 3))
+    assert dict(pairs.reduceByKey(reduce_records, 2).collect()) == naive_totals(log_path)
+    print("Shuffle blocks:", released)
+    # One block per map task and reduce partition, all unlinked
+    assert len(released) == pairs.getNumPartitions() * 2
+    for name in released:
+        assert not os.path.exists(os.path.join("/dev/shm", name.lstrip("/")))
+
+
+def test_process_failure_propagates(tmp_path, monkeypatch):
+    monkeypatch.setenv("RATE_login", "0.005")
+    path = tmp_path / "api_logs.txt"
+    path.write_text("2025-05-02T00:00:00Z user1 login 200 100ms\n" * 20 + "broken\n")
+    sc = create_context("processes", workers=2)
+    with pytest.raises(ValueError, match="Invalid log line"):
+        map_records(sc.textFile(str(path), 2)).reduceByKey(reduce_records).collect()
+
+
+def test_spark_job_on_local_backend(monkeypatch, log_path, tmp_path, capsys):
+    from mapreduce_billing import spark_job
+    monkeypatch.setattr("sys.argv", [
+        "spark_job.py", "--backend", "processes", "--workers", "2", "--input-path", log_path,
+        "--output-dir", str(tmp_path / "out"), "--single-file", "--cube", "task",
+    ])
+    spark_job.main()
+    metrics = json.loads(capsys.readouterr().out.splitlines()[-1])
+    print(metrics)
+    assert metrics["status"] == "succeeded"
+    assert metrics["counters"]["records"] == 5000
+
+    results_dir, = (tmp_path / "out").glob("billing_results_*")
+    lines = (results_dir / "part-00000").read_text().splitlines()
+    assert len(lines) == len(naive_totals(log_path))
+    assert (results_dir / "_rates" / "part-00000").exists()
+    assert list((tmp_path / "out").glob("billing_cube_*"))
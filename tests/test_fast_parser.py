@@ -0,0 +1,92 @@
+# tests/test_fast_parser.py
+import pytest
+from mapreduce_billing.fast_parser import (
+    RateTable, iter_parsed, parse_fields, parse_fields_bytes,
+)
+from mapreduce_billing.naive_aggregation import aggregate_naive, parse_line
+from utils.io import iter_lines
+
+LINES = [
+    "2025-05-02T00:00:00Z user1 login 200 100ms",
+    "2025-05-02T00:00:00Z user1 login 200 0ms",
+    "2025-05-02T00:00:00Z user1 login 200 007ms",
+    "  2025-05-02T00:00:00Z   user1\tlogin 200  100ms  ",
+    "2025-05-02T00:00:00Z usér1 login 200 100ms",
+    "2025-05-02T00:00:00Z user1 login 200 100ms",
+    "2025-05-02T00:00:00Z\x1cuser1 login 200 100ms",
+    "2025-05-02T00:00:00Z user1 login 200 +100ms",
+    "2025-05-02T00:00:00Z user1 login 200 -100ms",
+    "2025-05-02T00:00:00Z user1 login 200 1_000ms",
+    "2025-05-02T00:00:00Z user1 login 200 １００ms",
+    "2025-05-02T00:00:00Z user1 login 200 99999999999999999999999ms",
+    "2025-05-02T00:00:00Z user1 login 200 " + "9" * 5000 + "ms",
+    "2025-05-02T00:00:00Z user1 login 200 ms",
+    "2025-05-02T00:00:00Z user1 login 200 100",
+    "2025-05-02T00:00:00Z user1 login 200 100MS",
+    "2025-05-02T00:00:00Z user1 login 200 10.5ms",
+    "2025-05-02T00:00:00Z user1 login 100ms",
+    "2025-05-02T00:00:00Z user1 login 200 100ms extra",
+    "user1",
+]
+
+
+def outcome(parse, line):
+    try:
+        return parse(line)
+    except ValueError as e:
+        return type(e), str(e)
+
+
+@pytest.mark.parametrize("line", LINES)
+def test_parse_fields_matches_parse_line(line):
+    assert outcome(parse_fields, line) == outcome(parse_line, line)
+
+
+@pytest.mark.parametrize("line", [line for line in LINES if line.isascii() and "\x1c" not in line])
+def test_parse_fields_bytes_matches_parse_line(line):
+    expected = outcome(parse_line, line)
+    result = outcome(parse_fields_bytes, line.encode("utf-8"))
+    if isinstance(expected[0], str):
+        expected = (expected[0].encode(), expected[1].encode(), expected[2])
+    assert result == expected
+
+
+@pytest.mark.parametrize("line", LINES)
+def test_iter_parsed_matches_parse_line(tmp_path, line):
+    path = tmp_path / "api_logs.txt"
+    path.write_text(f"2025-05-02T00:00:00Z user2 createOrder 201 5ms\n\n{line}\n")
+    expected = [outcome(parse_line, l) for l in iter_lines(str(path)) if l.strip()]
+    try:
+        result = [
+            (user.decode(), task.decode(), duration)
+            for user, task, duration in iter_parsed(str(path))
+        ]
+    except ValueError as e:
+        result = expected[:-1] + [(type(e), str(e))]
+    assert result == expected
+
+
+def test_iter_parsed_across_blocks(tmp_path):
+    path = tmp_path / "api_logs.txt"
+    lines = [f"2025-05-02T00:00:00Z user{i % 7} login 200 {i}ms" for i in range(1000)]
+    path.write_text("\r\n".join(lines[:10]) + "\n" + "\n".join(lines[10:]))
+    result = list(iter_parsed(str(path), block_size=256))
+    assert [(u.decode(), t.decode(), d) for u, t, d in result] == [parse_line(l) for l in lines]
+
+
+def test_rate_table_interns_tasks():
+    table = RateTable({"login": 0.5, "createOrder": 0.25})
+    assert table.rate(b"createOrder") == 250_000
+    assert table.rate("login") == 500_000
+    assert table.rate(b"unknown") == 0
+    assert table.code(b"createOrder") == 0
+    assert table.codes == {b"createOrder": 0, "login": 1, b"unknown": 2}
+    assert table.rates == [250_000, 500_000, 0]
+
+
+def test_aggregate_naive_reports_parse_errors(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    path = tmp_path / "api_logs.txt"
+    path.write_text("2025-05-02T00:00:00Z user1 login 200 100ms\n2025-05-02T00:00:00Z user1 login 200 100\n")
+    with pytest.raises(ValueError, match="Invalid duration format: '100'"):
+        aggregate_naive(str(path))
@@ -0,0 +1,87 @@
+# tests/test_incremental.py
+import json
+import pytest
+from mapreduce_billing.incremental import aggregate_incremental
+from mapreduce_billing.naive_aggregation import aggregate_naive
+
+
+def write_day(log_dir, day, lines):
+    """
+    Helper to write one day's log file into the log directory.
+    """
+    log_file = log_dir / f"api_logs_{day}.txt"
+    log_file.write_text("\n".join(lines))
+    return str(log_file)
+
+
+def naive_partials(calls):
+    def aggregate_files(paths):
+        calls.append(sorted(paths))
+        return {
+            path: {
+                user: (metrics["total_duration_ms"], metrics["total_cost_micros"])
+                for user, metrics in aggregate_naive(path).items()
+            }
+            for path in paths
+        }
+    return aggregate_files
+
+
+def test_incremental_only_aggregates_new_files(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    monkeypatch.setenv("RATE_createOrder", "0.010")
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+    state_dir = str(tmp_path / "state")
+
+    day1 = write_day(log_dir, "2025-05-01", [
+        "2025-05-01T00:00:00Z user1 login 200 100ms",
+        "2025-05-01T00:01:00Z user2 createOrder 201 200ms",
+    ])
+    calls = []
+    totals = aggregate_incremental(str(log_dir), state_dir, naive_partials(calls))
+    assert calls == [[day1]]
+    assert totals["user1"] == (100, 500_000)
+
+    day2 = write_day(log_dir, "2025-05-02", [
+        "2025-05-02T00:00:00Z user1 createOrder 201 300ms",
+        "2025-05-02T00:02:00Z user3 login 200 50ms",
+    ])
+    totals = aggregate_incremental(str(log_dir), state_dir, naive_partials(calls))
+    print("Incremental totals after day 2:", totals)
+    assert calls[-1] == [day2]
+    assert totals["user1"][0] == 400
+    assert totals["user1"][1] == 100 * 5000 + 300 * 10_000
+    assert totals["user2"][0] == 200
+    assert totals["user3"][0] == 50
+
+    # Nothing new: stored partials answer without aggregating anything
+    again = aggregate_incremental(str(log_dir), state_dir, naive_partials(calls))
+    assert len(calls) == 2
+    assert again == totals
+
+    manifest = json.loads((tmp_path / "state" / "manifest.json").read_text())
+    assert sorted(manifest["inputs"]) == [day1, day2]
+
+
+def test_incremental_reprocesses_changed_and_drops_removed(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+    state_dir = str(tmp_path / "state")
+
+    day1 = write_day(log_dir, "2025-05-01", ["2025-05-01T00:00:00Z user1 login 200 100ms"])
+    day2 = write_day(log_dir, "2025-05-02", ["2025-05-02T00:00:00Z user2 login 200 10ms"])
+    calls = []
+    aggregate_incremental(str(log_dir), state_dir, naive_partials(calls))
+
+    write_day(log_dir, "2025-05-01", [
+        "2025-05-01T00:00:00Z user1 login 200 100ms",
+        "2025-05-01T00:05:00Z user1 login 200 900ms",
+    ])
+    (log_dir / "api_logs_2025-05-02.txt").unlink()
+    totals = aggregate_incremental(str(log_dir), state_dir, naive_partials(calls))
+
+    assert calls[-1] == [day1]
+    assert totals == {"user1": (1000, 1000 * 5000)}
+    assert day2 not in json.loads((tmp_path / "state" / "manifest.json").read_text())["inputs"]
@@ -0,0 +1,217 @@
+# tests/test_io.py
+import io
+import threading
+import time
+import pytest
+from utils.io import (
+    _s3_client_for, iter_blocks, iter_lines, iter_records, iter_s3_blocks, list_input_files,
+    read_lines,
+)
+
+
+def create_temp_log(tmp_path, content):
+    """
+    Helper to write a temporary log file and return its path.
+    """
+    log_file = tmp_path / "api_logs.txt"
+    log_file.write_bytes(content)
+    return str(log_file)
+
+
+LINES = [
+    "2025-05-02T00:00:00Z user1 login 200 100ms",
+    "",
+    "2025-05-02T00:01:00Z user1 createOrder 201 200ms",
+    "2025-05-02T00:02:00Z user2 login 200 50ms",
+]
+
+
+def test_iter_lines_matches_splitlines(tmp_path):
+    path = create_temp_log(tmp_path, "\n".join(LINES).encode())
+    assert list(iter_lines(path)) == LINES
+    assert read_lines(path) == LINES
+
+
+def test_iter_lines_crlf_and_trailing_newline(tmp_path):
+    path = create_temp_log(tmp_path, ("\r\n".join(LINES) + "\r\n").encode())
+    assert list(iter_lines(path)) == LINES
+
+
+def test_iter_lines_byte_range(tmp_path):
+    content = ("\n".join(LINES) + "\n").encode()
+    path = create_temp_log(tmp_path, content)
+    middle = content.index(b"\n", 5) + 1
+
+    # A range end inside a line still yields that whole line
+    assert list(iter_lines(path, 0, middle - 1)) == LINES[:1]
+    assert list(iter_lines(path, 0, middle)) + list(iter_lines(path, middle)) == LINES
+
+
+def test_iter_records_zero_copy_views(tmp_path):
+    path = create_temp_log(tmp_path, "\n".join(LINES).encode())
+    records = [bytes(view) for view in iter_records(path)]
+    assert records == [line.encode() for line in LINES]
+
+
+@pytest.mark.parametrize("block_size", [1, 10, 64, 1 << 20])
+def test_iter_blocks_line_aligned(tmp_path, block_size):
+    content = "\n".join(LINES).encode()
+    path = create_temp_log(tmp_path, content)
+
+    blocks = list(iter_blocks(path, block_size))
+    assert b"".join(blocks) == content
+    assert all(block.endswith(b"\n") for block in blocks[:-1])
+
+
+def test_empty_and_missing_files(tmp_path):
+    path = create_temp_log(tmp_path, b"")
+    assert list(iter_lines(path)) == []
+    assert list(iter_blocks(path)) == []
+
+    with pytest.raises(FileNotFoundError):
+        read_lines(str(tmp_path / "missing.txt"))
+
+
+class FakeS3:
+    """Minimal in-memory S3 client that records concurrent GETs."""
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.ranges = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        yield {"Contents": [
+            {"Key": key, "Size": len(self.objects[key]), "ETag": f'"{key}"'} for key in keys
+        ]}
+
+    def get_object(self, Bucket, Key, Range=None):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.ranges.append((Key, Range))
+        time.sleep(0.01)
+        with self.lock:
+            self.active -= 1
+        data = self.objects[Key]
+        if Range:
+            first, last = Range[len("bytes="):].split("-")
+            data = data[int(first):int(last) + 1 if last else None]
+        return {"Body": io.BytesIO(data)}
+
+
+@pytest.fixture
+def fake_s3(monkeypatch):
+    objects = {
+        f"logs/2025-05-02/{hour:02d}.log": "".join(
+            f"2025-05-02T{hour:02d}:00:00Z user{i} login 200 {i}ms\n" for i in range(20)
+        ).encode()
+        for hour in range(6)
+    }
+    objects["logs/2025-05-02/no-newline.log"] = b"2025-05-02T07:00:00Z user1 login 200 1ms"
+    objects["logs/2025-05-020.log"] = b"not under the prefix\n"
+    client = FakeS3(objects)
+    monkeypatch.setattr("utils.io._s3_client", lambda: client)
+    return client
+
+
+def test_iter_s3_blocks_concurrent_ranged_prefix(fake_s3):
+    expected = b"".join(
+        fake_s3.objects[key]
+        for key in sorted(fake_s3.objects) if key.startswith("logs/2025-05-02/")
+    )
+    blocks = list(iter_s3_blocks("s3://bucket/logs/2025-05-02/", part_size=100, max_workers=4))
+    print("ranged GETs:", len(fake_s3.ranges), "max concurrent:", fake_s3.max_active)
+
+    assert b"".join(blocks) == expected
+    assert all(block.endswith(b"\n") or block.endswith(b"1ms") for block in blocks)
+    assert len(fake_s3.ranges) > len(fake_s3.objects)
+    assert 1 < fake_s3.max_active <= 4
+
+
+def test_s3_lines_match_sequential_read(fake_s3):
+    prefix = "s3://bucket/logs/2025-05-02/"
+    expected = [
+        line
+        for key in sorted(fake_s3.objects) if key.startswith("logs/2025-05-02/")
+        for line in fake_s3.objects[key].decode().splitlines()
+    ]
+    assert read_lines(prefix) == expected
+    assert b"".join(iter_blocks(prefix, 64)).decode().splitlines() == expected
+
+    # A URI naming an object reads only that object, not keys it prefixes
+    assert read_lines("s3://bucket/logs/2025-05-02/00.log") == (
+        fake_s3.objects["logs/2025-05-02/00.log"].decode().splitlines()
+    )
+
+
+def test_s3_byte_range_reads_straddling_line(fake_s3):
+    uri = "s3://bucket/logs/2025-05-02/03.log"
+    content = fake_s3.objects["logs/2025-05-02/03.log"]
+    expected = content.decode().splitlines()
+    middle = content.index(b"\n", len(content) // 2) - 5
+
+    # The line straddling the range end belongs to the first range only
+    first, second = list(iter_lines(uri, 0, middle)), list(iter_lines(uri, middle + 6))
+    print("ranges:", fake_s3.ranges)
+    assert first + second == expected
+    assert len(first) == content[:middle].count(b"\n") + 1
+    assert [bytes(view) for view in iter_records(uri, 0, middle)] == [
+        line.encode() for line in first
+    ]
+    assert ("logs/2025-05-02/03.log", f"bytes={middle + 6}-") in fake_s3.ranges
+
+
+@pytest.mark.parametrize("scheme", ["s3a", "s3n"])
+def test_hadoop_s3_schemes_keep_their_scheme(fake_s3, tmp_path, scheme):
+    from mapreduce_billing.incremental import aggregate_incremental
+    prefix = f"{scheme}://bucket/logs/2025-05-02/"
+    files = list_input_files(prefix)
+    assert [path for path, _, _ in files] == [
+        f"{scheme}://bucket/{key}" for key in sorted(fake_s3.objects)
+        if key.startswith("logs/2025-05-02/")
+    ]
+    assert read_lines(files[0][0]) == fake_s3.objects["logs/2025-05-02/00.log"].decode().splitlines()
+
+    seen = []
+
+    def aggregate_files(paths):
+        seen.extend(paths)
+        return {path: {"user1": (1, 1)} for path in paths}
+
+    totals = aggregate_incremental(prefix, str(tmp_path / "state"), aggregate_files)
+    assert seen == [path for path, _, _ in files]
+    assert totals == {"user1": (len(files), len(files))}
+
+
+def test_iter_s3_blocks_missing_prefix(fake_s3):
+    with pytest.raises(FileNotFoundError):
+        list(iter_s3_blocks("s3://bucket/missing/"))
+
+
+def test_iter_s3_blocks_with_moto(monkeypatch):
+    moto = pytest.importorskip("moto")
+    import boto3
+
+    mock = getattr(moto, "mock_aws", None) or moto.mock_s3
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_REGION", "us-east-1")
+    with mock():
+        _s3_client_for.cache_clear()
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="logs")
+        content = ("\n".join(LINES) + "\n").encode() * 50
+        for shard in range(3):
+            s3.put_object(Bucket="logs", Key=f"hourly/{shard}.log", Body=content)
+
+        blocks = list(iter_s3_blocks("s3://logs/hourly/", part_size=256, max_workers=4))
+        assert b"".join(blocks) == content * 3
+        assert read_lines("s3://logs/hourly/1.log") == (LINES * 50)
+    _s3_client_for.cache_clear()
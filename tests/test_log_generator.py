@@ -0,0 +1,49 @@
+# tests/test_log_generator.py
+import pytest
+from collections import Counter
+from mapreduce_billing.naive_aggregation import parse_record
+from utils.log_generator import generate_logs, iter_log_lines, parse_mix
+
+
+def test_lines_parse_and_are_reproducible():
+    lines = list(iter_log_lines(500, users=20, seed=7))
+    assert lines == list(iter_log_lines(500, users=20, seed=7))
+    assert lines != list(iter_log_lines(500, users=20, seed=8))
+    for line in lines:
+        timestamp, user, task, status, duration = parse_record(line)
+        assert timestamp.startswith("2025-05") and timestamp.endswith("Z")
+        assert 50 <= duration <= 2000
+
+
+def test_zipf_skew_concentrates_traffic():
+    def top_share(skew):
+        users = Counter(line.split()[1] for line in iter_log_lines(5000, users=100, skew=skew))
+        return users.most_common(1)[0][1] / 5000
+
+    uniform, skewed = top_share(0.0), top_share(1.5)
+    print("Top user share uniform/skewed:", uniform, skewed)
+    assert uniform < 0.05
+    assert skewed > 0.3
+
+
+def test_task_and_status_mix():
+    lines = list(iter_log_lines(2000, task_mix={"login": 3, "createOrder": 1},
+                                status_mix={"200": 1}))
+    tasks = Counter(line.split()[2] for line in lines)
+    assert set(tasks) == {"login", "createOrder"}
+    assert tasks["login"] / len(lines) == pytest.approx(0.75, abs=0.05)
+    assert {line.split()[3] for line in lines} == {"200"}
+
+
+def test_generate_logs_writes_records(tmp_path):
+    path = tmp_path / "logs.txt"
+    written = generate_logs(str(path), 250_001, users=5)
+    content = path.read_text()
+    assert written == len(content)
+    assert content.count("\n") == 250_001
+
+
+def test_parse_mix():
+    assert parse_mix("login=5, createOrder=1") == {"login": 5.0, "createOrder": 1.0}
+    with pytest.raises(ValueError, match="Invalid mix entry"):
+        parse_mix("login")
@@ -1,7 +1,11 @@
 # tests/test_mapreduce.py
 import pytest
 import logging
-from mapreduce_billing.map_reduce import map_records, reduce_records
+from mapreduce_billing.map_reduce import (
+    check_error_rate, malformed_lines, map_records, map_parsed_records, reduce_records,
+)
+from mapreduce_billing.metrics import LineCounters
+import json
 import os
 
 # Configure logging for tests
@@ -11,57 +15,32 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# FakeRDD to simulate minimal RDD behavior for map and reduceByKey
-class FakeRDD:
-    def __init__(self, data):
-        self.data = data
-
-    def map(self, fn):
-        mapped = [fn(x) for x in self.data]
-        logger.info("map_records output: %s", mapped)
-        print("map_records output:", mapped)
-        return FakeRDD(mapped)
-
-    def reduceByKey(self, fn):
-        result = {}
-        for key, value in self.data:
-            if key in result:
-                result[key] = fn(result[key], value)
-            else:
-                result[key] = value
-        reduced = list(result.items())
-        logger.info("reduce_records output: %s", reduced)
-        print("reduce_records output:", reduced)
-        return FakeRDD(reduced)
-
-    def collect(self):
-        return self.data
-
-
-def test_map_records_single_entry(monkeypatch):
+def test_map_records_single_entry(monkeypatch, context):
     # Set rate for 'login'
     monkeypatch.setenv("RATE_login", "0.005")
     lines = ["2025-05-02T00:00:00Z user1 login 200 100ms"]
-    fake_rdd = FakeRDD(lines)
+    rdd = context.parallelize(lines)
 
-    mapped = map_records(fake_rdd).collect()
+    mapped = map_records(rdd).collect()
+    logger.info("map_records output: %s", mapped)
+    print("map_records output:", mapped)
     assert len(mapped) == 1
     user, (duration, cost) = mapped[0]
     assert user == "user1"
     assert duration == 100
-    assert cost == pytest.approx(100 * 0.005)
+    assert cost == 100 * 5000
 
 
 def test_reduce_records():
-    a = (100, 0.5)
-    b = (200, 2.0)
+    a = (100, 500_000)
+    b = (200, 2_000_000)
     result = reduce_records(a, b)
     logger.info("reduce_records single combine result: %s", result)
     print("reduce_records single combine result:", result)
-    assert result == (300, pytest.approx(2.5))
+    assert result == (300, 2_500_000)
 
 
-def test_map_reduce_multiple_entries(monkeypatch):
+def test_map_reduce_multiple_entries(monkeypatch, context):
     # Set rates for tasks
     monkeypatch.setenv("RATE_login", "0.005")
     monkeypatch.setenv("RATE_createOrder", "0.010")
@@ -71,9 +50,9 @@ def test_map_reduce_multiple_entries(monkeypatch):
         "2025-05-02T00:01:00Z user1 createOrder 201 200ms",
         "2025-05-02T00:02:00Z user2 login 200 50ms"
     ]
-    fake_rdd = FakeRDD(lines)
+    rdd = context.parallelize(lines, 2)
 
-    mapped_rdd = map_records(fake_rdd)
+    mapped_rdd = map_records(rdd)
     reduced_rdd = mapped_rdd.reduceByKey(reduce_records)
     aggregated = reduced_rdd.collect()
 
@@ -83,12 +62,75 @@ def test_map_reduce_multiple_entries(monkeypatch):
 
     result_dict = {user: metrics for user, metrics in aggregated}
 
-    # user1: duration 300ms, cost = 100*0.005 + 200*0.010
+    # user1: duration 300ms, cost = 100*0.005 + 200*0.010 in micro-units
     duration1, cost1 = result_dict["user1"]
     assert duration1 == 300
-    assert cost1 == pytest.approx(100 * 0.005 + 200 * 0.010)
+    assert cost1 == 100 * 5000 + 200 * 10_000
 
     # user2: duration 50ms, cost = 50*0.005
     duration2, cost2 = result_dict["user2"]
     assert duration2 == 50
-    assert cost2 == pytest.approx(50 * 0.005)
+    assert cost2 == 50 * 5000
+
+
+def test_map_parsed_records_matches_map_records(monkeypatch, context):
+    monkeypatch.setenv("RATE_login", "0.005")
+    monkeypatch.setenv("RATE_createOrder", "0.010")
+
+    lines = [
+        "2025-05-02T00:00:00Z user1 login 200 100ms",
+        "2025-05-02T00:01:00Z user2 createOrder 201 200ms",
+    ]
+    # Rows as read back from the Parquet ingest output
+    records = [("user1", "login", 100), ("user2", "createOrder", 200)]
+
+    from_lines = map_records(context.parallelize(lines)).collect()
+    from_records = map_parsed_records(context.parallelize(records)).collect()
+    assert from_records == from_lines
+
+
+MIXED_LINES = [
+    "2025-05-02T00:00:00Z user1 login 200 100ms",
+    "2025-05-02T00:00:01Z user1 login 200",
+    "",
+    "2025-05-02T00:00:02Z user2 login 200 5s",
+    "2025-05-02T00:00:03Z user2 login 200 50ms",
+]
+
+
+def test_map_records_fail_policy_raises(monkeypatch, context):
+    monkeypatch.setenv("RATE_login", "0.005")
+    with pytest.raises(ValueError, match="Invalid log line"):
+        map_records(context.parallelize(MIXED_LINES)).collect()
+
+
+def test_map_records_skip_policy_counts_malformed(monkeypatch, context):
+    monkeypatch.setenv("RATE_login", "0.005")
+    counters = LineCounters(context)
+    pairs = map_records(
+        context.parallelize(MIXED_LINES, 2), counters=counters, on_error="skip"
+    ).collect()
+    assert pairs == [("user1", (100, 500_000)), ("user2", (50, 250_000))]
+    # The blank line is dropped without counting as malformed
+    assert counters.records.value == 5
+    assert counters.malformed.value == 2
+
+
+def test_malformed_lines_side_output(context):
+    rows = [
+        json.loads(row) for row in malformed_lines(context.parallelize(MIXED_LINES, 2)).collect()
+    ]
+    print("quarantined:", rows)
+    assert rows == [
+        {"error": "Invalid log line: '2025-05-02T00:00:01Z user1 login 200'",
+         "line": "2025-05-02T00:00:01Z user1 login 200"},
+        {"error": "Invalid duration format: '5s'",
+         "line": "2025-05-02T00:00:02Z user2 login 200 5s"},
+    ]
+
+
+def test_check_error_rate():
+    check_error_rate(0, 0, 0.0)
+    check_error_rate(1000, 1, 0.001)
+    with pytest.raises(ValueError, match="2 of 1000 lines malformed"):
+        check_error_rate(1000, 2, 0.001)
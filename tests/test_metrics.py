@@ -0,0 +1,129 @@
+# tests/test_metrics.py
+import json
+import pytest
+from mapreduce_billing import metrics as metrics_module
+from mapreduce_billing.map_reduce import map_records
+from mapreduce_billing.metrics import (
+    JobMetrics, LineCounters, prometheus_text, spark_stage_metrics, write_prometheus,
+)
+
+
+class FakeSparkContext:
+    uiWebUrl = "http://driver:4040"
+    applicationId = "app-1"
+
+    def __init__(self):
+        self.job_groups = []
+        self.properties = {}
+
+    def setJobGroup(self, group_id, description):
+        self.job_groups.append(group_id)
+        self.properties["spark.jobGroup.id"] = group_id
+
+    def setLocalProperty(self, key, value):
+        self.properties[key] = value
+
+
+REST = {
+    "http://driver:4040/api/v1/applications/app-1/jobs": [
+        {"jobId": 0, "jobGroup": "billing-aggregate", "stageIds": [0, 1]},
+        {"jobId": 1, "jobGroup": "billing-write", "stageIds": [2, 3]},
+        {"jobId": 2, "stageIds": [4]},
+    ],
+    "http://driver:4040/api/v1/applications/app-1/stages?details=false": [
+        {"stageId": 1, "attemptId": 0, "status": "COMPLETE", "name": "aggregate at spark_job.py:1",
+         "numTasks": 4, "executorRunTime": 1500, "shuffleReadBytes": 2048, "shuffleReadRecords": 40,
+         "submissionTime": "2025-05-04T19:39:30.000GMT", "completionTime": "2025-05-04T19:39:31.250GMT"},
+        {"stageId": 0, "attemptId": 0, "status": "COMPLETE", "name": "reduceByKey at spark_job.py:2",
+         "numTasks": 8, "executorRunTime": 12000, "inputBytes": 1 << 20, "inputRecords": 10000,
+         "shuffleWriteBytes": 2048, "shuffleWriteRecords": 40,
+         "submissionTime": "2025-05-04T19:39:27.500GMT", "completionTime": "2025-05-04T19:39:30.000GMT"},
+        {"stageId": 2, "attemptId": 0, "status": "SKIPPED", "name": "sortByKey"},
+        {"stageId": 3, "attemptId": 0, "status": "COMPLETE", "name": "saveAsTextFile",
+         "numTasks": 4, "executorRunTime": 800, "shuffleReadBytes": 1024, "outputBytes": 4096},
+        {"stageId": 4, "attemptId": 0, "status": "COMPLETE", "name": "unrelated"},
+    ],
+    "http://driver:4040/api/v1/applications/app-1/allexecutors": [
+        {"id": "driver", "totalTasks": 0},
+        {"id": "1", "totalTasks": 10, "failedTasks": 1, "totalDuration": 9000, "totalGCTime": 300},
+        {"id": "2", "totalTasks": 6, "failedTasks": 0, "totalDuration": 5300, "totalGCTime": 100},
+    ],
+}
+
+
+@pytest.fixture
+def fake_rest(monkeypatch):
+    monkeypatch.setattr(metrics_module, "_get_json", lambda url: REST[url])
+
+
+def test_map_records_counts_lines(monkeypatch, context):
+    monkeypatch.setenv("RATE_login", "0.005")
+    counters = LineCounters(context)
+    lines = [f"2025-05-02T00:00:00Z user{i % 3} login 200 10ms" for i in range(7)]
+    rdd = map_records(context.parallelize(lines, 3), counters=counters)
+    assert len(rdd.collect()) == 7
+    assert counters.values() == {"records": 7, "malformed_records": 0}
+
+
+def test_stage_sets_job_group_and_times(monkeypatch):
+    sc = FakeSparkContext()
+    job = JobMetrics(sc)
+    with job.stage("aggregate"):
+        assert sc.properties["spark.jobGroup.id"] == "billing-aggregate"
+    with pytest.raises(RuntimeError):
+        with job.stage("write"):
+            raise RuntimeError("boom")
+
+    assert sc.job_groups == ["billing-aggregate", "billing-write"]
+    assert sc.properties["spark.jobGroup.id"] is None
+    assert list(job.stages) == ["aggregate", "write"]
+    assert all(stage["wall_seconds"] >= 0 for stage in job.stages.values())
+
+
+def test_spark_stage_metrics(fake_rest):
+    result = spark_stage_metrics("http://driver:4040/", "app-1", ["billing-aggregate", "billing-write"])
+    aggregate = result["stages"]["billing-aggregate"]
+    print("aggregate stages:", aggregate)
+
+    assert [(row["stage_id"], row["kind"]) for row in aggregate] == [(0, "map"), (1, "reduce")]
+    assert aggregate[0]["input_bytes"] == 1 << 20
+    assert aggregate[0]["wall_seconds"] == 2.5
+    assert aggregate[1]["executor_run_seconds"] == 1.5
+    assert [row["stage_id"] for row in result["stages"]["billing-write"]] == [3]
+    assert result["executors"] == {
+        "1": {"tasks": 10, "failed_tasks": 1, "task_seconds": 9.0, "gc_seconds": 0.3},
+        "2": {"tasks": 6, "failed_tasks": 0, "task_seconds": 5.3, "gc_seconds": 0.1},
+    }
+
+
+def test_job_metrics_json_and_prometheus(fake_rest, tmp_path):
+    job = JobMetrics(FakeSparkContext())
+    for name in ("plan", "aggregate", "write"):
+        with job.stage(name):
+            pass
+    job.add_counters(users=3, records=10000, input_bytes=None)
+    job.collect_spark()
+    job.finish("succeeded")
+
+    document = json.loads(job.to_json())
+    assert document["event"] == "billing_job_metrics"
+    assert document["status"] == "succeeded"
+    assert document["stages"]["aggregate"]["shuffle_write_bytes"] == 2048
+    assert document["stages"]["plan"]["spark_stages"] == []
+
+    path = tmp_path / "billing.prom"
+    write_prometheus(document, str(path))
+    text = path.read_text()
+    print(text)
+    assert 'billing_job_stage_input_bytes{stage="aggregate"} 1048576' in text
+    assert 'billing_job_executor_task_seconds{executor="1"} 9.0' in text
+    assert "billing_job_success 1" in text
+    assert "billing_job_records 10000" in text
+    assert "billing_job_input_bytes" not in text
+    assert text == prometheus_text(document)
+    assert list(tmp_path.iterdir()) == [path]
+
+    # Each metric's samples are contiguous under a single TYPE line
+    names = [line.split("{")[0].split(" ")[0] for line in text.splitlines() if not line.startswith("#")]
+    assert names == sorted(names)
+    assert text.count("# TYPE billing_job_stage_wall_seconds gauge") == 1
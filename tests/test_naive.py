@@ -1,7 +1,7 @@
 # tests/test_naive.py
 import pytest
 from pathlib import Path
-from mapreduce_billing.naive_aggregation import aggregate_naive
+from mapreduce_billing.naive_aggregation import aggregate_naive, parse_line, parse_record
 
 def create_temp_log(tmp_path, lines):
      """
@@ -27,7 +27,7 @@ def test_aggregate_naive_single_entry(monkeypatch, tmp_path):
     expected = {
         "user1": {
             "total_duration_ms": 100,
-            "total_cost": 100 * 0.005
+            "total_cost_micros": 100 * 5000
         }
     }
     assert result == expected
@@ -51,8 +51,25 @@ def test_aggregate_naive_multiple_entries(monkeypatch, tmp_path):
 
     # user1: 100ms + 200ms = 300ms; cost = 100*0.005 + 200*0.010
     assert result["user1"]["total_duration_ms"] == 300
-    assert pytest.approx(result["user1"]["total_cost"], rel=1e-6) == 100 * 0.005 + 200 * 0.010
+    assert result["user1"]["total_cost_micros"] == 100 * 5000 + 200 * 10_000
 
     # user2: 50ms; cost = 50*0.005
     assert result["user2"]["total_duration_ms"] == 50
-    assert pytest.approx(result["user2"]["total_cost"], rel=1e-6) == 50 * 0.005
+    assert result["user2"]["total_cost_micros"] == 50 * 5000
+
+
+@pytest.mark.parametrize("line, message", [
+    ("2025-05-02T00:00:00Z user1 login 200", "Invalid log line"),
+    ("2025-05-02T00:00:00Z user1 login 200 5s", "Invalid duration format: '5s'"),
+    ("2025-05-02T00:00:00Z user1 login 200 xms", "Cannot parse duration: 'xms'"),
+])
+def test_parse_line_and_record_report_the_same_errors(line, message):
+    for parse in (parse_line, parse_record):
+        with pytest.raises(ValueError, match=message):
+            parse(line)
+
+
+def test_parse_line_is_parse_record_without_timestamp_and_status():
+    line = "2025-05-02T00:00:00Z user1 login 200 7ms\n"
+    assert parse_record(line) == ("2025-05-02T00:00:00Z", "user1", "login", "200", 7)
+    assert parse_line(line) == ("user1", "login", 7)
@@ -0,0 +1,159 @@
+# tests/test_numpy.py
+import pytest
+from mapreduce_billing.naive_aggregation import aggregate_naive
+from mapreduce_billing.numpy_aggregation import aggregate_numpy
+
+
+def create_temp_log(tmp_path, lines):
+    """
+    Helper to write a temporary log file and return its path.
+    """
+    log_file = tmp_path / "api_logs.txt"
+    log_file.write_text("\n".join(lines))
+    return str(log_file)
+
+
+def assert_same_totals(result, expected):
+    assert result.keys() == expected.keys()
+    for user, metrics in expected.items():
+        assert result[user]["total_duration_ms"] == metrics["total_duration_ms"]
+        assert result[user]["total_cost_micros"] == metrics["total_cost_micros"]
+
+
+def test_aggregate_numpy_matches_naive(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    monkeypatch.setenv("RATE_createOrder", "0.010")
+
+    lines = [
+        "2025-05-02T00:00:00Z user1 login 200 100ms",
+        "2025-05-02T00:01:00Z user1 createOrder 201 200ms",
+        "",
+        "2025-05-02T00:02:00Z user2 login 200 50ms",
+        "2025-05-02T00:03:00Z user3 unknownTask 200 70ms",
+    ]
+    log_path = create_temp_log(tmp_path, lines)
+
+    result = aggregate_numpy(log_path)
+    print("NumPy aggregation result:", result)
+    assert_same_totals(result, aggregate_naive(log_path))
+    assert result["user3"]["total_cost_micros"] == 0
+
+
+def test_aggregate_numpy_across_blocks(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+
+    lines = [
+        f"2025-05-02T00:00:00Z user{i % 7} login 200 {i}ms" for i in range(1, 500)
+    ]
+    log_path = create_temp_log(tmp_path, lines)
+
+    # Tiny blocks force many batches and lines spanning read boundaries
+    result = aggregate_numpy(log_path, block_size=97)
+    assert_same_totals(result, aggregate_naive(log_path))
+
+
+def test_aggregate_numpy_fallback_lines(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+
+    # Signed durations and non-ASCII users are accepted by parse_line but
+    # cannot be tokenized in bulk
+    lines = [
+        "2025-05-02T00:00:00Z usér1 login 200 +100ms",
+        "2025-05-02T00:01:00Z user2 login 200 20ms\r",
+    ]
+    log_path = create_temp_log(tmp_path, lines)
+
+    result = aggregate_numpy(log_path)
+    assert_same_totals(result, aggregate_naive(log_path))
+
+
+def test_encode_spans_codes_only_distinct_tokens(monkeypatch, tmp_path):
+    from mapreduce_billing import numpy_aggregation
+    monkeypatch.setenv("RATE_login", "0.005")
+    looked_up = []
+    encode = numpy_aggregation._Codes.encode
+    monkeypatch.setattr(
+        numpy_aggregation._Codes, "encode",
+        lambda self, tokens: looked_up.append(len(tokens)) or encode(self, tokens),
+    )
+    # Users sharing 8-byte prefixes and a single-character duration
+    users = ["u", "user0001", "user00010", "user00010x", "user0001"]
+    lines = [f"2025-05-02T00:00:00Z {users[i % 5]} login 200 {i % 10}ms" for i in range(600)]
+    log_path = create_temp_log(tmp_path, lines)
+    assert_same_totals(aggregate_numpy(log_path), aggregate_naive(log_path))
+    print("Tokens looked up in Python:", looked_up)
+    assert looked_up == [4, 1]
+
+    # A token too long to pack: its block's users are looked up one by one
+    looked_up.clear()
+    log_path = create_temp_log(tmp_path, lines + [f"2025-05-02T00:00:00Z {'x' * 100} login 200 1ms"])
+    assert_same_totals(aggregate_numpy(log_path), aggregate_naive(log_path))
+    assert looked_up == [601, 1]
+
+
+def test_encode_spans_hash_collision(monkeypatch, tmp_path):
+    from mapreduce_billing import numpy_aggregation
+    monkeypatch.setenv("RATE_login", "0.005")
+    # With a zero multiplier every multi-word token hashes to its last word
+    monkeypatch.setattr(numpy_aggregation, "_HASH_MULTIPLIER", numpy_aggregation.np.uint64(0))
+    lines = [
+        "2025-05-02T00:00:00Z aaaaaaaa_tenant login 200 10ms",
+        "2025-05-02T00:00:00Z bbbbbbbb_tenant login 200 20ms",
+        "2025-05-02T00:00:00Z aaaaaaaa_tenant login 200 30ms",
+    ]
+    log_path = create_temp_log(tmp_path, lines)
+    result = aggregate_numpy(log_path)
+    assert result["aaaaaaaa_tenant"]["total_duration_ms"] == 40
+    assert_same_totals(result, aggregate_naive(log_path))
+
+
+def test_aggregate_numpy_nul_bytes(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    log_path = tmp_path / "api_logs.txt"
+    log_path.write_bytes(
+        b"2025-05-02T00:00:00Z user1 login 200 10ms\n2025-05-02T00:00:00Z user1\x00 login 200 20ms\n"
+    )
+    result = aggregate_numpy(str(log_path))
+    assert_same_totals(result, aggregate_naive(str(log_path)))
+    assert len(result) == 2
+
+
+@pytest.mark.parametrize("bad_line, message", [
+    ("2025-05-02T00:00:00Z user1 login 200", "Invalid log line"),
+    ("2025-05-02T00:00:00Z user1 login 200 100", "Invalid duration format"),
+    ("2025-05-02T00:00:00Z user1 login 200 abcms", "Cannot parse duration"),
+])
+def test_aggregate_numpy_invalid_line(monkeypatch, tmp_path, bad_line, message):
+    monkeypatch.setenv("RATE_login", "0.005")
+    log_path = create_temp_log(tmp_path, [
+        "2025-05-02T00:00:00Z user1 login 200 100ms",
+        bad_line,
+    ])
+
+    with pytest.raises(ValueError, match=message):
+        aggregate_numpy(log_path)
+
+
+def test_aggregate_numpy_exact_beyond_int64(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+
+    lines = [
+        "2025-05-02T00:00:00Z user1 login 200 10000000000000000ms",
+        "2025-05-02T00:01:00Z user2 login 200 100ms",
+        # Too long for the bulk tokenizer and for int64
+        "2025-05-02T00:02:00Z user3 login 200 +100000000000000000000ms",
+    ]
+    log_path = create_temp_log(tmp_path, lines)
+
+    # Small blocks: later int64 blocks still add to the exact ones
+    for block_size in (1 << 20, 60):
+        result = aggregate_numpy(log_path, block_size=block_size)
+        print("NumPy aggregation result:", result)
+        assert_same_totals(result, aggregate_naive(log_path))
+        assert result["user1"]["total_cost_micros"] == 5 * 10 ** 19
+        assert result["user2"]["total_cost_micros"] == 500000
+
+    # Many records whose sum, not any single cost, overflows int64
+    lines = [f"2025-05-02T00:00:00Z user{i % 2} login 200 999999999999999ms" for i in range(4000)]
+    log_path = create_temp_log(tmp_path, lines)
+    assert_same_totals(aggregate_numpy(log_path), aggregate_naive(log_path))
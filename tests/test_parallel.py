@@ -0,0 +1,79 @@
+# tests/test_parallel.py
+import pytest
+from mapreduce_billing.naive_aggregation import aggregate_naive
+from mapreduce_billing.parallel_aggregation import aggregate_parallel, split_byte_ranges
+
+
+def create_temp_log(tmp_path, lines):
+    """
+    Helper to write a temporary log file and return its path.
+    """
+    log_file = tmp_path / "api_logs.txt"
+    log_file.write_text("\n".join(lines))
+    return str(log_file)
+
+
+def test_split_byte_ranges_aligned_to_lines(tmp_path):
+    lines = [f"2025-05-02T00:00:00Z user{i} login 200 {i}ms" for i in range(50)]
+    log_path = create_temp_log(tmp_path, lines)
+    data = open(log_path, 'rb').read()
+
+    ranges = split_byte_ranges(log_path, 7)
+    print("Byte ranges:", ranges)
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+        assert data[start - 1:start] == b"\n"
+
+    rejoined = b"".join(data[start:end] for start, end in ranges)
+    assert rejoined == data
+
+
+def test_split_byte_ranges_more_ranges_than_lines(tmp_path):
+    line = "2025-05-02T00:00:00Z user1 login 200 1ms"
+    log_path = create_temp_log(tmp_path, [line])
+    assert split_byte_ranges(log_path, 16) == [(0, len(line))]
+
+
+@pytest.mark.parametrize("workers", [1, 2, 5])
+def test_aggregate_parallel_matches_naive(monkeypatch, tmp_path, workers):
+    monkeypatch.setenv("RATE_login", "0.005")
+    monkeypatch.setenv("RATE_createOrder", "0.010")
+
+    lines = [
+        f"2025-05-02T00:00:00Z user{i % 11} {'login' if i % 3 else 'createOrder'} 200 {i}ms"
+        for i in range(1, 300)
+    ]
+    lines.insert(40, "")
+    log_path = create_temp_log(tmp_path, lines)
+
+    result = aggregate_parallel(log_path, workers=workers)
+    expected = aggregate_naive(log_path)
+    print("Parallel aggregation result:", result)
+
+    assert result.keys() == expected.keys()
+    for user, metrics in expected.items():
+        assert result[user]["total_duration_ms"] == metrics["total_duration_ms"]
+        assert result[user]["total_cost_micros"] == metrics["total_cost_micros"]
+
+
+def test_aggregate_parallel_invalid_line(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    log_path = create_temp_log(tmp_path, [
+        "2025-05-02T00:00:00Z user1 login 200 100ms",
+        "2025-05-02T00:01:00Z user1 login 200",
+    ])
+
+    with pytest.raises(ValueError, match="Invalid log line"):
+        aggregate_parallel(log_path, workers=2)
+
+
+def test_parallel_cli_rejects_s3_input(monkeypatch, capsys):
+    from mapreduce_billing import naive_aggregation
+    monkeypatch.setattr("sys.argv", [
+        "naive_aggregation.py", "--engine", "parallel", "--input-path", "s3a://logs/2025-05-02/",
+    ])
+    with pytest.raises(SystemExit):
+        naive_aggregation.main()
+    assert "--engine parallel splits local files" in capsys.readouterr().err
@@ -0,0 +1,63 @@
+# tests/test_partitioning.py
+from mapreduce_billing.partitioning import (
+    MIB, MAX_SPLIT_BYTES, MIN_SPLIT_BYTES, available_parallelism, plan_input, plan_partitions,
+)
+
+
+def conf_lookup(settings):
+    return lambda key, default=None: settings.get(key, default)
+
+
+def test_available_parallelism_uses_dynamic_allocation_ceiling():
+    conf = conf_lookup({
+        "spark.executor.cores": "2",
+        "spark.dynamicAllocation.enabled": "true",
+        "spark.dynamicAllocation.maxExecutors": "10",
+    })
+    assert available_parallelism(conf, default_parallelism=4) == 20
+
+
+def test_available_parallelism_static_executors():
+    conf = conf_lookup({"spark.executor.cores": "2", "spark.executor.instances": "3"})
+    assert available_parallelism(conf, default_parallelism=2) == 6
+    assert available_parallelism(conf_lookup({}), default_parallelism=8) == 8
+
+
+def test_plan_large_input_fills_every_slot():
+    plan = plan_partitions([10 * 1024 * MIB], parallelism=20)
+    print("Large input plan:", plan)
+    assert plan["input_partitions"] >= 40
+    assert plan["split_bytes"] <= MAX_SPLIT_BYTES
+    assert plan["shuffle_partitions"] == 40
+    assert not plan["coalesce"]
+
+
+def test_plan_small_input_is_not_shredded():
+    plan = plan_partitions([2 * MIB], parallelism=20)
+    assert plan["split_bytes"] == MIN_SPLIT_BYTES
+    assert plan["input_partitions"] == 1
+    assert plan["shuffle_partitions"] == 1
+
+
+def test_plan_coalesces_many_small_files():
+    plan = plan_partitions([64 * 1024] * 1000, parallelism=4)
+    assert plan["files"] == 1000
+    assert plan["input_partitions"] == 8
+    assert plan["coalesce"]
+
+
+def test_plan_input_lists_local_directory(tmp_path):
+    for day in range(3):
+        (tmp_path / f"api_logs_{day}.txt").write_text("x" * 100)
+    nested = tmp_path / "date=2025-05-02"
+    nested.mkdir()
+    (nested / "part-0.parquet").write_bytes(b"x" * 50)
+
+    assert plan_input(str(tmp_path), parallelism=2)["input_bytes"] == 300
+    assert plan_input(str(tmp_path), parallelism=2, recursive=True)["input_bytes"] == 350
+
+
+def test_plan_input_unlisted_scheme_falls_back_to_slots():
+    plan = plan_input("hdfs://namenode/logs", parallelism=5)
+    assert plan["input_partitions"] == 10
+    assert plan["input_bytes"] is None
@@ -0,0 +1,144 @@
+# tests/test_rates.py
+import json
+import os
+import pytest
+from mapreduce_billing.incremental import aggregate_incremental
+from mapreduce_billing.map_reduce import map_records
+from mapreduce_billing.naive_aggregation import aggregate_naive
+from mapreduce_billing.rates import (
+    RateTableSnapshot, format_cost, load_rate_table, rates_value, rates_version,
+    to_micros,
+)
+
+
+@pytest.fixture
+def clean_rates_env(monkeypatch):
+    monkeypatch.setattr("mapreduce_billing.rates.load_dotenv", lambda: None)
+    monkeypatch.delenv("BILLING_RATES_PATH", raising=False)
+    for name in list(os.environ):
+        if name.startswith("RATE_"):
+            monkeypatch.delenv(name)
+    return monkeypatch
+
+
+def write_rates(tmp_path, document):
+    path = tmp_path / "rates.json"
+    path.write_text(json.dumps(document))
+    return str(path)
+
+
+def test_load_rates_from_env(clean_rates_env):
+    clean_rates_env.setenv("RATE_login", "0.005")
+    clean_rates_env.setenv("RATE_createOrder", "0.010")
+    table = load_rate_table()
+    print("Env rate table:", table)
+    assert table.rates == {"login": 0.005, "createOrder": 0.010}
+    assert table.source == "env"
+    assert table.version == rates_version({"createOrder": 0.010, "login": 0.005})
+
+
+def test_load_rates_from_file(clean_rates_env, tmp_path):
+    clean_rates_env.setenv("RATE_login", "0.5")
+    path = write_rates(tmp_path, {"version": "2025-06", "rates": {"login": 0.001}})
+    clean_rates_env.setenv("BILLING_RATES_PATH", path)
+    assert load_rate_table() == RateTableSnapshot("2025-06", {"login": 0.001}, path)
+
+    unversioned = write_rates(tmp_path, {"rates": {"login": 0.001}})
+    assert load_rate_table(unversioned).version == rates_version({"login": 0.001})
+
+
+@pytest.mark.parametrize("document, message", [
+    ({"rates": {"login": "cheap"}}, "Invalid rate for login"),
+    ({"rates": {"login": -1}}, "Invalid rate for login"),
+    ({"rates": {"login": float("inf")}}, "Invalid rate for login"),
+    ({"rates": {"log in": 0.1}}, "Invalid task name"),
+    ({"rates": {"login": 0.0000001}}, "more than 6 decimal places"),
+    ({"version": "1"}, "expected an object with a 'rates' mapping"),
+])
+def test_invalid_rate_files(clean_rates_env, tmp_path, document, message):
+    with pytest.raises(ValueError, match=message):
+        load_rate_table(write_rates(tmp_path, document))
+
+
+def test_invalid_env_rate(clean_rates_env):
+    clean_rates_env.setenv("RATE_login", "abc")
+    with pytest.raises(ValueError, match="Invalid rate for login: abc"):
+        load_rate_table()
+
+
+def test_to_micros():
+    assert to_micros(0.005) == 5000
+    assert to_micros("0.010") == 10_000
+    assert to_micros(0.000001) == 1
+    assert to_micros(2) == 2_000_000
+    with pytest.raises(ValueError, match="more than 6 decimal places"):
+        to_micros(0.1234567)
+
+
+@pytest.mark.parametrize("micros, expected", [
+    (0, "0.00"),
+    (4999, "0.00"),
+    (5000, "0.01"),
+    (2_500_000, "2.50"),
+    (1_234_565_000, "1234.57"),
+    (-5000, "-0.01"),
+    (-4999, "0.00"),
+])
+def test_format_cost(micros, expected):
+    assert format_cost(micros) == expected
+
+
+def test_map_records_uses_broadcast_rates(clean_rates_env, context):
+    lines = ["2025-05-02T00:00:00Z user1 login 200 100ms"]
+    pairs = map_records(context.parallelize(lines), context.broadcast({"login": 0.25})).collect()
+    assert pairs == [("user1", (100, 25_000_000))]
+    assert rates_value(RateTableSnapshot("v", {"login": 1.0}, "env")) == {"login": 1.0}
+
+
+def test_aggregate_naive_uses_rate_file(clean_rates_env, tmp_path):
+    log_path = tmp_path / "api_logs.txt"
+    log_path.write_text("2025-05-02T00:00:00Z user1 newTask 200 100ms\n")
+    clean_rates_env.setenv("BILLING_RATES_PATH", write_rates(tmp_path, {"rates": {"newTask": 0.5}}))
+    assert aggregate_naive(str(log_path))["user1"]["total_cost_micros"] == 50_000_000
+
+
+@pytest.mark.parametrize("engine", ["naive", "numpy", "parallel", "mapreduce", "spill"])
+def test_engines_use_passed_rate_table(clean_rates_env, tmp_path, engine):
+    from mapreduce_billing.engines import aggregate_mapreduce
+    from mapreduce_billing.numpy_aggregation import aggregate_numpy
+    from mapreduce_billing.parallel_aggregation import aggregate_parallel
+    from mapreduce_billing.spill import aggregate_spilling
+    aggregate = {
+        "naive": lambda path, table: aggregate_naive(path, rates=table),
+        "numpy": lambda path, table: aggregate_numpy(path, rates=table),
+        "parallel": lambda path, table: aggregate_parallel(path, 2, table),
+        "mapreduce": lambda path, table: aggregate_mapreduce(path, "serial", rates=table),
+        "spill": lambda path, table: {
+            user: {"total_cost_micros": cost} for user, _, cost in
+            aggregate_spilling(path, 1024 * 1024, str(tmp_path), table).sorted_items()
+        },
+    }[engine]
+    log_path = tmp_path / "api_logs.txt"
+    log_path.write_text("2025-05-02T00:00:00Z user1 login 200 100ms\n")
+    # The environment has no rates, so the passed table must be used
+    table = RateTableSnapshot("v", {"login": 0.5}, "test")
+    assert aggregate(str(log_path), table)["user1"]["total_cost_micros"] == 50_000_000
+
+
+def test_incremental_recomputes_on_rate_change(tmp_path):
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+    (log_dir / "day1.txt").write_text("2025-05-02T00:00:00Z user1 login 200 100ms\n")
+    state_dir = str(tmp_path / "state")
+    calls = []
+
+    def aggregate_files(rate):
+        def aggregate(paths):
+            calls.append(len(paths))
+            return {path: {"user1": (100, 100 * rate)} for path in paths}
+        return aggregate
+
+    assert aggregate_incremental(str(log_dir), state_dir, aggregate_files(0.5), rates_version="v1") == {"user1": (100, 50.0)}
+    assert aggregate_incremental(str(log_dir), state_dir, aggregate_files(0.5), rates_version="v1") == {"user1": (100, 50.0)}
+    assert aggregate_incremental(str(log_dir), state_dir, aggregate_files(1.0), rates_version="v2") == {"user1": (100, 100.0)}
+    assert calls == [1, 1]
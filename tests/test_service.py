@@ -0,0 +1,117 @@
+# tests/test_service.py
+import os
+import subprocess
+import sys
+import threading
+import pytest
+from mapreduce_billing.service import BillingService, serve, submit_job
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+LINES = [
+    "2025-05-02T00:00:00Z user1 login 200 100ms",
+    "2025-05-02T00:00:01Z user2 login 200 40ms",
+    "2025-05-02T00:00:02Z user1 login 500 60ms",
+]
+
+
+def run_python(code, **env):
+    environ = dict(os.environ, PYTHONPATH=SRC, **env)
+    result = subprocess.run(
+        [sys.executable, "-c", code], env=environ, capture_output=True, text=True, check=True
+    )
+    return result.stdout.strip()
+
+
+def test_config_import_is_lazy():
+    # aws mode without a reachable cluster: importing must neither load boto3 nor call EKS
+    out = run_python(
+        "import sys, utils.config as c; print('boto3' in sys.modules, c.Config.ENVIRONMENT)",
+        ENVIRONMENT="aws", EKS_CLUSTER_NAME="billing",
+    )
+    assert out == "False aws"
+
+
+def test_config_resolves_eks_master_on_first_access():
+    code = """
+import sys, types
+calls = []
+class EKS:
+    def describe_cluster(self, name):
+        calls.append(name)
+        return {"cluster": {"endpoint": "https://eks.example"}}
+sys.modules["boto3"] = types.SimpleNamespace(client=lambda service, region_name: EKS())
+from utils.config import Config
+print(Config.SPARK_MASTER_URL, Config.SPARK_MASTER_URL_AWS, calls)
+"""
+    out = run_python(code, ENVIRONMENT="aws", EKS_CLUSTER_NAME="billing")
+    assert out == "k8s://https://eks.example k8s://https://eks.example ['billing']"
+
+
+def test_service_runs_jobs(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    log_path = tmp_path / "api_logs.txt"
+    log_path.write_text("\n".join(LINES))
+    service = BillingService("python")
+
+    for _ in range(2):
+        result = service.handle({"input_path": str(log_path), "output_path": str(tmp_path / "out.txt")})
+        print("Job result:", result)
+        assert result["status"] == "ok"
+        assert result["users"] == 2
+        assert result["total_duration_ms"] == 200
+        assert result["total_cost_micros"] == 200 * 5000
+    assert service.jobs == 2
+    assert (tmp_path / "out.txt").read_text() == (
+        "user1: total_duration=160ms, total_cost=0.80\n"
+        "user2: total_duration=40ms, total_cost=0.20\n"
+    )
+    assert (tmp_path / "out.rates.json").exists()
+
+    failed = service.handle({"input_path": str(tmp_path / "missing.txt")})
+    assert failed["status"] == "error"
+    assert "FileNotFoundError" in failed["error"]
+    assert service.handle({"command": "reboot"})["status"] == "error"
+    assert service.handle(["not", "a", "job"])["status"] == "error"
+
+
+@pytest.mark.parametrize("engine", ["python", "numpy", "parallel"])
+def test_service_costs_with_job_rate_table(monkeypatch, tmp_path, engine):
+    from mapreduce_billing.rates import RateTableSnapshot
+    # The rate file changes after the job loads it: the costs must still use
+    # the table the job loaded and stamps
+    tables = iter([
+        RateTableSnapshot("v2", {"login": 0.5}, "test"),
+        RateTableSnapshot("v3", {"login": 1.0}, "test"),
+    ])
+    monkeypatch.setattr("mapreduce_billing.rates.load_rate_table", lambda: next(tables))
+    log_path = tmp_path / "api_logs.txt"
+    log_path.write_text("\n".join(LINES))
+    result = BillingService(engine, workers=2).handle({"input_path": str(log_path)})
+    assert result["rates_version"] == "v2"
+    assert result["total_cost_micros"] == 200 * 500_000
+
+
+def test_serve_over_socket(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    log_path = tmp_path / "api_logs.txt"
+    log_path.write_text("\n".join(LINES))
+    socket_path = str(tmp_path / "billing.sock")
+    ready = threading.Event()
+    server = threading.Thread(target=serve, args=(BillingService("numpy"), socket_path, ready))
+    server.start()
+    try:
+        assert ready.wait(5)
+        with pytest.raises(RuntimeError):
+            serve(BillingService("python"), socket_path)
+
+        assert submit_job({"command": "ping"}, socket_path, timeout=5)["engine"] == "numpy"
+        result = submit_job({"input_path": str(log_path)}, socket_path, timeout=5)
+        assert result["status"] == "ok"
+        assert result["total_cost_micros"] == 200 * 5000
+    finally:
+        response = submit_job({"command": "shutdown"}, socket_path, timeout=5)
+        server.join(5)
+    assert response == {"status": "ok", "jobs": 1}
+    assert not server.is_alive()
+    assert not os.path.exists(socket_path)
@@ -0,0 +1,117 @@
+# tests/test_sketches.py
+import json
+import pickle
+import random
+import pytest
+from mapreduce_billing.map_reduce import map_records
+from mapreduce_billing.naive_aggregation import aggregate_naive
+from mapreduce_billing.sketches import (
+    BillingSketches, DDSketch, HeavyHitters, HyperLogLog, SketchAccumulatorParam,
+    load_sketches, save_sketches,
+)
+
+
+def exact_quantile(values, q):
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))]
+
+
+def test_hyperloglog_estimate_and_union():
+    left, right = HyperLogLog(), HyperLogLog()
+    for i in range(30_000):
+        left.add(f"user{i}")
+    for i in range(20_000, 50_000):
+        right.add(f"user{i}".encode())
+    assert left.count() == pytest.approx(30_000, rel=0.03)
+    assert left.merge(right).count() == pytest.approx(50_000, rel=0.03)
+    assert HyperLogLog().count() == 0
+
+
+def test_ddsketch_relative_accuracy_and_exact_merge():
+    rng = random.Random(1)
+    values = [rng.randint(1, 5000) for _ in range(20_000)] + [0] * 100
+    whole = DDSketch()
+    parts = [DDSketch() for _ in range(4)]
+    for i, value in enumerate(values):
+        whole.add(value)
+        parts[i % 4].add(value)
+    merged = parts[0].merge(parts[1]).merge(parts[2]).merge(parts[3])
+
+    for q in (0.0, 0.5, 0.9, 0.99, 1.0):
+        expected = exact_quantile(values, q)
+        assert merged.quantile(q) == whole.quantile(q)
+        assert whole.quantile(q) == pytest.approx(expected, rel=0.01, abs=1e-9)
+    assert DDSketch().quantile(0.5) is None
+
+
+def test_heavy_hitters_keep_heavy_items():
+    rng = random.Random(2)
+    weights = {}
+    sketch = HeavyHitters(capacity=20)
+    for _ in range(20):
+        batch = {f"user{rng.randint(1, 500)}": rng.randint(1, 10) for _ in range(200)}
+        batch.update({"whale": 5000, "shark": 2000})
+        for user, weight in batch.items():
+            weights[user] = weights.get(user, 0) + weight
+        sketch.update(batch)
+
+    assert len(sketch.counters) <= 20
+    assert [user for user, _ in sketch.top(2)] == ["whale", "shark"]
+    for user, estimate in sketch.counters.items():
+        assert estimate <= weights[user] <= estimate + sketch.error
+
+
+def test_billing_sketches_merge_round_trip(tmp_path):
+    records = [
+        (f"user{i % 40}", ("login", "createOrder")[i % 2], 10 + i % 90, (10 + i % 90) * 5000)
+        for i in range(1000)
+    ]
+    whole, first, second = BillingSketches(), BillingSketches(), BillingSketches()
+    for i, record in enumerate(records):
+        whole.add(*record)
+        (first if i < 400 else second).add(*record)
+
+    restored = pickle.loads(pickle.dumps(first))
+    merged = restored.merge(BillingSketches.from_dict(json.loads(json.dumps(second.to_dict()))))
+    summary = merged.summary(top=3)
+    print("summary:", summary)
+
+    assert summary == whole.summary(top=3)
+    assert summary["records"] == 1000
+    assert summary["distinct_users"] == pytest.approx(40, abs=1)
+    assert summary["tasks"]["login"]["requests"] == 500
+    assert summary["tasks"]["login"]["distinct_users"] == 20
+
+    path = tmp_path / "billing.sketches.json"
+    save_sketches(merged, str(path))
+    assert load_sketches(str(path)).summary(top=3) == summary
+
+    part_dir = tmp_path / "_sketches"
+    part_dir.mkdir()
+    (part_dir / "part-00000").write_text(json.dumps(first.to_dict()) + "\n")
+    (part_dir / "part-00001").write_text(json.dumps(second.to_dict()) + "\n")
+    assert load_sketches(str(part_dir)).summary(top=3) == summary
+
+
+def test_merge_rejects_different_parameters():
+    with pytest.raises(ValueError, match="different parameters"):
+        BillingSketches(precision=12).merge(BillingSketches())
+
+
+def test_sketches_match_between_spark_map_and_naive(monkeypatch, tmp_path, context):
+    monkeypatch.setenv("RATE_login", "0.005")
+    monkeypatch.setenv("RATE_createOrder", "0.010")
+    lines = [
+        f"2025-05-02T00:00:00Z user{i % 7} {('login', 'createOrder')[i % 3 == 0]} 200 {i}ms"
+        for i in range(300)
+    ]
+    log_path = tmp_path / "api_logs.txt"
+    log_path.write_text("\n".join(lines) + "\n")
+
+    accumulator = context.accumulator(BillingSketches(), SketchAccumulatorParam())
+    map_records(context.parallelize(lines, 2), sketches=accumulator).collect()
+
+    naive = BillingSketches()
+    aggregate_naive(str(log_path), naive)
+    assert accumulator.value.summary() == naive.summary()
+    assert naive.summary()["tasks"]["createOrder"]["requests"] == 100
@@ -0,0 +1,121 @@
+# tests/test_skew.py
+import pytest
+from mapreduce_billing.map_reduce import map_records, reduce_records
+from mapreduce_billing.metrics import LineCounters
+from mapreduce_billing.skew import find_hot_keys, salt_partition, salted_reduce
+
+
+def skewed_lines():
+    lines = [f"2025-05-02T00:00:{i % 60:02d}Z enterprise login 200 {i % 7 + 1}ms" for i in range(900)]
+    lines += [f"2025-05-02T00:00:00Z user{i} createOrder 201 {i + 1}ms" for i in range(100)]
+    return [line for i in range(4) for line in lines[i::4]]
+
+
+def test_find_hot_keys():
+    counts = {"enterprise": 900, "user1": 40, "user2": 60}
+    assert find_hot_keys(counts, 4) == {"enterprise": 900}
+    assert find_hot_keys(counts, 1) == {}
+    assert find_hot_keys({}, 4) == {}
+
+
+def test_salt_partition_spreads_only_hot_keys():
+    pairs = [("hot", 1)] * 6 + [("cold", 1)] * 3
+    salted = list(salt_partition(2, iter(pairs), frozenset({"hot"}), 3))
+    assert {salt for (key, salt), _ in salted if key == "hot"} == {0, 1, 2}
+    assert {salt for (key, salt), _ in salted if key == "cold"} == {0}
+
+
+def test_salted_reduce_matches_plain_reduce(monkeypatch, context):
+    monkeypatch.setenv("RATE_login", "0.5")
+    monkeypatch.setenv("RATE_createOrder", "0.25")
+    pairs = map_records(context.parallelize(skewed_lines(), 4))
+
+    expected = dict(pairs.reduceByKey(reduce_records).collect())
+    totals, stats = salted_reduce(pairs, reduce_records, salts=4, sample_fraction=0.1, seed=1)
+    result = totals.collect()
+    print("Skew stats:", stats)
+
+    assert len(result) == len(expected)
+    assert dict(result) == expected
+    assert list(stats["hot_keys"]) == ["enterprise"]
+    assert stats["top_key_share"] == pytest.approx(0.9, abs=0.05)
+    assert stats["max_key_load_after"] < stats["max_key_load_before"]
+
+
+def test_salted_reduce_without_hot_keys(monkeypatch, context):
+    monkeypatch.setenv("RATE_createOrder", "0.25")
+    lines = [f"2025-05-02T00:00:00Z user{i % 10} createOrder 201 10ms" for i in range(100)]
+    pairs = map_records(context.parallelize(lines, 1))
+    totals, stats = salted_reduce(pairs, reduce_records, salts=4, sample_fraction=0.5, seed=1)
+    assert stats["hot_keys"] == {}
+    assert stats["salts"] == 1
+    assert dict(totals.collect()) == {f"user{i}": (100, 25_000_000) for i in range(10)}
+
+
+def test_salted_reduce_shuffles_only_hot_keys_twice(monkeypatch):
+    from mapreduce_billing.engines import SerialContext
+    monkeypatch.setenv("RATE_login", "0.5")
+    monkeypatch.setenv("RATE_createOrder", "0.25")
+    sc = SerialContext(4)
+    shuffled = []
+
+    def shuffle(parent, func, num_partitions, shuffle=sc._shuffle):
+        shuffled.append(parent.collect())
+        return shuffle(parent, func, num_partitions)
+
+    monkeypatch.setattr(sc, "_shuffle", shuffle)
+    pairs = map_records(sc.parallelize(skewed_lines(), 4))
+    totals, stats = salted_reduce(pairs, reduce_records, salts=4, sample_fraction=0.1, seed=1)
+    assert len(dict(totals.collect())) == 101
+
+    first, second = shuffled
+    print("Records into each reduce:", [len(records) for records in shuffled])
+    assert len(first) == 1000
+    # Cold users are final after the first reduce
+    assert {key for key, _ in second} == {"enterprise"}
+    assert len(second) <= 4 * 4
+
+
+def test_salted_reduce_maps_only_sampled_lines(monkeypatch, context):
+    monkeypatch.setenv("RATE_login", "0.5")
+    monkeypatch.setenv("RATE_createOrder", "0.25")
+    lines = context.parallelize(skewed_lines(), 4)
+    counters = LineCounters(context)
+    pairs = map_records(lines)
+
+    sample = lines.sample(False, 0.1, seed=1)
+    totals, stats = salted_reduce(
+        pairs, reduce_records, salts=4, sample_fraction=0.1,
+        sample_rdd=map_records(sample, counters=counters)
+    )
+    print("Sampled lines mapped:", counters.records.value)
+    assert counters.records.value == sample.count() < 200
+    assert list(stats["hot_keys"]) == ["enterprise"]
+    assert dict(totals.collect()) == dict(pairs.reduceByKey(reduce_records).collect())
+
+
+def test_build_user_totals_skew_with_parquet_input(monkeypatch, context):
+    import argparse
+    import logging
+    from types import SimpleNamespace
+    from mapreduce_billing import spark_job
+
+    monkeypatch.setenv("RATE_login", "0.5")
+    monkeypatch.setenv("RATE_createOrder", "0.25")
+    records = [("enterprise", "login", i % 7 + 1) for i in range(900)]
+    records += [(f"user{i}", "createOrder", i + 1) for i in range(100)]
+    columns = SimpleNamespace(rdd=context.parallelize(records, 4))
+    monkeypatch.setattr(spark_job, "read_billing_columns", lambda spark, path: columns)
+    args = argparse.Namespace(
+        state_dir=None, input_format="parquet", engine="rdd", input_path="billing.parquet",
+        skew_salts=4, skew_sample_fraction=0.5, on_error="fail",
+    )
+
+    totals = spark_job.build_user_totals(
+        SimpleNamespace(sparkContext=context), args, logging.getLogger(__name__),
+        {"shuffle_partitions": 4}, None, None
+    )
+    expected = dict(
+        map_records(context.parallelize(skewed_lines())).reduceByKey(reduce_records).collect()
+    )
+    assert dict(totals.collect()) == expected
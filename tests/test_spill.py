@@ -0,0 +1,123 @@
+# tests/test_spill.py
+import os
+import pytest
+from mapreduce_billing.naive_aggregation import aggregate_naive
+from mapreduce_billing.spill import SpillingAccumulator, aggregate_spilling
+from utils.log_generator import generate_logs
+
+
+def test_accumulator_merges_runs(tmp_path):
+    with SpillingAccumulator(memory_budget=400, spill_dir=str(tmp_path)) as acc:
+        for i in range(30):
+            acc.add(f"user{i % 10}".encode("utf-8"), i, 10 * i)
+        acc.add("zoë", 1, 2)
+        print("Runs:", acc.runs)
+        assert len(acc.runs) > 1
+
+        items = list(acc.sorted_items())
+        assert [user for user, _, _ in items] == sorted(f"user{i}" for i in range(10)) + ["zoë"]
+        assert items[0] == ("user0", 0 + 10 + 20, 10 * (0 + 10 + 20))
+        assert items[-1] == ("zoë", 1, 2)
+        # Iterable again until closed
+        assert list(acc.sorted_items()) == items
+        spill_dirs = list(tmp_path.iterdir())
+        assert len(spill_dirs) == 1
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_accumulator_without_spill():
+    with SpillingAccumulator() as acc:
+        acc.add(b"b", 1, 1)
+        acc.add(b"a", 2, 2)
+        acc.add(b"b", 3, 3)
+        assert acc.runs == []
+        assert list(acc.sorted_items()) == [("a", 2, 2), ("b", 4, 4)]
+    with pytest.raises(ValueError):
+        SpillingAccumulator(memory_budget=0)
+
+
+def test_accumulator_totals_beyond_int64(tmp_path):
+    big = 2 ** 62
+    with SpillingAccumulator(memory_budget=300, spill_dir=str(tmp_path)) as acc:
+        acc.add(b"huge", 1, 2 ** 70)
+        for i in range(20):
+            acc.add(b"user%d" % (i % 5), big, big)
+        acc.add(b"huge", 1, 1)
+        print("Runs:", acc.runs)
+        assert len(acc.runs) > 1
+
+        items = dict((user, (duration, cost)) for user, duration, cost in acc.sorted_items())
+        assert items["huge"] == (2, 2 ** 70 + 1)
+        assert items["user0"] == (4 * big, 4 * big)
+
+
+def test_aggregate_spilling_overflowing_costs(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    # One user's totals overflow within a run while the others force spills
+    lines = [
+        f"2025-05-02T00:00:00Z {'whale' if i % 2 else f'user{i}'} login 200 999999999999999ms"
+        for i in range(3000)
+    ]
+    log_path = tmp_path / "api_logs.txt"
+    log_path.write_text("\n".join(lines) + "\n")
+
+    expected = [
+        (user, m["total_duration_ms"], m["total_cost_micros"])
+        for user, m in sorted(aggregate_naive(str(log_path)).items())
+    ]
+    assert max(cost for _, _, cost in expected) > 2 ** 63
+    with aggregate_spilling(str(log_path), memory_budget=64 * 1024, spill_dir=str(tmp_path)) as acc:
+        print("Spilled runs:", len(acc.runs))
+        assert len(acc.runs) > 1
+        assert list(acc.sorted_items()) == expected
+
+
+def test_aggregate_spilling_matches_naive(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    monkeypatch.setenv("RATE_createOrder", "0.010")
+    log_path = str(tmp_path / "api_logs.txt")
+    generate_logs(log_path, 5000, users=2000, seed=7)
+
+    expected = [
+        (user, m["total_duration_ms"], m["total_cost_micros"])
+        for user, m in sorted(aggregate_naive(log_path).items())
+    ]
+    spill_dir = tmp_path / "spill"
+    spill_dir.mkdir()
+    with aggregate_spilling(log_path, memory_budget=16 * 1024, spill_dir=str(spill_dir)) as acc:
+        print("Spilled runs:", len(acc.runs))
+        assert len(acc.runs) >= 5
+        assert all(os.path.getsize(run) > 0 for run in acc.runs)
+        assert list(acc.sorted_items()) == expected
+    assert list(spill_dir.iterdir()) == []
+
+
+def test_aggregate_spilling_cleans_up_on_error(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    log_path = tmp_path / "api_logs.txt"
+    log_path.write_text("2025-05-02T00:00:00Z user1 login 200 100ms\n" * 50 + "broken line\n")
+    with pytest.raises(ValueError, match="Invalid log line"):
+        aggregate_spilling(str(log_path), memory_budget=1, spill_dir=str(tmp_path))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["api_logs.txt"]
+
+
+def test_aggregate_spilling_stays_within_budget(monkeypatch, tmp_path):
+    import tracemalloc
+    monkeypatch.setenv("RATE_login", "0.005")
+    log_path = str(tmp_path / "api_logs.txt")
+    generate_logs(log_path, 60000, users=50000, skew=0.3, seed=5)
+    budget = 2 * 1024 * 1024
+
+    tracemalloc.start()
+    try:
+        with aggregate_spilling(log_path, memory_budget=budget, spill_dir=str(tmp_path)) as acc:
+            users = sum(1 for _ in acc.sorted_items())
+            runs = len(acc.runs)
+            peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    print(f"Runs: {runs}, users: {users}, peak: {peak / 2**20:.1f} MiB")
+    assert runs > 1 and users > 30000
+    # The budget is approximate, not a hard limit
+    assert peak < budget * 1.2
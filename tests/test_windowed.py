@@ -0,0 +1,123 @@
+# tests/test_windowed.py
+import pytest
+from mapreduce_billing.naive_aggregation import aggregate_naive
+from mapreduce_billing.windowed import (
+    aggregate_windowed, bucket_key, coarsen, map_windowed_records, read_rollup,
+    reduce_windowed, rollup_user_totals, user_totals, window_totals, write_rollup,
+)
+
+
+LINES = [
+    "2025-05-02T00:10:00Z user1 login 200 100ms",
+    "2025-05-02T00:50:00Z user1 login 200 300ms",
+    "2025-05-02T01:05:00Z user1 createOrder 201 200ms",
+    "2025-05-03T09:00:00Z user2 login 200 50ms",
+]
+
+
+def create_temp_log(tmp_path, lines):
+    """
+    Helper to write a temporary log file and return its path.
+    """
+    log_file = tmp_path / "api_logs.txt"
+    log_file.write_text("\n".join(lines))
+    return str(log_file)
+
+
+@pytest.mark.parametrize("timestamp, granularity, expected", [
+    ("2025-05-02T23:16:50Z", "hour", "2025-05-02T23"),
+    ("2025-05-02T23:16:50Z", "day", "2025-05-02"),
+    ("2025-05-02T23:16:50Z", "month", "2025-05"),
+    ("2025-05-02T23:16:50.125Z", "minute", "2025-05-02T23:16"),
+    ("2025-05-03T01:16:50+02:00", "hour", "2025-05-02T23"),
+])
+def test_bucket_key(timestamp, granularity, expected):
+    assert bucket_key(timestamp, granularity) == expected
+
+
+def test_bucket_key_invalid():
+    with pytest.raises(ValueError, match="Invalid timestamp"):
+        bucket_key("yesterday", "hour")
+
+
+def test_map_reduce_windowed_hourly(monkeypatch, context):
+    monkeypatch.setenv("RATE_login", "0.005")
+    monkeypatch.setenv("RATE_createOrder", "0.010")
+
+    rollup = dict(
+        map_windowed_records(context.parallelize(LINES, 2), "hour")
+        .reduceByKey(reduce_windowed)
+        .collect()
+    )
+    print("Hourly rollup:", rollup)
+    assert rollup[("2025-05-02T00", "user1", "login")] == (2, 400, 2_000_000)
+    assert rollup[("2025-05-02T01", "user1", "createOrder")] == (1, 200, 2_000_000)
+    assert rollup[("2025-05-03T09", "user2", "login")] == (1, 50, 250_000)
+
+    totals = dict(rollup_user_totals(context.parallelize(list(rollup.items()), 2)).collect())
+    assert totals["user1"] == (600, 4_000_000)
+
+
+def test_aggregate_windowed_matches_billing(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    monkeypatch.setenv("RATE_createOrder", "0.010")
+    log_path = create_temp_log(tmp_path, LINES)
+
+    totals = user_totals(aggregate_windowed(log_path, "minute"))
+    expected = aggregate_naive(log_path)
+    for user, metrics in expected.items():
+        assert totals[user][0] == metrics["total_duration_ms"]
+        assert totals[user][1] == metrics["total_cost_micros"]
+
+
+def test_coarser_windows_from_stored_rollup(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    monkeypatch.setenv("RATE_createOrder", "0.010")
+    log_path = create_temp_log(tmp_path, LINES)
+    rollup_path = str(tmp_path / "rollup.csv")
+
+    hourly = aggregate_windowed(log_path, "hour")
+    write_rollup(rollup_path, hourly.items())
+    stored = read_rollup(rollup_path)
+    assert stored == hourly
+
+    daily = coarsen(stored, "day")
+    assert daily == aggregate_windowed(log_path, "day")
+    assert window_totals(stored, start="2025-05-02", end="2025-05-03", user="user1") == (
+        3, 600, 4_000_000
+    )
+    assert window_totals(stored, start="2025-05-02T01", task="login") == (1, 50, 250_000)
+
+    with pytest.raises(ValueError, match="Cannot derive"):
+        coarsen(daily, "hour")
+
+
+def test_read_rollup_from_part_files(monkeypatch, tmp_path):
+    monkeypatch.setenv("RATE_login", "0.005")
+    monkeypatch.setenv("RATE_createOrder", "0.010")
+    log_path = create_temp_log(tmp_path, LINES)
+    hourly = aggregate_windowed(log_path, "hour")
+
+    # Same layout as save_rollup_rdd: one CSV with a header per partition
+    items = sorted(hourly.items())
+    parts_dir = tmp_path / "rollup"
+    write_rollup(str(parts_dir / "part-00000"), items[:2])
+    write_rollup(str(parts_dir / "part-00001"), items[2:])
+    (parts_dir / "_SUCCESS").write_text("")
+
+    assert read_rollup(str(parts_dir)) == hourly
+
+
+def test_map_windowed_skip_policy(monkeypatch, context):
+    monkeypatch.setenv("RATE_login", "0.005")
+    lines = LINES + ["yesterday user3 login 200 10ms", "2025-05-02T00:10:00Z user3 login"]
+    with pytest.raises(ValueError, match="Invalid timestamp"):
+        map_windowed_records(context.parallelize(lines), "hour").collect()
+
+    rollup = dict(
+        map_windowed_records(context.parallelize(lines, 2), "hour", on_error="skip")
+        .reduceByKey(reduce_windowed)
+        .collect()
+    )
+    assert not any(user == "user3" for _, user, _ in rollup)
+    assert rollup[("2025-05-02T00", "user1", "login")] == (2, 400, 2_000_000)